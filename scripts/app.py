@@ -7,31 +7,1298 @@ Based on Paul Bourke's equirectangular projection documentation
 import cv2
 import numpy as np
 import base64
-from flask import Flask, request, jsonify
+import hashlib
+import json
+from flask import Flask, Response, request, jsonify, send_file, g
 from flask_cors import CORS
 import sys
+import os
+import resource
 import time
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 
 app = Flask(__name__)
 CORS(app)
 
-def decode_base64_image(base64_string: str) -> np.ndarray:
+_timings_lock = threading.Lock()
+
+@contextmanager
+def timed(timings: dict, stage: str):
+    """
+    Add the wall time of the enclosed block to timings[stage] (no-op if
+    timings is None). Safe to use from the decode threads.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            elapsed = time.perf_counter() - start
+            with _timings_lock:
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def emit_progress(progress, event: str, **fields):
+    """Log a structured progress event to stderr and pass it to the progress callback, if any"""
+    record = {'event': event, **fields}
+    print(json.dumps(record), file=sys.stderr)
+    if progress is not None:
+        progress(record)
+
+# Histogram buckets (seconds / images)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+IMAGE_COUNT_BUCKETS = (2, 4, 8, 12, 16, 24, 32, 48)
+
+class Metrics:
+    """
+    Minimal Prometheus registry: labelled counters and histograms, rendered
+    in the text exposition format by /metrics. Values are per process, so
+    every gunicorn worker reports its own.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = {}
+        self.histograms = {}
+        self.buckets = {}
+    
+    def counter(self, name: str, help_text: str):
+        self.help[name] = ('counter', help_text)
+    
+    def histogram(self, name: str, help_text: str, buckets):
+        self.help[name] = ('histogram', help_text)
+        self.buckets[name] = tuple(buckets)
+    
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.buckets[name]
+        with self.lock:
+            counts, total, count = self.histograms.get(key, ([0] * len(buckets), 0.0, 0))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.histograms[key] = (counts, total + value, count + 1)
+    
+    @staticmethod
+    def format_value(value) -> str:
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+    
+    @staticmethod
+    def format_labels(labels) -> str:
+        if not labels:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+    
+    def render(self, snapshot: dict = None) -> str:
+        """
+        Text exposition of all metrics. snapshot maps name -> (type, help, value)
+        for values read at scrape time (cache counters, memory, queue sizes).
+        """
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(counts), total, count) for key, (counts, total, count) in self.histograms.items()}
+        
+        for name, (kind, help_text) in self.help.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{self.format_labels(labels)} {self.format_value(value)}")
+                continue
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(self.buckets[name], counts):
+                    lines.append(f"{name}_bucket{self.format_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+                lines.append(f"{name}_bucket{self.format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {self.format_value(total)}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+        
+        for name, (kind, help_text, value) in (snapshot or {}).items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {self.format_value(value)}")
+        
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.histogram('stitch_http_request_seconds', 'HTTP request latency by endpoint and status', LATENCY_BUCKETS)
+metrics.histogram('stitch_stage_seconds', 'Seconds spent per stitch stage (see the timings response field)', LATENCY_BUCKETS)
+metrics.histogram('stitch_images_per_request', 'Images in each stitched capture set', IMAGE_COUNT_BUCKETS)
+metrics.counter('stitch_results_total', 'Panoramas returned, by quality tier and whether they came from the result cache')
+metrics.counter('stitch_input_bytes_total', 'Encoded image bytes received')
+metrics.counter('stitch_output_bytes_total', 'Encoded panorama bytes produced')
+metrics.counter('stitch_rejected_total', 'Stitches refused by admission control, by reason')
+
+def record_stitch(meta: dict, timings: dict, jpeg: bytes, cached: bool):
+    """Update the stitch metrics for one finished (or cached) panorama"""
+    for stage, seconds in timings.items():
+        metrics.observe('stitch_stage_seconds', seconds, stage=stage)
+    metrics.observe('stitch_images_per_request', meta.get('imageCount', 0))
+    metrics.inc('stitch_results_total', quality=meta.get('quality', ''), cached=str(cached).lower())
+    metrics.inc('stitch_output_bytes_total', len(jpeg))
+
+def server_timing(timings: dict) -> str:
+    """Server-Timing header value for stage timings in seconds"""
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+# Uploads wider than this are downsized before stitching
+MAX_SOURCE_WIDTH = 1080
+
+# JPEG start-of-frame markers (SOF0-SOF15 minus DHT, JPG and DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def jpeg_dimensions(img_bytes: bytes):
+    """Read (width, height) from a JPEG header without decoding; None if not a JPEG"""
+    if img_bytes[:2] != b'\xff\xd8':
+        return None
+    
+    i = 2
+    while i + 9 <= len(img_bytes):
+        if img_bytes[i] != 0xFF:
+            return None
+        marker = img_bytes[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # Standalone markers
+            i += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height = int.from_bytes(img_bytes[i + 5:i + 7], 'big')
+            width = int.from_bytes(img_bytes[i + 7:i + 9], 'big')
+            return width, height
+        i += 2 + int.from_bytes(img_bytes[i + 2:i + 4], 'big')
+    return None
+
+def image_dimensions(img_bytes: bytes):
+    """(width, height) from a JPEG or PNG header without decoding; None if unknown"""
+    if img_bytes[:8] == b'\x89PNG\r\n\x1a\n' and len(img_bytes) >= 24:
+        return int.from_bytes(img_bytes[16:20], 'big'), int.from_bytes(img_bytes[20:24], 'big')
+    return jpeg_dimensions(img_bytes)
+
+def reduced_decode_flag(img_bytes: bytes, max_width: int) -> int:
+    """
+    Pick the largest IMREAD_REDUCED_COLOR_* factor that still leaves at least
+    max_width pixels, so JPEGs are downscaled inside the decoder.
+    
+    The shorter side is used since EXIF orientation may swap width and height.
+    """
+    dims = jpeg_dimensions(img_bytes)
+    if dims is None:
+        return cv2.IMREAD_COLOR
+    
+    short_side = min(dims)
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                         (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if short_side // factor >= max_width:
+            return flag
+    return cv2.IMREAD_COLOR
+
+def decode_image_bytes(img_bytes: bytes, max_width: int = None) -> np.ndarray:
+    """
+    Decode raw JPEG/PNG bytes to OpenCV format (the buffer is not copied).
+    
+    With max_width set, large JPEGs are decoded at 1/2, 1/4 or 1/8 scale while
+    still at least max_width wide; the caller resizes the remainder.
+    """
+    flags = cv2.IMREAD_COLOR if max_width is None else reduced_decode_flag(img_bytes, max_width)
+    nparr = np.frombuffer(img_bytes, np.uint8)
+    img = cv2.imdecode(nparr, flags)
+    return img
+
+def decode_base64_image(base64_string: str, max_width: int = None) -> np.ndarray:
     """Decode a base64 image string to OpenCV format"""
     if ',' in base64_string:
         base64_string = base64_string.split(',')[1]
-    img_bytes = base64.b64decode(base64_string)
-    nparr = np.frombuffer(img_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    return decode_image_bytes(base64.b64decode(base64_string), max_width)
+
+def read_stitch_request():
+    """
+    Collect (image source, azimuth, elevation) for every uploaded image plus
+    the remaining request options (quality, timeBudget, ...).
+    
+    multipart/form-data: repeated binary 'images' parts plus a 'manifest' JSON
+    field {"images": [{"azimuth": .., "elevation": ..}, ...]} in the same order.
+    application/json: {"images": [{"data": <base64 data URL>, "azimuth": .., "elevation": ..}]}
+    
+    The image source is raw bytes for multipart parts and the base64 string for
+    JSON, so JSON payloads are only decoded one image at a time. Malformed
+    bodies raise ValueError.
+    """
+    if request.mimetype == 'multipart/form-data':
+        files = request.files.getlist('images')
+        manifest = json.loads(request.form.get('manifest') or '{}')
+        if not isinstance(manifest, dict):
+            raise ValueError('manifest must be a JSON object')
+        poses = request_images(manifest)
+        if len(poses) != len(files):
+            raise ValueError(f"Manifest lists {len(poses)} poses for {len(files)} images")
+        uploads = [(f.read(), pose.get('azimuth', 0), pose.get('elevation', 0))
+                   for f, pose in zip(files, poses)]
+        return uploads, manifest
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object or multipart/form-data')
+    images_data = request_images(data)
+    if not all(isinstance(img_data.get('data'), str) for img_data in images_data):
+        raise ValueError('Every image needs its base64 data')
+    uploads = [(img_data['data'], img_data.get('azimuth', 0), img_data.get('elevation', 0))
+               for img_data in images_data]
+    return uploads, data
+
+def request_images(body: dict) -> list:
+    """Pop the 'images' list of a request body, checking each entry is an object with numeric angles"""
+    images = body.pop('images', [])
+    if not isinstance(images, list):
+        raise ValueError('images must be a list')
+    for index, image in enumerate(images):
+        if not isinstance(image, dict):
+            raise ValueError(f"images[{index}] must be an object")
+        for angle in ('azimuth', 'elevation'):
+            try:
+                float(image.get(angle, 0))
+            except (TypeError, ValueError):
+                raise ValueError(f"images[{index}].{angle} must be a number") from None
+    return images
+
+def decode_upload(source, max_width: int = None) -> np.ndarray:
+    """Decode an image source returned by read_stitch_request"""
+    if isinstance(source, str):
+        return decode_base64_image(source, max_width)
+    return decode_image_bytes(source, max_width)
+
+def prepare_upload(source, max_width: int = MAX_SOURCE_WIDTH, timings: dict = None):
+    """
+    Decode, validate and downsize one upload; returns None if it can't be
+    decoded. Seconds spent in resize (summed over threads) go to timings.
+    """
+    img = decode_upload(source, max_width)
+    if img is None or img.size == 0:
+        return None
+    
+    # Resize large images to save memory
+    h, w = img.shape[:2]
+    if w > max_width:
+        scale = max_width / w
+        with timed(timings, 'resize'):
+            img = cv2.resize(img, (int(w * scale), int(h * scale)))
+    
+    # NOTE: Don't flip here - the U coordinate flip in projection handles it
     return img
 
+# cv2.imdecode and cv2.resize release the GIL, so threads decode in parallel.
+# Created on first use so each gunicorn worker gets its own threads after fork.
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', min(os.cpu_count() or 1, 8)))
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
+def get_decode_pool() -> ThreadPoolExecutor:
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(max_workers=max(DECODE_WORKERS, 1), thread_name_prefix='decode')
+        return _decode_pool
+
+def prepare_uploads(sources, max_width: int = MAX_SOURCE_WIDTH, timings: dict = None) -> list:
+    """Decode all uploads concurrently, keeping input order"""
+    return list(get_decode_pool().map(lambda source: prepare_upload(source, max_width, timings), sources))
+
+def upload_digest(source):
+    """Raw image bytes of an upload and their SHA-256 hex digest"""
+    if isinstance(source, str):
+        source = base64.b64decode(source.split(',')[1] if ',' in source else source)
+    return source, hashlib.sha256(source).hexdigest()
+
+def digest_uploads(sources) -> list:
+    """(raw bytes, digest) for every upload, computed concurrently in input order"""
+    return list(get_decode_pool().map(upload_digest, sources))
+
+def encode_jpeg(img: np.ndarray, quality: int = 90, progressive: bool = False) -> bytes:
+    """Encode OpenCV image to JPEG bytes (baseline, or progressive)"""
+    _, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality,
+                                           cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)])
+    return buffer.tobytes()
+
+def jpeg_data_url(jpeg: bytes) -> str:
+    base64_string = base64.b64encode(jpeg).decode('utf-8')
+    return f"data:image/jpeg;base64,{base64_string}"
+
 def encode_image_base64(img: np.ndarray, quality: int = 90) -> str:
     """Encode OpenCV image to base64 string"""
-    encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
-    _, buffer = cv2.imencode('.jpg', img, encode_params)
-    base64_string = base64.b64encode(buffer).decode('utf-8')
-    return f"data:image/jpeg;base64,{base64_string}"
+    return jpeg_data_url(encode_jpeg(img, quality))
+
+def camera_basis(az_deg: float, el_deg: float):
+    """Forward, right and up unit vectors for a camera at (azimuth, elevation)"""
+    az = np.radians(az_deg)
+    el = np.radians(el_deg)
+    
+    # Forward vector: direction camera is looking
+    cam_fwd = np.array([
+        np.cos(el) * np.sin(az),  # X
+        np.sin(el),               # Y
+        np.cos(el) * np.cos(az)   # Z
+    ])
+    
+    # Right vector: perpendicular to forward, in horizontal plane
+    # For azimuth rotation: right = (cos(az), 0, -sin(az))
+    cam_right = np.array([
+        np.cos(az),   # X
+        0,            # Y
+        -np.sin(az)   # Z
+    ])
+    
+    # Up vector: perpendicular to both forward and right
+    # This tilts with elevation
+    cam_up = np.array([
+        -np.sin(el) * np.sin(az),  # X
+        np.cos(el),                # Y
+        -np.sin(el) * np.cos(az)   # Z
+    ])
+    
+    return cam_fwd, cam_right, cam_up
+
+# Working memory for one stitch (accumulators and projection temporaries, not
+# the decoded sources or the result). Canvases that don't fit are rendered in strips.
+MAX_STITCH_MEMORY_MB = int(os.environ.get('MAX_STITCH_MEMORY_MB', 128))
+
+# Approximate working bytes per canvas pixel: projection temporaries while
+# building remap maps, and accumulators plus per-tile temporaries while blending
+PROJECTION_BYTES_PER_PIXEL = 96
+STRIP_BYTES_PER_PIXEL = {'feather': 32, 'multiband': 64}
+
+@lru_cache(maxsize=8)
+def sphere_axes(out_width: int, out_height: int):
+    """
+    Sine and cosine of the longitude of every canvas column and the latitude
+    of every canvas row (float32). The ray direction of pixel (x, y) is
+    (cos_lat[y] * sin_lon[x], sin_lat[y], cos_lat[y] * cos_lon[x]).
+    
+    Standard equirectangular: longitude spans -180° to +180°, latitude spans +90° to -90°
+    longitude (azimuth): -180° at x=0, 0° at x=width/2, +180° at x=width
+    """
+    px = np.arange(out_width, dtype=np.float32)
+    py = np.arange(out_height, dtype=np.float32)
+    
+    lon_rad = np.radians((px / out_width - 0.5) * 360.0)  # -180 to +180 degrees
+    lat_rad = np.radians((0.5 - py / out_height) * 180.0)  # +90 to -90 degrees
+    
+    # Shared between requests - keep them read-only
+    axes = (np.sin(lon_rad), np.cos(lon_rad), np.sin(lat_rad), np.cos(lat_rad))
+    for arr in axes:
+        arr.setflags(write=False)
+    return axes
+
+def sphere_window(out_width: int, out_height: int, y0: int, y1: int, x0: int, x1: int):
+    """
+    Unit ray directions for canvas rows y0:y1 and columns x0:x1.
+    
+    Using convention: X=right, Y=up, Z=forward; longitude=0 points to +Z
+    (forward), longitude=90° points to +X (right). out_y is returned as a
+    column (it only depends on the row) and broadcasts against the others.
+    """
+    sin_lon, cos_lon, sin_lat, cos_lat = sphere_axes(out_width, out_height)
+    cos_lat = cos_lat[y0:y1, np.newaxis]
+    out_x = cos_lat * sin_lon[np.newaxis, x0:x1]  # Right/left
+    out_y = sin_lat[y0:y1, np.newaxis]             # Up/down
+    out_z = cos_lat * cos_lon[np.newaxis, x0:x1]  # Forward/back
+    return out_x, out_y, out_z
+
+def footprint_windows(cam_fwd, cam_right, cam_up, h_fov: float, v_fov: float,
+                      out_width: int, out_height: int, lon_origin: float = -180.0,
+                      samples: int = 64, margin: int = 2):
+    """
+    Pixel windows (y0, y1, x0, x1) of the equirectangular canvas that contain a camera's footprint.
+    
+    The FOV is a rectangle on the tangent plane, so its outline is traced in
+    camera space and rotated onto the sphere. Latitude and longitude extremes
+    of a region lie on its outline unless it contains a pole; poles are tested
+    directly and widen the window to the full longitude range. A footprint
+    crossing the ±180° seam is split into two windows.
+    """
+    tan_h = np.tan(np.radians(h_fov / 2))
+    tan_v = np.tan(np.radians(v_fov / 2))
+    
+    # Outline of the FOV rectangle on the image plane, walked as one closed loop
+    t = np.linspace(-1, 1, samples, endpoint=False)
+    ones = np.ones(samples)
+    edge_x = np.concatenate([t, ones, -t, -ones]) * tan_h
+    edge_y = np.concatenate([-ones, t, ones, -t]) * tan_v
+    dirs = np.outer(edge_x, cam_right) + np.outer(edge_y, cam_up) + cam_fwd
+    dirs /= np.linalg.norm(dirs, axis=1, keepdims=True)
+    
+    lat = np.degrees(np.arcsin(np.clip(dirs[:, 1], -1, 1)))
+    lat_min, lat_max = lat.min(), lat.max()
+    
+    # A pole is inside the footprint if it projects inside the FOV rectangle
+    full_width = False
+    for sign in (1, -1):
+        fwd = sign * cam_fwd[1]
+        if fwd > 0.01 and abs(sign * cam_right[1] / fwd) <= tan_h and abs(sign * cam_up[1] / fwd) <= tan_v:
+            full_width = True
+            if sign > 0:
+                lat_max = 90.0
+            else:
+                lat_min = -90.0
+    
+    y0 = max(int(np.floor((90 - lat_max) / 180 * out_height)) - margin, 0)
+    y1 = min(int(np.ceil((90 - lat_min) / 180 * out_height)) + margin + 1, out_height)
+    
+    if not full_width:
+        lon = np.unwrap(np.degrees(np.arctan2(dirs[:, 0], dirs[:, 2])), period=360)
+        # Longitude moves fast near the poles - pad by the largest step between outline samples
+        pad = np.abs(np.diff(lon)).max()
+        lon_min = lon.min() - pad
+        lon_max = lon.max() + pad
+        x0 = int(np.floor((lon_min - lon_origin) / 360 * out_width)) - margin
+        x1 = int(np.ceil((lon_max - lon_origin) / 360 * out_width)) + margin + 1
+        full_width = x1 - x0 >= out_width
+    
+    if full_width:
+        return [(y0, y1, 0, out_width)]
+    
+    # Shift into [0, width) and split at the seam
+    shift = (x0 // out_width) * out_width
+    x0 -= shift
+    x1 -= shift
+    if x1 <= out_width:
+        return [(y0, y1, x0, x1)]
+    return [(y0, y1, x0, out_width), (y0, y1, 0, x1 - out_width)]
 
-def stitch_equirectangular(images, azimuths, elevations):
+def camera_angles(out_width: int, out_height: int, y0: int, y1: int, x0: int, x1: int,
+                  cam_fwd, cam_right, cam_up, h_fov: float, v_fov: float):
+    """
+    Horizontal and vertical angles (radians) of the canvas rays in rows
+    y0:y1 and columns x0:x1 from a camera's axis, and the mask of rays
+    inside its FOV
+    """
+    # FOV half-angles for boundary check
+    h_fov_half = np.radians(h_fov / 2)
+    v_fov_half = np.radians(v_fov / 2)
+    
+    win_x, win_y, win_z = sphere_window(out_width, out_height, y0, y1, x0, x1)
+    
+    # For each output pixel direction, compute projection onto this camera's image plane
+    # Dot products with camera basis (vectorized)
+    dot_fwd = win_x * cam_fwd[0] + win_y * cam_fwd[1] + win_z * cam_fwd[2]
+    dot_right = win_x * cam_right[0] + win_y * cam_right[1] + win_z * cam_right[2]
+    dot_up = win_x * cam_up[0] + win_y * cam_up[1] + win_z * cam_up[2]
+    
+    # Only consider pixels that are in front of the camera
+    in_front = dot_fwd > 0.01
+    
+    # Perspective projection: project 3D point onto image plane
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Angles from camera center
+        angle_h = np.where(in_front, np.arctan2(dot_right, dot_fwd), 999)
+        angle_v = np.where(in_front, np.arctan2(dot_up, dot_fwd), 999)
+    
+    # Check if within camera FOV
+    in_fov = in_front & (np.abs(angle_h) < h_fov_half) & (np.abs(angle_v) < v_fov_half)
+    return angle_h, angle_v, in_fov
+
+def project_window(out_width: int, out_height: int, y0: int, y1: int, x0: int, x1: int,
+                   cam_fwd, cam_right, cam_up, h_fov: float, v_fov: float, img_w: int, img_h: int):
+    """Remap maps, feather weights and in-FOV pixel count for one canvas window (see build_projection)"""
+    h_fov_half = np.radians(h_fov / 2)
+    v_fov_half = np.radians(v_fov / 2)
+    angle_h, angle_v, in_fov = camera_angles(out_width, out_height, y0, y1, x0, x1,
+                                             cam_fwd, cam_right, cam_up, h_fov, v_fov)
+    
+    # Convert angle to image UV coordinates (0 to 1)
+    # Center of image = angle 0, edges = ±FOV/2
+    # No flip needed for test images
+    u = 0.5 + (angle_h / h_fov_half) * 0.5
+    v = 0.5 - (angle_v / v_fov_half) * 0.5  # Top of image = positive angle
+    
+    # Feathering weight based on distance from edge
+    edge_u = np.minimum(u, 1 - u)
+    edge_v = np.minimum(v, 1 - v)
+    edge_dist = np.minimum(edge_u, edge_v)
+    # Normalize to 0-1 range over 20% feather zone
+    feather = np.clip(edge_dist / 0.2, 0, 1)
+    # Smoothstep for nicer blending
+    feather = feather * feather * (3 - 2 * feather)
+    weight = np.where(in_fov, feather, 0).astype(np.float32)
+    
+    # Convert UV to pixel coordinates
+    map_x = np.clip(u * (img_w - 1), 0, img_w - 1).astype(np.float32)
+    map_y = np.clip(v * (img_h - 1), 0, img_h - 1).astype(np.float32)
+    
+    # Compact fixed-point format: half the memory of float maps and faster remap
+    map1, map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    
+    return map1, map2, weight, int(np.count_nonzero(in_fov))
+
+def build_projection(out_width: int, out_height: int, h_fov: float, v_fov: float,
+                     img_az: float, img_el: float, img_w: int, img_h: int, rows: tuple = None):
+    """
+    Compute the remap maps and feather weights that place one camera on the canvas.
+    
+    Only the windows covering the camera footprint (and, if given, canvas rows
+    rows[0]:rows[1]) are computed, in row chunks so the float temporaries stay
+    within MAX_STITCH_MEMORY_MB. Returns (tiles, pixels) where each tile is
+    (y0, y1, x0, x1, map1, map2, weight): map1/map2 are OpenCV fixed-point maps
+    (CV_16SC2 + interpolation table) and weight is zero outside the camera FOV.
+    """
+    cam_fwd, cam_right, cam_up = camera_basis(img_az, img_el)
+    row0, row1 = rows or (0, out_height)
+    chunk_pixels = max(MAX_STITCH_MEMORY_MB * 1024 * 1024 // 2 // PROJECTION_BYTES_PER_PIXEL, out_width)
+    
+    tiles = []
+    pixels = 0
+    for y0, y1, x0, x1 in footprint_windows(cam_fwd, cam_right, cam_up, h_fov, v_fov, out_width, out_height):
+        y0, y1 = max(y0, row0), min(y1, row1)
+        if y0 >= y1:
+            continue
+        map1 = np.empty((y1 - y0, x1 - x0, 2), dtype=np.int16)
+        map2 = np.empty((y1 - y0, x1 - x0), dtype=np.uint16)
+        weight = np.empty((y1 - y0, x1 - x0), dtype=np.float32)
+        chunk_rows = max(chunk_pixels // (x1 - x0), 1)
+        for cy0 in range(y0, y1, chunk_rows):
+            cy1 = min(cy0 + chunk_rows, y1)
+            chunk = slice(cy0 - y0, cy1 - y0)
+            map1[chunk], map2[chunk], weight[chunk], in_fov_pixels = project_window(
+                out_width, out_height, cy0, cy1, x0, x1, cam_fwd, cam_right, cam_up, h_fov, v_fov, img_w, img_h)
+            pixels += in_fov_pixels
+        
+        tiles.append((y0, y1, x0, x1, map1, map2, weight))
+    
+    return tiles, pixels
+
+class ProjectionCache:
+    """
+    LRU cache of per-camera projections, bounded by total bytes.
+    
+    The capture rig shoots the same poses at the same source sizes, so repeat
+    stitches only pay for cv2.remap and accumulation.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def entry_bytes(entry) -> int:
+        tiles, _ = entry
+        return sum(map1.nbytes + map2.nbytes + weight.nbytes for *_, map1, map2, weight in tiles)
+    
+    @staticmethod
+    def key(out_width: int, out_height: int, h_fov: float, v_fov: float,
+            img_az: float, img_el: float, img_w: int, img_h: int):
+        return (out_width, out_height, float(h_fov), float(v_fov),
+                round(float(img_az), 3), round(float(img_el), 3), img_w, img_h)
+    
+    def peek(self, *pose):
+        """Cached projection for a pose, or None (nothing is built or counted as a miss)"""
+        key = self.key(*pose)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return entry
+    
+    def get(self, out_width: int, out_height: int, h_fov: float, v_fov: float,
+            img_az: float, img_el: float, img_w: int, img_h: int):
+        key = self.key(out_width, out_height, h_fov, v_fov, img_az, img_el, img_w, img_h)
+        
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        
+        entry = build_projection(out_width, out_height, h_fov, v_fov, img_az, img_el, img_w, img_h)
+        for *_, map1, map2, weight in entry[0]:
+            for arr in (map1, map2, weight):
+                arr.setflags(write=False)
+        size = self.entry_bytes(entry)
+        
+        with self.lock:
+            if size <= self.max_bytes and key not in self.entries:
+                self.entries[key] = entry
+                self.current_bytes += size
+                while self.current_bytes > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.current_bytes -= self.entry_bytes(evicted)
+                    self.evictions += 1
+        
+        return entry
+    
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+projection_cache = ProjectionCache(int(os.environ.get('PROJECTION_CACHE_MB', 128)) * 1024 * 1024)
+
+class MultiBandBlender:
+    """
+    Laplacian pyramid (multi-band) blending into per-band canvas accumulators.
+    
+    Low frequencies are blended over wide transitions and high frequencies over
+    narrow ones, which hides seams and exposure steps that feathering smears.
+    Each camera's pyramid is built only over its footprint window (padded and
+    aligned so every level lines up with the canvas), so per-camera memory
+    scales with the footprint rather than the canvas. The accumulators add
+    about a third on top of the feather blender's output/weights buffers.
+    
+    rows limits the accumulators to canvas rows rows[0]:rows[1] (multiples of
+    2**bands, see usable_bands) for strip rendering.
+    """
+    
+    def __init__(self, out_width: int, out_height: int, bands: int = 5, rows: tuple = None):
+        bands = self.usable_bands(out_width, out_height, bands)
+        self.bands = bands
+        self.width = out_width
+        self.height = out_height
+        self.row0, self.row1 = rows or (0, out_height)
+        region = self.row1 - self.row0
+        self.acc = [np.zeros((region >> level, out_width >> level, 3), dtype=np.float32)
+                    for level in range(bands + 1)]
+        self.wacc = [np.zeros((region >> level, out_width >> level), dtype=np.float32)
+                     for level in range(bands + 1)]
+    
+    @staticmethod
+    def usable_bands(out_width: int, out_height: int, bands: int) -> int:
+        """Largest band count <= bands for which every level divides the canvas evenly"""
+        while bands > 0 and (out_width % (1 << bands) or out_height % (1 << bands)):
+            bands -= 1
+        return bands
+    
+    def feed(self, sampled: np.ndarray, weight: np.ndarray, y0: int, y1: int, x0: int, x1: int):
+        """Blend one remapped tile covering canvas rows y0:y1 and columns x0:x1"""
+        step = 1 << self.bands
+        pad = 2 * step  # Room for the pyramid filters around the footprint
+        ay0 = max((y0 - pad) // step * step, self.row0)
+        ay1 = min(-(-(y1 + pad) // step) * step, self.row1)
+        ax0 = max((x0 - pad) // step * step, 0)
+        ax1 = min(-(-(x1 + pad) // step) * step, self.width)
+        
+        # Extend the image past the footprint so band edges don't ring into the blend
+        img = cv2.copyMakeBorder(sampled.astype(np.float32), y0 - ay0, ay1 - y1, x0 - ax0, ax1 - x1,
+                                 cv2.BORDER_REPLICATE)
+        wt = cv2.copyMakeBorder(weight, y0 - ay0, ay1 - y1, x0 - ax0, ax1 - x1,
+                                cv2.BORDER_CONSTANT, value=0)
+        
+        for level in range(self.bands + 1):
+            if level < self.bands:
+                down = cv2.pyrDown(img)
+                band = img - cv2.pyrUp(down, dstsize=(img.shape[1], img.shape[0]))
+            else:
+                band = img
+            
+            ly0, ly1 = (ay0 - self.row0) >> level, (ay1 - self.row0) >> level
+            lx0, lx1 = ax0 >> level, ax1 >> level
+            self.acc[level][ly0:ly1, lx0:lx1] += band * wt[:, :, np.newaxis]
+            self.wacc[level][ly0:ly1, lx0:lx1] += wt
+            
+            if level < self.bands:
+                img = down
+                wt = cv2.pyrDown(wt)
+    
+    def preview(self, max_width: int):
+        """
+        Non-destructive low-resolution collapse: only the levels at or below
+        max_width are folded together. Returns (output, weights) at that level.
+        """
+        level = 0
+        while level < self.bands and (self.width >> level) > max_width:
+            level += 1
+        output = None
+        for band_level in range(self.bands, level - 1, -1):
+            w = self.wacc[band_level][:, :, np.newaxis]
+            band = np.divide(self.acc[band_level], w, out=np.zeros_like(self.acc[band_level]), where=w > 1e-5)
+            if output is not None:
+                band += cv2.pyrUp(output, dstsize=(band.shape[1], band.shape[0]))
+            output = band
+        return output, self.wacc[level]
+    
+    def result(self):
+        """
+        Normalize each band and collapse the pyramid in place.
+        Returns (output, weights) where weights is the full-resolution weight sum.
+        """
+        output = None
+        for level in range(self.bands, -1, -1):
+            band = self.acc[level]
+            w = self.wacc[level][:, :, np.newaxis]
+            np.divide(band, w, out=band, where=w > 1e-5)
+            band[np.broadcast_to(w <= 1e-5, band.shape)] = 0
+            if output is not None:
+                band += cv2.pyrUp(output, dstsize=(band.shape[1], band.shape[0]))
+            output = band
+            # Release coarser levels as soon as they're folded in
+            self.acc[level] = None
+            if level > 0:
+                self.wacc[level] = None
+        return output, self.wacc[0]
+
+BLEND_MODES = ('feather', 'multiband')
+
+# Output tiers rendered natively (no upscaling), smallest first.
+# source_width caps decoded uploads: a 40° camera spans about width/9 output
+# pixels, so anything past ~2x that is thrown away by the remap.
+QUALITY_TIERS = OrderedDict([
+    ('preview', {'width': 1024, 'height': 512, 'source_width': 540}),
+    ('standard', {'width': 2048, 'height': 1024, 'source_width': 1080}),
+    ('full', {'width': 4096, 'height': 2048, 'source_width': MAX_SOURCE_WIDTH}),
+])
+
+DEFAULT_TIME_BUDGET = float(os.environ.get('STITCH_TIME_BUDGET', 30))
+
+# Images assumed when the count isn't known yet (sessions): the capture rig's targets
+TYPICAL_IMAGE_COUNT = 16
+
+# Observed stitch cost per canvas megapixel and source image, refined after
+# every stitch (exponential moving average). Each camera's footprint is a
+# fixed share of the canvas, so remapping and accumulating scale with both.
+_cost_lock = threading.Lock()
+_seconds_per_megapixel_image = 0.16
+
+def estimate_stitch_seconds(tier: str, images: int = None) -> float:
+    """Expected stitch time for a tier and image count on this host"""
+    spec = QUALITY_TIERS[tier]
+    images = TYPICAL_IMAGE_COUNT if images is None else images
+    return spec['width'] * spec['height'] / 1e6 * images * _seconds_per_megapixel_image
+
+def record_stitch_seconds(tier: str, images: int, elapsed: float):
+    """Feed an observed stitch time back into the cost estimate"""
+    global _seconds_per_megapixel_image
+    spec = QUALITY_TIERS[tier]
+    observed = elapsed / (spec['width'] * spec['height'] / 1e6 * max(images, 1))
+    with _cost_lock:
+        _seconds_per_megapixel_image = 0.7 * _seconds_per_megapixel_image + 0.3 * observed
+
+def select_quality_tier(quality: str = None, time_budget: float = None, images: int = None) -> str:
+    """
+    Resolve the requested quality to a tier name.
+    
+    An explicit tier is used as-is; 'auto' (the default) picks the largest
+    tier whose estimated stitch time for images (see estimate_stitch_seconds)
+    fits the time budget.
+    """
+    quality = quality or 'auto'
+    if quality != 'auto':
+        if quality not in QUALITY_TIERS:
+            raise ValueError(f"Unknown quality '{quality}' (expected auto, {', '.join(QUALITY_TIERS)})")
+        return quality
+    
+    budget = DEFAULT_TIME_BUDGET if time_budget is None else float(time_budget)
+    for tier in reversed(QUALITY_TIERS):
+        if estimate_stitch_seconds(tier, images) <= budget:
+            return tier
+    return next(iter(QUALITY_TIERS))
+
+class EquirectAccumulator:
+    """
+    Running blend of projected images on an equirectangular canvas.
+    
+    Images can be added one at a time (see /sessions); finish() normalizes,
+    fills gaps and returns the uint8 panorama. With rows, only canvas rows
+    rows[0]:rows[1] are accumulated (see stitch_strips) and normalize()
+    returns that region.
+    """
+    
+    # Camera FOV (after 65% center crop on frontend)
+    h_fov = 40  # degrees
+    v_fov = 55  # degrees
+    
+    def __init__(self, out_width: int, out_height: int, blend: str = 'feather', blend_bands: int = 5,
+                 h_fov: float = None, v_fov: float = None, rows: tuple = None):
+        if blend not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode '{blend}' (expected {', '.join(BLEND_MODES)})")
+        self.width = out_width
+        self.height = out_height
+        self.rows = rows or (0, out_height)
+        self.blend = blend
+        self.image_count = 0
+        if h_fov is not None:
+            self.h_fov = h_fov
+        if v_fov is not None:
+            self.v_fov = v_fov
+        
+        # Initialize output accumulation buffers
+        region = self.rows[1] - self.rows[0]
+        if blend == 'multiband':
+            self.blender = MultiBandBlender(out_width, out_height, blend_bands, self.rows)
+        else:
+            self.output = np.zeros((region, out_width, 3), dtype=np.float32)
+            self.weights = np.zeros((region, out_width), dtype=np.float32)
+    
+    def add(self, img: np.ndarray, img_az: float, img_el: float, timings: dict = None) -> int:
+        """Project one image onto the canvas; returns the number of covered pixels"""
+        img_h, img_w = img.shape[:2]
+        pose = (self.width, self.height, self.h_fov, self.v_fov, img_az, img_el, img_w, img_h)
+        row0, row1 = self.rows
+        with timed(timings, 'projection'):
+            if self.rows == (0, self.height):
+                tiles, pixels = projection_cache.get(*pose)
+            else:
+                # Strips reuse cached projections but don't fill the cache with partial ones
+                entry = projection_cache.peek(*pose)
+                tiles, pixels = entry if entry is not None else build_projection(*pose, rows=self.rows)
+        
+        # Only the camera footprint is touched
+        for y0, y1, x0, x1, map1, map2, w in tiles:
+            if y0 < row0 or y1 > row1:
+                ty0, ty1 = max(y0, row0), min(y1, row1)
+                if ty0 >= ty1:
+                    continue
+                map1, map2, w = (arr[ty0 - y0:ty1 - y0] for arr in (map1, map2, w))
+                y0, y1 = ty0, ty1
+            
+            # Sample image
+            with timed(timings, 'remap'):
+                sampled = cv2.remap(img, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            
+            # Accumulate weighted samples
+            if self.blend == 'multiband':
+                with timed(timings, 'pyramid'):
+                    self.blender.feed(sampled, w, y0, y1, x0, x1)
+            else:
+                with timed(timings, 'accumulate'):
+                    self.output[y0 - row0:y1 - row0, x0:x1] += sampled * w[:, :, np.newaxis]
+                    self.weights[y0 - row0:y1 - row0, x0:x1] += w
+        
+        self.image_count += 1
+        return pixels
+    
+    def preview(self, max_width: int = 512) -> np.ndarray:
+        """Cheap low-resolution normalized view of the current state (gaps left black)"""
+        max_width = min(max_width, self.width)
+        if self.blend == 'multiband':
+            output, weights = self.blender.preview(max_width)
+        else:
+            size = (max_width, max_width * self.height // self.width)
+            output = cv2.resize(self.output, size, interpolation=cv2.INTER_AREA)
+            weights = cv2.resize(self.weights, size, interpolation=cv2.INTER_AREA)
+            w = weights[:, :, np.newaxis]
+            output = np.divide(output, w, out=np.zeros_like(output), where=w > 0.001)
+        if output.shape[1] != max_width:
+            output = cv2.resize(output, (max_width, max_width * self.height // self.width), interpolation=cv2.INTER_AREA)
+        return np.clip(output, 0, 255, out=output).astype(np.uint8)
+    
+    def normalize(self):
+        """
+        Divide by the total weight in place; returns (output, mask) for the
+        accumulated rows, with output 0 where nothing was projected
+        """
+        if self.blend == 'multiband':
+            output, weights = self.blender.result()
+            mask = weights > 0.001
+            output[~mask] = 0
+        else:
+            output, weights = self.output, self.weights
+            mask = weights > 0.001
+            np.divide(output, np.maximum(weights, 0.001)[:, :, np.newaxis], out=output)
+            output[~mask] = 0
+        return output, mask
+    
+    def finish(self, timings: dict = None, progress=None, keep_float: bool = False, gap_fill: str = 'fast'):
+        """
+        Normalize by total weight and fill gaps (see fill_gaps); the
+        accumulator can't be used afterwards. With keep_float, returns (panorama, linear) where
+        linear is the unclipped normalized buffer converted to linear light
+        (float32, 1.0 = white, gaps taken from the filled panorama),
+        reusing the accumulator's memory.
+        """
+        with timed(timings, 'normalize'):
+            output, mask = self.normalize()
+            if keep_float:
+                result = np.clip(output, 0, 255).astype(np.uint8)
+            else:
+                result = np.clip(output, 0, 255, out=output).astype(np.uint8)
+        
+        result = fill_gaps(result, mask, timings, progress, gap_fill)
+        
+        if not keep_float:
+            return result
+        return result, linear_light(output, result, mask, timings)
+
+def coverage_map(images, azimuths, elevations, out_width: int, out_height: int,
+                 h_fov: float = None, v_fov: float = None, timings: dict = None) -> np.ndarray:
+    """
+    Number of cameras whose FOV covers each canvas pixel (uint8). Cached
+    projections give it from their feather weights; other cameras use the
+    same FOV test without building remap maps (which could evict the
+    projections the blending pass needs), in row chunks as in
+    build_projection.
+    """
+    h_fov = EquirectAccumulator.h_fov if h_fov is None else h_fov
+    v_fov = EquirectAccumulator.v_fov if v_fov is None else v_fov
+    coverage = np.zeros((out_height, out_width), dtype=np.uint8)
+    chunk_pixels = max(MAX_STITCH_MEMORY_MB * 1024 * 1024 // 2 // PROJECTION_BYTES_PER_PIXEL, out_width)
+    with timed(timings, 'coverage'):
+        for img, img_az, img_el in zip(images, azimuths, elevations):
+            if img is None:
+                continue
+            img_h, img_w = img.shape[:2]
+            cached = projection_cache.peek(out_width, out_height, h_fov, v_fov, img_az, img_el, img_w, img_h)
+            if cached is not None:
+                for y0, y1, x0, x1, _, _, w in cached[0]:
+                    coverage[y0:y1, x0:x1] += w > 0
+                continue
+            
+            cam_fwd, cam_right, cam_up = camera_basis(img_az, img_el)
+            for y0, y1, x0, x1 in footprint_windows(cam_fwd, cam_right, cam_up, h_fov, v_fov,
+                                                    out_width, out_height):
+                chunk_rows = max(chunk_pixels // (x1 - x0), 1)
+                for cy0 in range(y0, y1, chunk_rows):
+                    cy1 = min(cy0 + chunk_rows, y1)
+                    *_, in_fov = camera_angles(out_width, out_height, cy0, cy1, x0, x1,
+                                               cam_fwd, cam_right, cam_up, h_fov, v_fov)
+                    coverage[cy0:cy1, x0:x1] += in_fov
+    return coverage
+
+# Canvas pixels per batch of seam gathers in SeamAccumulator.add
+SEAM_CHUNK_PIXELS = 1 << 18
+
+class SeamAccumulator:
+    """
+    Feather blending that only accumulates where cameras overlap.
+    
+    coverage (see coverage_map) tells which canvas pixels exactly one camera
+    sees: those are copied straight into the uint8 panorama. Seam pixels (two
+    or more cameras) get one compact float32 row each (weighted BGR sum and
+    total weight), addressed by a per-pixel int32 index, and are normalized
+    in finish(). The output matches EquirectAccumulator's, except that
+    single-camera pixels keep their exact sampled values instead of going
+    through the float round trip.
+    """
+    
+    # index values of the pixels that aren't seams
+    UNCOVERED = -1
+    SINGLE = -2
+    WRITTEN = -3  # SINGLE pixel that got its (non-negligible) sample
+    
+    h_fov = EquirectAccumulator.h_fov
+    v_fov = EquirectAccumulator.v_fov
+    
+    def __init__(self, coverage: np.ndarray, h_fov: float = None, v_fov: float = None):
+        self.height, self.width = coverage.shape
+        self.image_count = 0
+        if h_fov is not None:
+            self.h_fov = h_fov
+        if v_fov is not None:
+            self.v_fov = v_fov
+        
+        seams = coverage > 1
+        seam_count = int(np.count_nonzero(seams))
+        self.index = np.full(coverage.shape, self.UNCOVERED, dtype=np.int32)
+        self.index[coverage == 1] = self.SINGLE
+        # Row-major, so finish() can scatter the seams back with flatnonzero
+        self.index[seams] = np.arange(seam_count, dtype=np.int32)
+        self.sums = np.zeros((seam_count, 4), dtype=np.float32)
+        self.result = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+    
+    def add(self, img: np.ndarray, img_az: float, img_el: float, timings: dict = None) -> int:
+        """Project one image onto the canvas; returns the number of covered pixels"""
+        img_h, img_w = img.shape[:2]
+        with timed(timings, 'projection'):
+            tiles, pixels = projection_cache.get(self.width, self.height, self.h_fov, self.v_fov,
+                                                 img_az, img_el, img_w, img_h)
+        
+        for y0, y1, x0, x1, map1, map2, w in tiles:
+            with timed(timings, 'remap'):
+                sampled = cv2.remap(img, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            
+            with timed(timings, 'accumulate'):
+                index = self.index[y0:y1, x0:x1]
+                # Pixels only this camera sees are final (negligible weights stay gaps, as when normalizing)
+                single = (index == self.SINGLE) & (w > 0.001)
+                cv2.copyTo(sampled, single.view(np.uint8), self.result[y0:y1, x0:x1])
+                np.copyto(index, self.WRITTEN, where=single)
+                
+                # Seam pixels, in chunks of rows to bound the per-seam temporaries
+                chunk_rows = max(SEAM_CHUNK_PIXELS // (x1 - x0), 1)
+                for cy0 in range(0, y1 - y0, chunk_rows):
+                    rows = slice(cy0, cy0 + chunk_rows)
+                    self.add_seams(index[rows], sampled[rows], w[rows])
+        
+        self.image_count += 1
+        return pixels
+    
+    def add_seams(self, index: np.ndarray, sampled: np.ndarray, w: np.ndarray):
+        """Add the weighted samples of seam pixels: one gather and one scatter of (sum * w, w) rows"""
+        seam = np.flatnonzero((index >= 0) & (w > 0))
+        if not len(seam):
+            return
+        at = np.ravel(index).take(seam)
+        # BGR pixels and the (n, 4) sum rows are moved as single 3- and 16-byte items
+        samples = np.empty((len(seam), 4), dtype=np.uint8)
+        samples[:, :3] = sampled.view('V3').take(seam).view(np.uint8).reshape(-1, 3)
+        samples[:, 3] = 1
+        contribution = samples.astype(np.float32)
+        contribution *= w.take(seam)[:, np.newaxis]
+        sums = self.sums.view(np.complex128).ravel()
+        rows = sums.take(at).view(np.float32).reshape(-1, 4)
+        rows += contribution
+        sums[at] = rows.view(np.complex128).ravel()
+    
+    def finish(self, timings: dict = None, progress=None, keep_float: bool = False, gap_fill: str = 'fast'):
+        """
+        Normalize the seams and fill gaps (see fill_gaps); the accumulator
+        can't be used afterwards. There is no float canvas, so keep_float
+        isn't supported.
+        """
+        if keep_float:
+            raise ValueError('SeamAccumulator has no float canvas to keep')
+        with timed(timings, 'normalize'):
+            # Whole (contiguous) rows are scaled; the weight column is discarded
+            sums, weights = self.sums, self.sums[:, 3]
+            covered = weights > 0.001
+            sums *= np.reciprocal(np.maximum(weights, 0.001))[:, np.newaxis]
+            sums[~covered] = 0
+            np.clip(sums, 0, 255, out=sums)
+            blended = np.ascontiguousarray(sums.astype(np.uint8)[:, :3])  # Truncated like EquirectAccumulator
+            
+            seam_pixels = np.flatnonzero(self.index >= 0)
+            result = self.result
+            np.put(result.view('V3').ravel(), seam_pixels, blended.view('V3').ravel())
+            mask = self.index == self.WRITTEN
+            mask.reshape(-1)[seam_pixels] = covered
+            self.sums = self.index = self.result = None
+        
+        return fill_gaps(result, mask, timings, progress, gap_fill)
+
+# Gap fill modes: 'fast' fills large regions (polar caps) by push-pull and
+# inpaints only small cracks, 'pushpull' uses push-pull everywhere and
+# 'telea' inpaints the whole frame
+GAP_FILL_MODES = ('fast', 'pushpull', 'telea')
+
+def push_pull_fill(img: np.ndarray, known: np.ndarray) -> np.ndarray:
+    """
+    Smooth fill of the unknown pixels of a uint8 image: known pixels are
+    averaged down a pyramid until no holes remain, then each level fills its
+    holes from the upsampled coarser level. Returns a filled copy.
+    
+    The full-resolution level stays uint8 (holes just take the upsampled
+    half-resolution fill), so the float buffers are a third of the image.
+    """
+    filled = img.copy()
+    filled[~known] = 0
+    if known.all() or not known.any():
+        # Nothing to fill, or nothing to fill it from (holes stay black)
+        return filled
+    weight = known.astype(np.uint8) * 255
+    
+    # Premultiplied colour and coverage, from half resolution down
+    levels = []
+    color, cover = filled, weight
+    while min(cover.shape) > 1 and (cover == 0).any():
+        size = ((cover.shape[1] + 1) // 2, (cover.shape[0] + 1) // 2)
+        color = cv2.resize(color, size, interpolation=cv2.INTER_AREA)
+        cover = cv2.resize(cover, size, interpolation=cv2.INTER_AREA)
+        if not levels:
+            color = color.astype(np.float32)
+            cover = cover.astype(np.float32) / 255
+        levels.append((color, cover))
+    
+    if not levels:
+        # A single row or column isn't reduced: holes take the average of the known pixels
+        filled[~known] = img[known].mean(axis=0)
+        return filled
+    
+    # Coarsest level: average of the known samples
+    color, cover = levels.pop()
+    w = cover[:, :, np.newaxis]
+    pulled = np.divide(color, w, out=np.zeros_like(color), where=w > 0)
+    
+    # Finer levels keep their (premultiplied) samples and take the rest from below
+    while levels:
+        color, cover = levels.pop()
+        up = cv2.resize(pulled, (color.shape[1], color.shape[0]), interpolation=cv2.INTER_LINEAR)
+        pulled = color + up * (1 - np.minimum(cover, 1))[:, :, np.newaxis]
+    
+    pulled = np.clip(pulled, 0, 255, out=pulled).astype(np.uint8)
+    up = cv2.resize(pulled, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_LINEAR)
+    np.copyto(filled, up, where=~known[:, :, np.newaxis])
+    return filled
+
+def wrapped_crop(img: np.ndarray, y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+    """
+    img[y0:y1, x0:x1] where columns wrap around the ±180° seam: a view if
+    the window lies inside the canvas, otherwise a copy
+    """
+    if x0 >= 0 and x1 <= img.shape[1]:
+        return img[y0:y1, x0:x1]
+    return np.take(img[y0:y1], np.arange(x0, x1) % img.shape[1], axis=1)
+
+def fill_gaps(result: np.ndarray, mask: np.ndarray, timings: dict = None, progress=None,
+              mode: str = 'fast') -> np.ndarray:
+    """
+    Fill the pixels of result outside mask (no camera covered them), in place
+    where possible. See GAP_FILL_MODES.
+    
+    'fast' labels the connected gap regions. Regions touching the top or
+    bottom row (zenith/nadir caps) or larger than (width/32)^2 pixels get a
+    push-pull fill over their bounding box plus some context; the remaining
+    small cracks are inpainted with TELEA inside their bounding boxes only.
+    """
+    gaps = ~mask
+    gap_percent = 100 * np.count_nonzero(gaps) / mask.size
+    if gap_percent == 0:
+        emit_progress(progress, 'normalized', gapPercent=0.0, gapRegions=0)
+        return result
+    
+    height, width = mask.shape
+    if mode == 'telea':
+        emit_progress(progress, 'normalized', gapPercent=round(float(gap_percent), 1))
+        with timed(timings, 'inpaint'):
+            return cv2.inpaint(result, gaps.astype(np.uint8) * 255, inpaintRadius=5, flags=cv2.INPAINT_TELEA)
+    
+    with timed(timings, 'labels'):
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(gaps.astype(np.uint8), connectivity=8)
+    emit_progress(progress, 'normalized', gapPercent=round(float(gap_percent), 1), gapRegions=count - 1)
+    
+    large_area = (width // 32) ** 2
+    regions = []
+    for label in range(1, count):
+        x, y, w, h, area = stats[label]
+        large = mode == 'pushpull' or y == 0 or y + h == height or area > large_area
+        regions.append((not large, label, x, y, w, h))
+    
+    # Large regions first, so cracks are inpainted from filled surroundings
+    for small, label, x, y, w, h in sorted(regions):
+        # TELEA needs its radius around a crack, push-pull enough known context for the coarse levels
+        margin = 5 if small else max(w, h) // 4 + 8
+        y0, y1 = max(y - margin, 0), min(y + h + margin, height)
+        x0, x1 = (0, width) if w + 2 * margin >= width else (x - margin, x + w + margin)
+        crop_mask = wrapped_crop(labels, y0, y1, x0, x1) == label
+        crop_gaps = wrapped_crop(gaps, y0, y1, x0, x1)
+        
+        if small:
+            with timed(timings, 'inpaint'):
+                # Other unfilled pixels in the box are masked too, so they aren't sampled as black
+                filled = cv2.inpaint(wrapped_crop(result, y0, y1, x0, x1), crop_gaps.astype(np.uint8),
+                                     inpaintRadius=margin, flags=cv2.INPAINT_TELEA)
+        else:
+            with timed(timings, 'pushpull'):
+                filled = push_pull_fill(wrapped_crop(result, y0, y1, x0, x1), ~crop_gaps)
+        
+        # Write back only this region's pixels
+        if x0 >= 0 and x1 <= width:
+            np.copyto(result[y0:y1, x0:x1], filled, where=crop_mask[:, :, np.newaxis])
+            gaps[y0:y1, x0:x1] &= ~crop_mask
+        else:
+            cols = np.arange(x0, x1) % width
+            target = result[y0:y1, cols]
+            np.copyto(target, filled, where=crop_mask[:, :, np.newaxis])
+            result[y0:y1, cols] = target
+            gaps[y0:y1, cols] &= ~crop_mask
+    
+    return result
+
+def linear_light(output: np.ndarray, result: np.ndarray, mask: np.ndarray, timings: dict = None) -> np.ndarray:
+    """
+    Convert the normalized float canvas to linear light in place (1.0 =
+    white), taking gap pixels from the filled panorama
+    """
+    with timed(timings, 'linearize'):
+        np.copyto(output, result, where=~mask[:, :, np.newaxis])
+        np.maximum(output, 0, out=output)
+        output *= 1 / 255
+        # sRGB transfer curve approximated by gamma 2.2
+        np.power(output, 2.2, out=output)
+    return output
+
+def plan_strips(out_width: int, out_height: int, blend: str = 'feather', blend_bands: int = 5):
+    """
+    Split the canvas into strips whose blending working set fits in
+    MAX_STITCH_MEMORY_MB. Returns a list of (row0, row1, core0, core1): the
+    rows accumulated and the rows kept. Multiband strips are aligned to the
+    coarsest pyramid level and overlap by a halo, so the pyramid filters see
+    real neighbours around the rows that are kept, so very small budgets are
+    exceeded by the halo. A single strip means the whole canvas fits.
+    """
+    budget = MAX_STITCH_MEMORY_MB * 1024 * 1024
+    step = 1 << MultiBandBlender.usable_bands(out_width, out_height, blend_bands) if blend == 'multiband' else 1
+    halo = 4 * step if blend == 'multiband' else 0
+    
+    rows = budget // (out_width * STRIP_BYTES_PER_PIXEL[blend])
+    if rows >= out_height:
+        return [(0, out_height, 0, out_height)]
+    core = max((rows - 2 * halo) // step * step, step, 16)
+    
+    strips = []
+    for core0 in range(0, out_height, core):
+        core1 = min(core0 + core, out_height)
+        strips.append((max(core0 - halo, 0), min(core1 + halo, out_height), core0, core1))
+    return strips
+
+def stitch_strips(images, azimuths, elevations, strips, out_width: int, out_height: int,
+                  blend: str = 'feather', blend_bands: int = 5, timings: dict = None, progress=None,
+                  h_fov: float = None, v_fov: float = None, keep_float: bool = False, gap_fill: str = 'fast'):
+    """
+    Render the panorama strip by strip (see plan_strips), so only one strip
+    of float accumulators exists at a time. The output matches a
+    whole-canvas render: feather blending is per pixel, and multiband strips
+    overlap by enough rows for the pyramid filters to see the same
+    neighbours. Returns what EquirectAccumulator.finish returns.
+    """
+    result = np.empty((out_height, out_width, 3), dtype=np.uint8)
+    mask = np.empty((out_height, out_width), dtype=bool)
+    linear = np.empty((out_height, out_width, 3), dtype=np.float32) if keep_float else None
+    
+    for index, (row0, row1, core0, core1) in enumerate(strips):
+        strip = EquirectAccumulator(out_width, out_height, blend, blend_bands, h_fov, v_fov, rows=(row0, row1))
+        for img, img_az, img_el in zip(images, azimuths, elevations):
+            if img is not None:
+                strip.add(img, img_az, img_el, timings)
+        
+        with timed(timings, 'normalize'):
+            output, strip_mask = strip.normalize()
+            core = slice(core0 - row0, core1 - row0)
+            if keep_float:
+                linear[core0:core1] = output[core]
+            np.clip(output[core], 0, 255, out=output[core])
+            result[core0:core1] = output[core]
+            mask[core0:core1] = strip_mask[core]
+        del strip, output
+        emit_progress(progress, 'strip', index=index, total=len(strips), rows=[core0, core1])
+    
+    result = fill_gaps(result, mask, timings, progress, gap_fill)
+    
+    if not keep_float:
+        return result
+    return result, linear_light(linear, result, mask, timings)
+
+def stitch_equirectangular(images, azimuths, elevations, out_width: int = 1024, out_height: int = 512,
+                           blend: str = 'feather', blend_bands: int = 5, timings: dict = None,
+                           progress=None, h_fov: float = None, v_fov: float = None, keep_float: bool = False,
+                           gap_fill: str = 'fast'):
     """
     Equirectangular stitching using CORRECT spherical math.
     
@@ -45,221 +1312,1361 @@ def stitch_equirectangular(images, azimuths, elevations):
     - x = 0 corresponds to azimuth = -180° (left edge = behind)
     - x = width/2 corresponds to azimuth = 0° (center = front)
     - x = width corresponds to azimuth = +180° (right edge = behind)
+    
+    blend is 'feather' (smoothstep-weighted average) or 'multiband' (Laplacian
+    pyramid, see MultiBandBlender). Per-stage seconds are added to timings and
+    progress events are passed to the progress callback (see emit_progress).
+    h_fov/v_fov override the default camera FOV (EquirectAccumulator.h_fov/v_fov).
+    keep_float returns (panorama, linear float buffer), see EquirectAccumulator.finish.
+    gap_fill picks how uncovered pixels are filled (GAP_FILL_MODES, see fill_gaps).
     """
     start_time = time.time()
     
-    # Output dimensions (2:1 aspect ratio for equirectangular)
-    # Reduced for speed on free tier - will upscale at end
-    out_width = 1024
-    out_height = 512
+    # Canvases that don't fit in MAX_STITCH_MEMORY_MB are rendered in strips
+    strips = plan_strips(out_width, out_height, blend, blend_bands)
+    emit_progress(progress, 'stitch', images=len(images), width=out_width, height=out_height, blend=blend,
+                  strips=len(strips))
+    if len(strips) > 1:
+        result = stitch_strips(images, azimuths, elevations, strips, out_width, out_height, blend, blend_bands,
+                               timings, progress, h_fov, v_fov, keep_float, gap_fill)
+        emit_progress(progress, 'stitched', seconds=round(time.time() - start_time, 2))
+        return result
     
-    # Camera FOV (after 65% center crop on frontend)
-    h_fov = 40  # degrees
-    v_fov = 55  # degrees
+    # Output dimensions (2:1 aspect ratio for equirectangular), see QUALITY_TIERS.
+    # Feather blending only accumulates where cameras overlap, unless float
+    # outputs need the whole float canvas
+    if blend == 'feather' and not keep_float:
+        coverage = coverage_map(images, azimuths, elevations, out_width, out_height, h_fov, v_fov, timings)
+        accumulator = SeamAccumulator(coverage, h_fov, v_fov)
+        del coverage
+    else:
+        accumulator = EquirectAccumulator(out_width, out_height, blend, blend_bands, h_fov, v_fov)
     
-    print(f"Stitching {len(images)} images to {out_width}x{out_height}", file=sys.stderr)
+    # Process each source image
+    for idx, (img, img_az, img_el) in enumerate(zip(images, azimuths, elevations)):
+        if img is None:
+            continue
+        
+        pixels = accumulator.add(img, img_az, img_el, timings)
+        emit_progress(progress, 'projected', index=idx, total=len(images),
+                      azimuth=float(img_az), elevation=float(img_el), pixels=pixels)
     
-    # Create output pixel coordinate grids
-    px = np.arange(out_width, dtype=np.float32)
-    py = np.arange(out_height, dtype=np.float32)
-    px_grid, py_grid = np.meshgrid(px, py)
+    result = accumulator.finish(timings, progress, keep_float, gap_fill)
+    
+    elapsed = time.time() - start_time
+    cache_stats = projection_cache.stats()
+    emit_progress(progress, 'stitched', seconds=round(elapsed, 2),
+                  cacheHits=cache_stats['hits'], cacheMisses=cache_stats['misses'])
     
-    # Convert output pixel coordinates to spherical coordinates
-    # Standard equirectangular: longitude spans -180° to +180°, latitude spans +90° to -90°
-    # longitude (azimuth): -180° at x=0, 0° at x=width/2, +180° at x=width
-    longitude = (px_grid / out_width - 0.5) * 360.0  # -180 to +180 degrees
-    latitude = (0.5 - py_grid / out_height) * 180.0   # +90 to -90 degrees
+    return result
+
+# Extra output encodings: extension, MIME type, quality flag and default quality
+OUTPUT_FORMATS = {
+    'jpeg': ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY, 90),
+    'webp': ('.webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY, 85),
+    'avif': ('.avif', 'image/avif', getattr(cv2, 'IMWRITE_AVIF_QUALITY', None), 60),
+    'hdr': ('.hdr', 'image/vnd.radiance', None, None),
+    'exr': ('.exr', 'image/x-exr', None, None),
+}
+
+# Formats written from the unclipped linear float buffer
+FLOAT_FORMATS = ('hdr', 'exr')
+
+# Outputs made of several images, each encoded with an 8-bit format ('encoding')
+COMPOSITE_OUTPUTS = ('cubemap', 'tiles')
+TILE_LAYOUTS = ('equirect', 'cubemap')
+
+# Cubemap faces as (azimuth, elevation) of a camera looking at the face center (see camera_basis)
+CUBEMAP_FACES = OrderedDict([
+    ('front', (0, 0)),
+    ('right', (90, 0)),
+    ('back', (180, 0)),
+    ('left', (270, 0)),
+    ('up', (0, 90)),
+    ('down', (0, -90)),
+])
+
+@lru_cache(maxsize=None)
+def encoder_available(ext: str) -> bool:
+    """
+    Whether this OpenCV build can write ext. EXR is only enabled when the
+    process runs with OPENCV_IO_ENABLE_OPENEXR=1.
+    """
+    sample = np.zeros((8, 8, 3), dtype=np.float32 if ext in ('.hdr', '.exr') else np.uint8)
+    try:
+        return bool(cv2.imencode(ext, sample)[0])
+    except cv2.error:
+        return False
+
+def parse_outputs(options: dict) -> list:
+    """
+    Normalize the 'outputs' request option into a list of output specs.
     
-    # Convert to radians
-    lon_rad = np.radians(longitude)
-    lat_rad = np.radians(latitude)
+    Each entry is a format name ("webp") or an object {"format": "webp",
+    "quality": 80}; cubemaps take {"format": "cubemap", "size": 512,
+    "encoding": "webp", "quality": 85} and tile pyramids {"format": "tiles",
+    "layout": "equirect", "tileSize": 512, "encoding": "jpeg"}. Raises
+    ValueError for unknown or unavailable formats so the request fails
+    before anything is stitched.
+    """
+    specs = []
+    for entry in options.get('outputs') or []:
+        spec = {'format': entry} if isinstance(entry, str) else dict(entry)
+        fmt = spec.get('format')
+        encoding = spec.get('encoding', 'jpeg') if fmt in COMPOSITE_OUTPUTS else fmt
+        if fmt not in COMPOSITE_OUTPUTS and fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{fmt}' "
+                             f"(expected {', '.join(COMPOSITE_OUTPUTS + tuple(OUTPUT_FORMATS))})")
+        if encoding not in OUTPUT_FORMATS or (fmt in COMPOSITE_OUTPUTS and encoding in FLOAT_FORMATS):
+            raise ValueError(f"Unknown {fmt} encoding '{encoding}'")
+        if not encoder_available(OUTPUT_FORMATS[encoding][0]):
+            raise ValueError(f"Output format '{encoding}' is not supported by this server")
+        if 'quality' in spec:
+            spec['quality'] = max(1, min(int(spec['quality']), 100))
+        if fmt == 'cubemap' and 'size' in spec:
+            spec['size'] = max(16, min(int(spec['size']), 4096))
+        if fmt == 'tiles':
+            spec.setdefault('layout', 'equirect')
+            if spec['layout'] not in TILE_LAYOUTS:
+                raise ValueError(f"Unknown tile layout '{spec['layout']}' (expected {', '.join(TILE_LAYOUTS)})")
+            spec['tileSize'] = max(64, min(int(spec.get('tileSize', 512)), 2048))
+        specs.append(spec)
+    return specs
+
+# Large fixed lookup tables are written here once and memory-mapped, so all
+# gunicorn workers (and restarts) share one page-cached copy
+TABLE_CACHE_DIR = os.environ.get('TABLE_CACHE_DIR', os.path.join(os.environ.get('TMPDIR', '/tmp'), 'stitch-tables'))
+
+# Bump when a table's layout or formula changes, so stale files are not loaded
+TABLE_VERSION = 1
+
+def shared_table(name: str, build) -> np.ndarray:
+    """
+    Read-only memory map of TABLE_CACHE_DIR/<name>.npy, writing build()'s
+    array there first if the file doesn't exist yet. If the directory isn't
+    writable the built array is returned (read-only) instead.
+    """
+    path = os.path.join(TABLE_CACHE_DIR, f"{name}-v{TABLE_VERSION}.npy")
+    try:
+        return np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        pass
     
-    # Convert spherical to Cartesian (unit sphere)
-    # Using standard convention: X=right, Y=up, Z=forward
-    # longitude=0 points to +Z (forward), longitude=90° points to +X (right)
-    out_x = np.cos(lat_rad) * np.sin(lon_rad)  # Right/left
-    out_y = np.sin(lat_rad)                      # Up/down  
-    out_z = np.cos(lat_rad) * np.cos(lon_rad)  # Forward/back
+    table = build()
+    try:
+        os.makedirs(TABLE_CACHE_DIR, exist_ok=True)
+        # Written under a unique name and renamed, so concurrent workers never load a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, table)
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r')
+    except OSError:
+        table.flags.writeable = False
+        return table
+
+@lru_cache(maxsize=4)
+def cubemap_maps(face_size: int, out_width: int, out_height: int):
+    """
+    Fixed-point remap tables (CV_16SC2) sampling each cubemap face from an
+    equirectangular canvas laid out as in sphere_axes. The tables of all
+    faces are stored together as shared tables (see shared_table).
+    """
+    def build_maps():
+        t = (np.arange(face_size, dtype=np.float64) + 0.5) / face_size * 2 - 1
+        grid_x, grid_y = np.meshgrid(t, -t)
+        xy = np.empty((len(CUBEMAP_FACES), face_size, face_size, 2), dtype=np.int16)
+        frac = np.empty((len(CUBEMAP_FACES), face_size, face_size), dtype=np.uint16)
+        for i, (az, el) in enumerate(CUBEMAP_FACES.values()):
+            cam_fwd, cam_right, cam_up = camera_basis(az, el)
+            dirs = cam_fwd + grid_x[..., np.newaxis] * cam_right + grid_y[..., np.newaxis] * cam_up
+            lon = np.degrees(np.arctan2(dirs[..., 0], dirs[..., 2]))
+            lat = np.degrees(np.arctan2(dirs[..., 1], np.hypot(dirs[..., 0], dirs[..., 2])))
+            map_x = ((lon / 360 + 0.5) * out_width).astype(np.float32)
+            map_y = np.clip((0.5 - lat / 180) * out_height, 0, out_height - 1).astype(np.float32)
+            xy[i], frac[i] = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+        return xy, frac
     
-    # Initialize output accumulation buffers
-    output = np.zeros((out_height, out_width, 3), dtype=np.float32)
-    weights = np.zeros((out_height, out_width), dtype=np.float32)
+    # Both tables come from one build, done only if one of the files is missing
+    built = []
+    def build(part: int) -> np.ndarray:
+        if not built:
+            built.extend(build_maps())
+        return built[part]
     
-    # FOV half-angles for boundary check
-    h_fov_half = np.radians(h_fov / 2)
-    v_fov_half = np.radians(v_fov / 2)
+    name = f"cubemap-{face_size}-{out_width}x{out_height}"
+    xy = shared_table(f"{name}-xy", lambda: build(0))
+    frac = shared_table(f"{name}-frac", lambda: build(1))
+    return OrderedDict((face, (xy[i], frac[i])) for i, face in enumerate(CUBEMAP_FACES))
+
+def encode_output(img: np.ndarray, fmt: str, quality: int = None) -> bytes:
+    ext, _, quality_flag, default_quality = OUTPUT_FORMATS[fmt]
+    params = [] if quality_flag is None else [quality_flag, quality or default_quality]
+    ok, buffer = cv2.imencode(ext, img, params)
+    if not ok:
+        raise ValueError(f"Could not encode {fmt} output")
+    return buffer.tobytes()
+
+def data_url(data: bytes, mime_type: str) -> str:
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+def pyramid_levels(top: np.ndarray, tile_size: int) -> list:
+    """
+    Halved copies of top, smallest first, down to the first level no wider
+    than tile_size. top itself is the last level (not copied).
+    """
+    levels = [top]
+    while levels[0].shape[1] > tile_size:
+        height, width = levels[0].shape[:2]
+        levels.insert(0, cv2.resize(levels[0], ((width + 1) // 2, (height + 1) // 2), interpolation=cv2.INTER_AREA))
+    return levels
+
+def write_tile_pyramid(result: np.ndarray, spec: dict, key: str) -> dict:
+    """
+    Cut the panorama (or its cubemap faces) into a multi-resolution tile
+    pyramid, encode the tiles on the decode pool and store them with a
+    manifest as the tile archive <key> in the result cache.
     
-    # Process each source image
-    for idx, (img, img_az, img_el) in enumerate(zip(images, azimuths, elevations)):
-        if img is None:
+    Tiles of the top level are encoded straight from views of result. Tile
+    paths are "<level>/<row>_<col>.<ext>" ("<level>/<face>/<row>_<col>.<ext>"
+    for cubemaps); level 0 is the smallest.
+    """
+    tile_size = spec['tileSize']
+    encoding = spec.get('encoding', 'jpeg')
+    ext = OUTPUT_FORMATS[encoding][0]
+    height, width = result.shape[:2]
+    
+    if spec['layout'] == 'cubemap':
+        face_size = spec.get('size', width // 4)
+        faces = OrderedDict((face, cv2.remap(result, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP))
+                            for face, (map1, map2) in cubemap_maps(face_size, width, height).items())
+    else:
+        faces = OrderedDict([(None, result)])
+    
+    levels = []
+    tiles = []
+    for face, face_img in faces.items():
+        for level, img in enumerate(pyramid_levels(face_img, tile_size)):
+            level_h, level_w = img.shape[:2]
+            rows, cols = -(-level_h // tile_size), -(-level_w // tile_size)
+            if len(levels) <= level:
+                levels.append({'level': level, 'width': level_w, 'height': level_h, 'rows': rows, 'columns': cols})
+            prefix = f"{level}/{face}/" if face else f"{level}/"
+            for row in range(rows):
+                for col in range(cols):
+                    tiles.append((f"{prefix}{row}_{col}{ext}",
+                                  img[row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size]))
+    
+    quality = spec.get('quality')
+    encoded = get_decode_pool().map(lambda tile: encode_output(tile[1], encoding, quality), tiles)
+    
+    manifest = {
+        'layout': spec['layout'],
+        'tileSize': tile_size,
+        'encoding': encoding,
+        'width': width,
+        'height': height,
+        'levels': levels,
+        'tilePath': ('{level}/{face}/{row}_{col}' if spec['layout'] == 'cubemap' else '{level}/{row}_{col}') + ext,
+    }
+    if spec['layout'] == 'cubemap':
+        manifest['faces'] = list(faces)
+        manifest['faceSize'] = face_size
+    
+    members = [('manifest.json', json.dumps(manifest).encode('utf-8'))]
+    members.extend((name, data) for (name, _), data in zip(tiles, encoded))
+    size = result_cache.put_archive(key, members)
+    metrics.inc('stitch_output_bytes_total', size)
+    return dict(manifest, tileCount=len(tiles), bytes=size)
+
+def render_outputs(result: np.ndarray, linear: np.ndarray, specs: list, timings: dict = None,
+                   cache_key: str = None) -> list:
+    """
+    Encode every requested output (see parse_outputs) from the finished
+    panorama. linear is the unclipped float buffer from
+    EquirectAccumulator.finish(keep_float=True), used by the float formats.
+    Tile pyramids are stored in the result cache under a key derived from
+    cache_key and the tile options, and served by /tiles/<key>.
+    """
+    rendered = []
+    for spec in specs:
+        fmt = spec['format']
+        with timed(timings, f"output_{fmt}"):
+            if fmt == 'tiles':
+                spec_line = json.dumps(spec, sort_keys=True)
+                key = hashlib.sha256(f"{cache_key}\ntiles={spec_line}".encode('utf-8')).hexdigest()
+                manifest = write_tile_pyramid(result, spec, key)
+                rendered.append({'format': 'tiles', 'key': key, 'archive': f"/tiles/{key}",
+                                 'tiles': f"/tiles/{key}/", 'manifest': manifest})
+                continue
+            
+            if fmt == 'cubemap':
+                height, width = result.shape[:2]
+                size = spec.get('size', width // 4)
+                encoding = spec.get('encoding', 'jpeg')
+                faces = OrderedDict()
+                for face, (map1, map2) in cubemap_maps(size, width, height).items():
+                    face_img = cv2.remap(result, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+                    data = encode_output(face_img, encoding, spec.get('quality'))
+                    metrics.inc('stitch_output_bytes_total', len(data))
+                    faces[face] = data_url(data, OUTPUT_FORMATS[encoding][1])
+                rendered.append({'format': 'cubemap', 'encoding': encoding, 'size': size, 'faces': faces})
+                continue
+            
+            data = encode_output(linear if fmt in FLOAT_FORMATS else result, fmt, spec.get('quality'))
+            metrics.inc('stitch_output_bytes_total', len(data))
+            entry = {'format': fmt, 'data': data_url(data, OUTPUT_FORMATS[fmt][1])}
+            if OUTPUT_FORMATS[fmt][2] is not None:
+                entry['quality'] = spec.get('quality', OUTPUT_FORMATS[fmt][3])
+            rendered.append(entry)
+    return rendered
+
+def result_cache_key(digests, azimuths, elevations, tier: str, options: dict) -> str:
+    """
+    Content address of a stitch: SHA-256 over one line per image
+    ("<sha256 of image bytes>:<azimuth>:<elevation>", angles with 3 decimals)
+    followed by the quality tier that renders (see select_quality_tier) and
+    the output options. Clients can compute the same key and check
+    /results/<key> before uploading anything.
+    """
+    blend = options.get('blend') or 'feather'
+    lines = [f"{digest}:{float(az):.3f}:{float(el):.3f}"
+             for digest, az, el in zip(digests, azimuths, elevations)]
+    lines.append(f"quality={tier}")
+    lines.append(f"blend={blend}")
+    if blend == 'multiband':
+        lines.append(f"blendBands={int(options.get('blendBands', 5))}")
+    if (options.get('gapFill') or 'fast') != 'fast':
+        lines.append(f"gapFill={options['gapFill']}")
+    if options.get('progressive'):
+        lines.append("progressive=true")
+    return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """
+    On-disk LRU cache of stitched panoramas, keyed by result_cache_key.
+    
+    Each entry is <key>.jpg plus <key>.json with the response metadata, or a
+    tile archive <key>.zip. File mtimes track recency, so the cache can be
+    shared by several workers.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def valid_key(key: str) -> bool:
+        return len(key) == 64 and all(c in '0123456789abcdef' for c in key)
+    
+    def image_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.jpg")
+    
+    def meta_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def archive_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.zip")
+    
+    def contains(self, key: str) -> bool:
+        return self.valid_key(key) and os.path.exists(self.image_path(key)) and os.path.exists(self.meta_path(key))
+    
+    def get(self, key: str):
+        """(jpeg bytes, metadata) for a cached result, or None"""
+        try:
+            with open(self.meta_path(key)) as f:
+                meta = json.load(f)
+            with open(self.image_path(key), 'rb') as f:
+                jpeg = f.read()
+            os.utime(self.image_path(key))
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return jpeg, meta
+    
+    def put(self, key: str, jpeg: bytes, meta: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename so readers never see partial files; image last since it marks the entry
+        for path, data in ((self.meta_path(key), json.dumps(meta).encode('utf-8')), (self.image_path(key), jpeg)):
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        self.evict()
+    
+    def put_archive(self, key: str, members) -> int:
+        """Store (name, bytes) members as the uncompressed archive <key>.zip; returns its size"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.archive_path(key)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED) as archive:
+            for name, data in members:
+                archive.writestr(name, data)
+        os.replace(tmp, path)
+        self.evict()
+        return os.path.getsize(path)
+    
+    def read_archive_member(self, key: str, name: str):
+        """One file from archive <key>, or None if the archive or member doesn't exist"""
+        if not self.valid_key(key):
+            return None
+        try:
+            with zipfile.ZipFile(self.archive_path(key)) as archive:
+                data = archive.read(name)
+            os.utime(self.archive_path(key))
+        except (OSError, KeyError, zipfile.BadZipFile):
+            return None
+        return data
+    
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        with self.lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                key, ext = os.path.splitext(name)
+                if ext == '.jpg':
+                    paths = (self.image_path(key), self.meta_path(key))
+                elif ext == '.zip':
+                    paths = (self.archive_path(key),)
+                else:
+                    continue
+                try:
+                    mtime = os.stat(paths[0]).st_mtime
+                    size = sum(os.path.getsize(path) for path in paths)
+                except OSError:
+                    continue
+                entries.append((mtime, paths, size))
+                total += size
+            
+            for _, paths, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+                self.evictions += 1
+    
+    def stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'maxBytes': self.max_bytes}
+
+result_cache = ResultCache(os.environ.get('RESULT_CACHE_DIR', os.path.join(os.environ.get('TMPDIR', '/tmp'), 'stitch-results')),
+                           int(os.environ.get('RESULT_CACHE_MB', 256)) * 1024 * 1024)
+
+# Admission control: every stitch holds one of MAX_CONCURRENT_STITCHES slots
+# and reserves its estimated peak memory from the worker's budget while it
+# runs, so concurrent large captures are refused instead of OOM-killing the worker
+MAX_CONCURRENT_STITCHES = int(os.environ.get('MAX_CONCURRENT_STITCHES', 2))
+MAX_STITCH_IMAGES = int(os.environ.get('MAX_STITCH_IMAGES', 64))
+
+def default_memory_budget() -> int:
+    """
+    80% of the container's memory limit (or of physical memory), split
+    between the gunicorn workers (WEB_CONCURRENCY)
+    """
+    try:
+        limit = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError):
+        limit = 1024 ** 3
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
             continue
-        
-        img_h, img_w = img.shape[:2]
-        img_float = img.astype(np.float32)
-        
-        # Image camera direction in spherical coords (converted to radians)
-        cam_az_rad = np.radians(img_az)   # Azimuth of camera
-        cam_el_rad = np.radians(img_el)   # Elevation of camera
-        
-        # Camera basis vectors (where camera is pointing)
-        # Forward vector: direction camera is looking
-        cam_fwd = np.array([
-            np.cos(cam_el_rad) * np.sin(cam_az_rad),  # X
-            np.sin(cam_el_rad),                         # Y
-            np.cos(cam_el_rad) * np.cos(cam_az_rad)   # Z
-        ])
-        
-        # Right vector: perpendicular to forward, in horizontal plane
-        # For azimuth rotation: right = (cos(az), 0, -sin(az))
-        cam_right = np.array([
-            np.cos(cam_az_rad),   # X
-            0,                      # Y
-            -np.sin(cam_az_rad)   # Z
-        ])
-        
-        # Up vector: perpendicular to both forward and right
-        # This tilts with elevation
-        cam_up = np.array([
-            -np.sin(cam_el_rad) * np.sin(cam_az_rad),  # X
-            np.cos(cam_el_rad),                          # Y
-            -np.sin(cam_el_rad) * np.cos(cam_az_rad)   # Z
-        ])
-        
-        # For each output pixel direction, compute projection onto this camera's image plane
-        # Dot products with camera basis (vectorized)
-        dot_fwd = out_x * cam_fwd[0] + out_y * cam_fwd[1] + out_z * cam_fwd[2]
-        dot_right = out_x * cam_right[0] + out_y * cam_right[1] + out_z * cam_right[2]
-        dot_up = out_x * cam_up[0] + out_y * cam_up[1] + out_z * cam_up[2]
-        
-        # Only consider pixels that are in front of the camera
-        in_front = dot_fwd > 0.01
-        
-        # Perspective projection: project 3D point onto image plane
-        with np.errstate(divide='ignore', invalid='ignore'):
-            # Angles from camera center
-            angle_h = np.where(in_front, np.arctan2(dot_right, dot_fwd), 999)
-            angle_v = np.where(in_front, np.arctan2(dot_up, dot_fwd), 999)
-        
-        # Check if within camera FOV
-        in_fov = in_front & (np.abs(angle_h) < h_fov_half) & (np.abs(angle_v) < v_fov_half)
-        
-        # Convert angle to image UV coordinates (0 to 1)
-        # Center of image = angle 0, edges = ±FOV/2
-        # No flip needed for test images
-        u = 0.5 + (angle_h / h_fov_half) * 0.5
-        v = 0.5 - (angle_v / v_fov_half) * 0.5  # Top of image = positive angle
-        
-        # Convert UV to pixel coordinates
-        src_x = (u * (img_w - 1)).astype(np.float32)
-        src_y = (v * (img_h - 1)).astype(np.float32)
-        
-        # Feathering weight based on distance from edge
-        edge_u = np.minimum(u, 1 - u)
-        edge_v = np.minimum(v, 1 - v)
-        edge_dist = np.minimum(edge_u, edge_v)
-        # Normalize to 0-1 range over 20% feather zone
-        feather = np.clip(edge_dist / 0.2, 0, 1)
-        # Smoothstep for nicer blending
-        feather = feather * feather * (3 - 2 * feather)
-        
-        # Sample image
-        map_x = np.clip(src_x, 0, img_w - 1).astype(np.float32)
-        map_y = np.clip(src_y, 0, img_h - 1).astype(np.float32)
-        sampled = cv2.remap(img_float, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-        
-        # Apply weight only where in FOV
-        w = np.where(in_fov, feather, 0).astype(np.float32)
-        
-        # Accumulate weighted samples
-        for c in range(3):
-            output[:, :, c] += sampled[:, :, c] * w
-        weights += w
-        
-        print(f"  [{idx+1}/{len(images)}] az={img_az:>6.1f}°, el={img_el:>6.1f}° - pixels: {np.sum(in_fov):>7}", file=sys.stderr)
-    
-    # Normalize by total weight
-    mask = weights > 0.001
-    for c in range(3):
-        output[:, :, c] = np.where(mask, output[:, :, c] / np.maximum(weights, 0.001), 0)
-    
-    # Fill any gaps with inpainting
-    gap_mask = (~mask).astype(np.uint8) * 255
-    gap_percent = 100 * np.sum(~mask) / (out_width * out_height)
-    print(f"Gaps: {gap_percent:.1f}%", file=sys.stderr)
-    
-    result = np.clip(output, 0, 255).astype(np.uint8)
-    
-    if gap_percent > 0:
-        result = cv2.inpaint(result, gap_mask, inpaintRadius=5, flags=cv2.INPAINT_TELEA)
+        if value.isdigit():  # 'max' means unlimited
+            limit = min(limit, int(value))
+        break
+    workers = max(int(os.environ.get('WEB_CONCURRENCY', 1)), 1)
+    return int(limit * 0.8) // workers
+
+STITCH_MEMORY_BUDGET = (int(os.environ['STITCH_MEMORY_BUDGET_MB']) * 1024 * 1024
+                        if os.environ.get('STITCH_MEMORY_BUDGET_MB') else default_memory_budget())
+
+def estimate_stitch_bytes(raws, tier: str, blend: str = 'feather', output_specs=(), held_bytes: int = 0,
+                          strips: bool = True) -> int:
+    """
+    Estimated peak memory of one stitch: the decoded sources (raws are the
+    uploads' image bytes, sized from their headers as prepare_upload will
+    downsize them), the decoder output of the images decoded at once, the
+    blending working set (capped by MAX_STITCH_MEMORY_MB when rendered in
+    strips), the panorama, gap mask and labels, and the float buffer and
+    composite outputs. held_bytes counts request data already in memory.
+    """
+    spec = QUALITY_TIERS[tier]
+    source_width = spec['source_width']
+    decoded = 0
+    largest_decode = 0
+    for raw in raws:
+        width, height = image_dimensions(raw) or (0, 0)
+        if not width or not height:
+            # Unknown format: assume a portrait 3:4 capture at the source width
+            width, height = source_width, source_width * 4 // 3
+        # JPEGs are decoded at a reduced scale while the short side stays >= source_width (see reduced_decode_flag)
+        factor = next((f for f in (8, 4, 2) if min(width, height) // f >= source_width), 1)
+        if raw[:2] != b'\xff\xd8':
+            factor = 1
+        largest_decode = max(largest_decode, (width // factor) * (height // factor) * 3)
+        scale = min(1.0, source_width / width)
+        decoded += int(width * scale) * int(height * scale) * 3
+    decoding = largest_decode * min(DECODE_WORKERS, len(raws))
     
-    elapsed = time.time() - start_time
-    print(f"Stitching complete in {elapsed:.1f}s", file=sys.stderr)
+    canvas = spec['width'] * spec['height']
+    blending = canvas * STRIP_BYTES_PER_PIXEL[blend]
+    if strips:
+        blending = min(blending, MAX_STITCH_MEMORY_MB * 1024 * 1024)
+    finishing = canvas * 8
+    outputs = sum(canvas * (12 if s['format'] in FLOAT_FORMATS else 3) for s in output_specs)
+    return held_bytes + decoded + decoding + blending + finishing + outputs
+
+class StitchRejected(Exception):
+    """A stitch refused by admission control; status is the HTTP status to answer with"""
     
-    return result
+    def __init__(self, message: str, status: int, retry_after: int = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({'status': 'ok', 'opencv': cv2.__version__})
+class StitchAdmission:
+    """
+    Concurrency and memory semaphore in front of stitching. Stitches take a
+    slot and reserve their estimated bytes (see estimate_stitch_bytes);
+    sessions reserve their accumulators without a slot. acquire() raises
+    StitchRejected when the request can't run now (or, with wait, blocks
+    until it can); requests that could never fit are always rejected.
+    """
+    
+    def __init__(self, max_concurrent: int, budget_bytes: int):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.budget_bytes = budget_bytes
+        self.tickets = {}  # ticket -> (bytes, holds a slot, expected end)
+        self.next_ticket = 0
+        self.rejected = 0
+        self.cond = threading.Condition()
+    
+    def acquire(self, cost: int, seconds: float = 0, slot: bool = True, wait: bool = False,
+                reclaim=None) -> int:
+        """
+        Reserve cost bytes (and a slot) for about `seconds`; returns a ticket
+        for release(). reclaim is called (without the lock held) before every
+        check to release reservations that have expired, e.g. purge_sessions;
+        waiting callers recheck at least every retry_after() seconds.
+        """
+        if cost > self.budget_bytes:
+            self.reject('size')
+            raise StitchRejected(f"Request needs about {cost / 1e6:.0f} MB, more than this server's "
+                                 f"{self.budget_bytes / 1e6:.0f} MB stitch budget; send fewer or smaller images "
+                                 f"or a lower quality", 413)
+        while True:
+            if reclaim is not None:
+                reclaim()
+            with self.cond:
+                slots_free = not slot or self.running() < self.max_concurrent
+                memory_free = self.reserved() + cost <= self.budget_bytes
+                if slots_free and memory_free:
+                    ticket = self.next_ticket
+                    self.next_ticket += 1
+                    self.tickets[ticket] = (cost, slot, time.time() + seconds)
+                    return ticket
+                if not wait:
+                    self.reject('concurrency' if not slots_free else 'memory')
+                    if not slots_free:
+                        raise StitchRejected('Too many stitches running, retry later', 429,
+                                             self.retry_after(slots_only=True))
+                    raise StitchRejected('Not enough memory for this stitch right now, retry later', 503,
+                                         self.retry_after())
+                self.cond.wait(self.retry_after(slots_only=not memory_free))
+    
+    def reject(self, reason: str):
+        with self.cond:  # Reentrant, also called with the lock held
+            self.rejected += 1
+        metrics.inc('stitch_rejected_total', reason=reason)
+    
+    def release(self, ticket: int):
+        with self.cond:
+            if self.tickets.pop(ticket, None) is not None:
+                self.cond.notify_all()
+    
+    def renew(self, ticket: int, seconds: float):
+        """Move a reservation's expected end to `seconds` from now"""
+        with self.cond:
+            if ticket in self.tickets:
+                cost, slot, _ = self.tickets[ticket]
+                self.tickets[ticket] = (cost, slot, time.time() + seconds)
+    
+    @contextmanager
+    def admit(self, cost: int, seconds: float = 0, wait: bool = False, reclaim=None):
+        ticket = self.acquire(cost, seconds, wait=wait, reclaim=reclaim)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+    
+    def running(self) -> int:
+        return sum(1 for _, slot, _ in self.tickets.values() if slot)
+    
+    def reserved(self) -> int:
+        return sum(cost for cost, _, _ in self.tickets.values())
+    
+    def retry_after(self, slots_only: bool = False) -> int:
+        """
+        Seconds until the first reservation (with slots_only, the first
+        running stitch) is expected to end (1-60); sessions end when they
+        expire
+        """
+        ends = [end for _, slot, end in self.tickets.values() if slot or not slots_only]
+        if not ends:
+            return 5
+        return int(min(max(np.ceil(min(ends) - time.time()), 1), 60))
+    
+    def stats(self) -> dict:
+        with self.cond:
+            return {'running': self.running(), 'maxConcurrent': self.max_concurrent,
+                    'reservedBytes': self.reserved(), 'budgetBytes': self.budget_bytes,
+                    'rejected': self.rejected}
 
-@app.route('/stitch', methods=['POST'])
-def stitch():
+admission = StitchAdmission(MAX_CONCURRENT_STITCHES, STITCH_MEMORY_BUDGET)
+
+def result_payload(meta: dict, jpeg: bytes, cached: bool, cache_key: str, timings: dict, embed: bool = True) -> dict:
+    """
+    /stitch response payload for an encoded panorama. The JPEG is embedded
+    as a data URL in 'panorama', or with embed=False kept as raw bytes in
+    'jpeg' for jpeg_response (never serialized).
+    """
+    payload = dict(meta, success=True, cached=cached, cacheKey=cache_key,
+                   timings={stage: round(seconds, 3) for stage, seconds in timings.items()})
+    if embed:
+        payload['panorama'] = jpeg_data_url(jpeg)
+    else:
+        payload['jpeg'] = jpeg
+    return payload
+
+def publish_result(result: np.ndarray, meta: dict, cache_key: str, timings: dict, outputs: list = None,
+                   progressive: bool = False, embed: bool = True) -> dict:
+    """
+    Encode a stitched panorama, store it in the result cache and build the
+    response payload (see result_payload). outputs (from render_outputs)
+    are returned as-is and not cached.
+    """
+    with timed(timings, 'encode'):
+        jpeg = encode_jpeg(result, quality=90, progressive=progressive)
+    
     try:
-        data = request.json
-        images_data = data.get('images', [])
-        
-        if len(images_data) < 2:
-            return jsonify({'success': False, 'error': 'Need at least 2 images'})
-        
-        print(f"\n{'='*50}", file=sys.stderr)
-        print(f"Received {len(images_data)} images", file=sys.stderr)
+        result_cache.put(cache_key, jpeg, meta)
+    except OSError as e:
+        print(f"Result cache write failed: {e}", file=sys.stderr)
+    
+    record_stitch(meta, timings, jpeg, cached=False)
+    payload = result_payload(meta, jpeg, False, cache_key, timings, embed)
+    if outputs is not None:
+        payload['outputs'] = outputs
+    return payload
+
+def parse_stitch_options(options: dict, images: int, embed: bool = True) -> tuple:
+    """
+    Resolve and check the /stitch options for a set of images: returns
+    (tier, blend, blend bands, gap fill, output specs); raises ValueError
+    """
+    tier = select_quality_tier(options.get('quality'), options.get('timeBudget'), images)
+    blend = options.get('blend') or 'feather'
+    if blend not in BLEND_MODES:
+        raise ValueError(f"Unknown blend mode '{blend}'")
+    blend_bands = int(options.get('blendBands', 5))
+    gap_fill = options.get('gapFill') or 'fast'
+    if gap_fill not in GAP_FILL_MODES:
+        raise ValueError(f"Unknown gap fill mode '{gap_fill}'")
+    output_specs = parse_outputs(options)
+    if output_specs and not embed:
+        raise ValueError('outputs need a JSON response')
+    return tier, blend, blend_bands, gap_fill, output_specs
+
+def run_stitch(uploads, options: dict, progress=None, embed: bool = True, wait: bool = False) -> dict:
+    """
+    Decode, stitch and encode one capture set.
+    
+    uploads and options come from read_stitch_request. Returns the /stitch
+    response payload, with the raw JPEG instead of a data URL if not embed
+    (see result_payload); raises ValueError for requests that can't be stitched.
+    Stitching goes through admission control, which raises StitchRejected
+    when the server is at capacity, or with wait blocks until it isn't.
+    """
+    if len(uploads) < 2:
+        raise ValueError('Need at least 2 images')
+    if len(uploads) > MAX_STITCH_IMAGES:
+        admission.reject('size')
+        raise StitchRejected(f"At most {MAX_STITCH_IMAGES} images per stitch", 413)
+    
+    tier, blend, blend_bands, gap_fill, output_specs = parse_stitch_options(options, len(uploads), embed)
+    spec = QUALITY_TIERS[tier]
+    timings = {}
+    
+    emit_progress(progress, 'received', images=len(uploads), quality=tier)
+    
+    # Identical capture sets are served from the result cache
+    with timed(timings, 'hash'):
+        hashed = digest_uploads([source for source, _, _ in uploads])
+    metrics.inc('stitch_input_bytes_total', sum(len(raw) for raw, _ in hashed))
+    cache_key = result_cache_key([digest for _, digest in hashed], [az for _, az, _ in uploads],
+                                 [el for _, _, el in uploads], tier, options)
+    # Only the JPEG is cached, so requests for extra outputs always stitch
+    cached = None if output_specs else result_cache.get(cache_key)
+    if cached is not None:
+        jpeg, meta = cached
+        emit_progress(progress, 'cached', key=cache_key)
+        record_stitch(meta, timings, jpeg, cached=True)
+        return result_payload(meta, jpeg, True, cache_key, timings, embed)
+    
+    # Capacity for the decoded sources and the blending buffers is reserved before decoding
+    held_bytes = sum(len(raw) + (len(source) if isinstance(source, str) else 0)
+                     for (raw, _), (source, _, _) in zip(hashed, uploads))
+    cost = estimate_stitch_bytes([raw for raw, _ in hashed], tier, blend, output_specs, held_bytes)
+    # Abandoned sessions past their TTL give their reservations back first
+    with admission.admit(cost, estimate_stitch_seconds(tier, len(uploads)), wait, reclaim=purge_sessions):
+        # Decode images (in parallel, order preserved)
+        with timed(timings, 'decode'):
+            decoded = prepare_uploads([raw for raw, _ in hashed], spec['source_width'], timings)
         
-        # Decode images
         images = []
         azimuths = []
         elevations = []
         
-        for i, img_data in enumerate(images_data):
-            img = decode_base64_image(img_data['data'])
+        for i, (img, (_, azimuth, elevation)) in enumerate(zip(decoded, uploads)):
             if img is not None:
-                # Resize large images to save memory
-                h, w = img.shape[:2]
-                if w > 1080:
-                    scale = 1080 / w
-                    img = cv2.resize(img, (int(w * scale), int(h * scale)))
-                
-                # NOTE: Don't flip here - the U coordinate flip in projection handles it
-                
                 images.append(img)
-                azimuths.append(float(img_data.get('azimuth', 0)))
-                elevations.append(float(img_data.get('elevation', 0)))
-                
-                print(f"  Image {i+1}: {img.shape[1]}x{img.shape[0]}, az={azimuths[-1]:.0f}°, el={elevations[-1]:.0f}°", file=sys.stderr)
+                azimuths.append(float(azimuth))
+                elevations.append(float(elevation))
+            
+            emit_progress(progress, 'decoded', index=i, total=len(uploads), ok=img is not None,
+                          width=None if img is None else img.shape[1],
+                          height=None if img is None else img.shape[0],
+                          azimuth=float(azimuth), elevation=float(elevation))
         
         if len(images) < 2:
-            return jsonify({'success': False, 'error': 'Could not decode images'})
+            raise ValueError('Could not decode images')
         
-        # Stitch using corrected algorithm
-        result = stitch_equirectangular(images, azimuths, elevations)
+        # Stitch using corrected algorithm, rendered directly at the tier's size
+        stitch_start = time.time()
+        keep_float = any(s['format'] in FLOAT_FORMATS for s in output_specs)
+        result = stitch_equirectangular(images, azimuths, elevations, spec['width'], spec['height'],
+                                        blend=blend, blend_bands=blend_bands,
+                                        timings=timings, progress=progress, keep_float=keep_float,
+                                        gap_fill=gap_fill)
+        record_stitch_seconds(tier, len(images), time.time() - stitch_start)
         
-        # Upscale result for quality
-        result = cv2.resize(result, (4096, 2048), interpolation=cv2.INTER_CUBIC)
+        linear = None
+        if keep_float:
+            result, linear = result
+        outputs = render_outputs(result, linear, output_specs, timings, cache_key) if output_specs else None
         
-        panorama = encode_image_base64(result, quality=90)
+        return publish_result(result, {
+            'method': 'equirectangular-corrected',
+            'imageCount': len(images),
+            'quality': tier,
+            'width': spec['width'],
+            'height': spec['height'],
+            'blend': blend,
+        }, cache_key, timings, outputs, bool(options.get('progressive')), embed)
+
+class StitchJob:
+    """A queued /jobs stitch: status, structured progress events and the final result"""
+    
+    def __init__(self, image_count: int):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.created = time.time()
+        self.finished = None
+        self.image_count = image_count
+        self.images_decoded = 0
+        self.images_projected = 0
+        self.events = []
+        self.result = None
+        self.error = None
+        self.lock = threading.Lock()
+    
+    def record(self, event: dict):
+        with self.lock:
+            event = dict(event, t=round(time.time() - self.created, 3))
+            self.events.append(event)
+            if event['event'] == 'decoded':
+                self.images_decoded += 1
+            elif event['event'] == 'projected':
+                self.images_projected += 1
+    
+    def snapshot(self, since: int = 0) -> dict:
+        with self.lock:
+            payload = {
+                'success': True,
+                'jobId': self.id,
+                'status': self.status,
+                'progress': {
+                    'images': self.image_count,
+                    'decoded': self.images_decoded,
+                    'projected': self.images_projected,
+                },
+                'events': self.events[since:],
+                'nextEvent': len(self.events),
+            }
+            if self.status == 'done':
+                payload['result'] = self.result
+            elif self.status == 'failed':
+                payload['error'] = self.error
+            return payload
+
+# Jobs run on their own small pool so /jobs requests return immediately.
+# Job state lives in this process: run one gunicorn worker (the default) when using /jobs.
+STITCH_JOB_WORKERS = int(os.environ.get('STITCH_JOB_WORKERS', 1))
+MAX_PENDING_JOBS = int(os.environ.get('MAX_PENDING_JOBS', 8))
+JOB_TTL_SECONDS = float(os.environ.get('JOB_TTL_SECONDS', 900))
+
+jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_job_pool = None
+
+def get_job_pool() -> ThreadPoolExecutor:
+    global _job_pool
+    with _jobs_lock:
+        if _job_pool is None:
+            _job_pool = ThreadPoolExecutor(max_workers=max(STITCH_JOB_WORKERS, 1), thread_name_prefix='stitch-job')
+        return _job_pool
+
+def purge_jobs():
+    """Forget finished jobs older than JOB_TTL_SECONDS"""
+    now = time.time()
+    with _jobs_lock:
+        for job_id in [job_id for job_id, job in jobs.items()
+                       if job.finished is not None and now - job.finished > JOB_TTL_SECONDS]:
+            del jobs[job_id]
+
+def execute_job(job: StitchJob, uploads, options: dict, ticket: int):
+    job.status = 'running'
+    try:
+        # The stitch reserves the payload again, with its working memory, when it is admitted
+        admission.release(ticket)
+        # Jobs are already queued, so they wait for stitch capacity instead of being refused
+        job.result = run_stitch(uploads, options, progress=job.record, wait=True)
+        job.status = 'done'
+    except Exception as e:
+        if not isinstance(e, (ValueError, StitchRejected)):
+            import traceback
+            traceback.print_exc(file=sys.stderr)
+        job.error = str(e)
+        job.status = 'failed'
+    finally:
+        job.finished = time.time()
+
+def submit_job(uploads, options: dict):
+    """
+    Queue a stitch; returns the job. Options are checked now (ValueError),
+    and the queued payload reserves its bytes from admission control until
+    the job runs, so a full queue (429) or budget (StitchRejected from
+    acquire) is refused before anything is accepted.
+    """
+    tier = parse_stitch_options(options, len(uploads))[0]
+    purge_jobs()
+    with _jobs_lock:
+        pending = sum(1 for job in jobs.values() if job.finished is None)
+        if pending >= MAX_PENDING_JOBS:
+            admission.reject('queue')
+            raise StitchRejected('Too many pending jobs, retry later', 429, admission.retry_after(slots_only=True))
+        # Held until the job starts, which is after the jobs ahead of it
+        seconds = estimate_stitch_seconds(tier, len(uploads)) * (pending // max(STITCH_JOB_WORKERS, 1) + 1)
+        ticket = admission.acquire(sum(len(source) for source, _, _ in uploads), seconds, slot=False,
+                                   reclaim=purge_sessions)
+        job = StitchJob(len(uploads))
+        jobs[job.id] = job
+    get_job_pool().submit(execute_job, job, uploads, options, ticket)
+    return job
+
+class StitchSession:
+    """
+    Incremental stitch: each pushed image is projected into the accumulators
+    right away, so finalize only normalizes, inpaints and encodes.
+    
+    Images arrive one at a time and aren't kept, so the canvas can't be
+    rendered in strips: MAX_STITCH_MEMORY_MB doesn't apply, and reserve()
+    charges the whole-canvas accumulators instead.
+    """
+    
+    def __init__(self, options: dict):
+        self.id = uuid.uuid4().hex
+        self.options = options
+        self.tier = select_quality_tier(options.get('quality'), options.get('timeBudget'))
+        self.spec = QUALITY_TIERS[self.tier]
+        self.blend = options.get('blend') or 'feather'
+        self.gap_fill = options.get('gapFill') or 'fast'
+        if self.gap_fill not in GAP_FILL_MODES:
+            raise ValueError(f"Unknown gap fill mode '{self.gap_fill}'")
+        self.output_specs = parse_outputs(options)
+        self.accumulator = EquirectAccumulator(self.spec['width'], self.spec['height'], self.blend,
+                                               int(options.get('blendBands', 5)))
+        self.digests = []
+        self.azimuths = []
+        self.elevations = []
+        self.timings = {}
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+        self.ticket = None
+    
+    def reserve(self):
+        """
+        Reserve the accumulators' memory from admission control until the
+        session expires (raises StitchRejected)
+        """
+        cost = estimate_stitch_bytes([], self.tier, self.blend, self.output_specs, strips=False)
+        self.ticket = admission.acquire(cost, SESSION_TTL_SECONDS, slot=False)
+    
+    def release(self):
+        """Return the reservation once the session is closed"""
+        if self.ticket is not None:
+            admission.release(self.ticket)
+            self.ticket = None
+    
+    def push(self, uploads) -> list:
+        """Decode and project uploaded images; returns per-image results"""
+        if self.accumulator is None:
+            raise ValueError('Session already finalized')
+        with timed(self.timings, 'hash'):
+            hashed = digest_uploads([source for source, _, _ in uploads])
+        metrics.inc('stitch_input_bytes_total', sum(len(raw) for raw, _ in hashed))
+        with timed(self.timings, 'decode'):
+            decoded = prepare_uploads([raw for raw, _ in hashed], self.spec['source_width'], self.timings)
         
-        return jsonify({
-            'success': True,
-            'panorama': panorama,
+        added = []
+        for img, (_, digest), (_, azimuth, elevation) in zip(decoded, hashed, uploads):
+            if img is None:
+                added.append({'ok': False})
+                continue
+            pixels = self.accumulator.add(img, float(azimuth), float(elevation), self.timings)
+            self.digests.append(digest)
+            self.azimuths.append(float(azimuth))
+            self.elevations.append(float(elevation))
+            emit_progress(None, 'projected', session=self.id, index=len(self.digests) - 1,
+                          azimuth=float(azimuth), elevation=float(elevation), pixels=pixels)
+            added.append({'ok': True, 'index': len(self.digests) - 1, 'pixels': pixels})
+        return added
+    
+    def finalize(self) -> dict:
+        if self.accumulator is None:
+            raise ValueError('Session already finalized')
+        if len(self.digests) < 2:
+            raise ValueError('Need at least 2 images')
+        keep_float = any(s['format'] in FLOAT_FORMATS for s in self.output_specs)
+        result = self.accumulator.finish(self.timings, keep_float=keep_float, gap_fill=self.gap_fill)
+        self.accumulator = None
+        linear = None
+        if keep_float:
+            result, linear = result
+        cache_key = result_cache_key(self.digests, self.azimuths, self.elevations, self.tier, self.options)
+        outputs = (render_outputs(result, linear, self.output_specs, self.timings, cache_key)
+                   if self.output_specs else None)
+        return publish_result(result, {
             'method': 'equirectangular-corrected',
-            'imageCount': len(images)
-        })
+            'imageCount': len(self.digests),
+            'quality': self.tier,
+            'width': self.spec['width'],
+            'height': self.spec['height'],
+            'blend': self.blend,
+        }, cache_key, self.timings, outputs, bool(self.options.get('progressive')))
+
+# Each session holds full-size float32 accumulators, so only a few may be open at once
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 2))
+SESSION_TTL_SECONDS = float(os.environ.get('SESSION_TTL_SECONDS', 300))
+
+sessions = {}
+_sessions_lock = threading.Lock()
+
+def purge_sessions():
+    """Drop sessions idle for longer than SESSION_TTL_SECONDS to free their accumulators"""
+    now = time.time()
+    with _sessions_lock:
+        for session_id in [session_id for session_id, session in sessions.items()
+                           if now - session.last_used > SESSION_TTL_SECONDS]:
+            sessions.pop(session_id).release()
+
+def touch_session(session_id: str):
+    """Look up a session and mark it as used; None if unknown or expired"""
+    purge_sessions()
+    with _sessions_lock:
+        session = sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.time()
+            if session.ticket is not None:
+                admission.renew(session.ticket, SESSION_TTL_SECONDS)
+        return session
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Request latency histogram and Server-Timing header (stage timings set in g.timings)"""
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.observe('stitch_http_request_seconds', elapsed, endpoint=endpoint, method=request.method,
+                    status=str(response.status_code))
+    timings = dict(g.get('timings') or {}, total=elapsed)
+    response.headers['Server-Timing'] = server_timing(timings)
+    return response
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics of this worker process"""
+    projection = projection_cache.stats()
+    results = result_cache.stats()
+    load = admission.stats()
+    with _jobs_lock:
+        pending = sum(1 for job in jobs.values() if job.status in ('queued', 'running'))
+    body = metrics.render({
+        'stitch_projection_cache_hits_total': ('counter', 'Projection cache hits', projection['hits']),
+        'stitch_projection_cache_misses_total': ('counter', 'Projection cache misses', projection['misses']),
+        'stitch_projection_cache_evictions_total': ('counter', 'Projection cache evictions', projection['evictions']),
+        'stitch_result_cache_hits_total': ('counter', 'Result cache hits', results['hits']),
+        'stitch_result_cache_misses_total': ('counter', 'Result cache misses', results['misses']),
+        'stitch_pending_jobs': ('gauge', 'Queued or running /jobs', pending),
+        'stitch_open_sessions': ('gauge', 'Open /sessions', len(sessions)),
+        'stitch_running': ('gauge', 'Stitches holding an admission slot', load['running']),
+        'stitch_reserved_bytes': ('gauge', 'Memory reserved by running stitches and open sessions', load['reservedBytes']),
+        'stitch_memory_budget_bytes': ('gauge', 'Admission control memory budget', load['budgetBytes']),
+        'process_peak_resident_memory_bytes': ('gauge', 'Peak resident set size of the worker', peak_rss_bytes()),
+    })
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Poses of the capture page's targets (8 azimuths at -45°, 0° and 45°, plus zenith and nadir)
+WARMUP_POSES = [(az, el) for el in (-45, 0, 45) for az in range(0, 360, 45)] + [(0, 80), (0, -80)]
+
+# 'idle' until warm_up() starts, then 'warming' and 'ready' (or 'failed')
+warmup = {'state': 'idle', 'seconds': None, 'error': None}
+
+def warm_up():
+    """
+    Build the lookup tables of every quality tier and run one preview stitch
+    of synthetic images at WARMUP_POSES, so the first request doesn't pay
+    for them. /health reports not ready until this is done.
+    """
+    warmup['state'] = 'warming'
+    start_time = time.time()
+    try:
+        for spec in QUALITY_TIERS.values():
+            sphere_axes(spec['width'], spec['height'])
+            cubemap_maps(spec['width'] // 4, spec['width'], spec['height'])
         
+        spec = next(iter(QUALITY_TIERS.values()))
+        source_height = spec['source_width'] * 4 // 3
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 256, (source_height, spec['source_width'], 3), dtype=np.uint8)
+                  for _ in WARMUP_POSES]
+        azimuths, elevations = zip(*WARMUP_POSES)
+        result = stitch_equirectangular(images, azimuths, elevations, spec['width'], spec['height'])
+        encode_jpeg(result)
+    except Exception as e:
+        # The service still works, just without the head start
+        print(f"Warm-up failed: {e}", file=sys.stderr)
+        warmup.update(state='failed', error=str(e))
+    else:
+        warmup['state'] = 'ready'
+    warmup['seconds'] = round(time.time() - start_time, 2)
+
+# OpenCV thread count saved by preload() and restored in each worker by after_fork()
+_preload_threads = None
+
+def preload():
+    """
+    Warm up in the gunicorn master before workers are forked (see
+    gunicorn.conf.py), so the workers start ready and share the tables
+    copy-on-write. OpenCV runs single-threaded meanwhile, since its thread
+    pool doesn't survive a fork.
+    """
+    global _preload_threads
+    _preload_threads = cv2.getNumThreads()
+    cv2.setNumThreads(1)
+    warm_up()
+
+def after_fork():
+    """Restore OpenCV's thread count in a worker forked after preload()"""
+    if _preload_threads is not None:
+        cv2.setNumThreads(_preload_threads)
+
+@app.route('/health', methods=['GET'])
+def health():
+    ready = warmup['state'] != 'warming'
+    return jsonify({
+        'status': 'ok' if ready else 'warming',
+        'ready': ready,
+        'warmup': warmup,
+        'load': admission.stats(),
+        'opencv': cv2.__version__,
+        'projectionCache': projection_cache.stats(),
+        'resultCache': result_cache.stats()
+    }), 200 if ready else 503
+
+# /stitch response bodies: the JSON payload, or the panorama itself (see jpeg_response)
+RESPONSE_FORMATS = ('json', 'jpeg')
+
+# Payload fields sent as headers with a raw JPEG response
+JPEG_RESPONSE_HEADERS = OrderedDict([
+    ('method', 'X-Stitch-Method'),
+    ('imageCount', 'X-Stitch-Image-Count'),
+    ('quality', 'X-Stitch-Quality'),
+    ('width', 'X-Stitch-Width'),
+    ('height', 'X-Stitch-Height'),
+    ('blend', 'X-Stitch-Blend'),
+    ('cached', 'X-Stitch-Cached'),
+    ('cacheKey', 'X-Stitch-Cache-Key'),
+])
+
+JPEG_CHUNK_BYTES = 256 * 1024
+
+def jpeg_requested(options: dict) -> bool:
+    """
+    Whether /stitch should answer with the raw JPEG: the 'response' option
+    (removed from options), else an Accept header preferring image/jpeg
+    """
+    fmt = options.pop('response', None)
+    if fmt is None:
+        return request.accept_mimetypes.best_match(['application/json', 'image/jpeg']) == 'image/jpeg'
+    if fmt not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown response format '{fmt}' (expected {', '.join(RESPONSE_FORMATS)})")
+    return fmt == 'jpeg'
+
+def jpeg_response(payload: dict) -> Response:
+    """
+    Stream the panorama of a result_payload(embed=False) as image/jpeg in
+    JPEG_CHUNK_BYTES chunks, with the metadata in JPEG_RESPONSE_HEADERS
+    (timings go to Server-Timing as for every response)
+    """
+    jpeg = payload['jpeg']
+    
+    def chunks():
+        for start in range(0, len(jpeg), JPEG_CHUNK_BYTES):
+            yield jpeg[start:start + JPEG_CHUNK_BYTES]
+    
+    headers = {header: str(payload[field]).lower() if isinstance(payload[field], bool) else str(payload[field])
+               for field, header in JPEG_RESPONSE_HEADERS.items()}
+    # Let browsers read the metadata of cross-origin responses
+    headers['Access-Control-Expose-Headers'] = ', '.join([*JPEG_RESPONSE_HEADERS.values(), 'ETag', 'Server-Timing'])
+    response = Response(chunks(), mimetype='image/jpeg', headers=headers, direct_passthrough=True)
+    response.content_length = len(jpeg)
+    response.set_etag(payload['cacheKey'])
+    return response
+
+def rejected_response(e: StitchRejected):
+    """Error response for a request refused by admission control, with Retry-After if it may succeed later"""
+    response = jsonify({'success': False, 'error': str(e)})
+    response.status_code = e.status
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(e.retry_after)
+        response.headers['Access-Control-Expose-Headers'] = 'Retry-After'
+    return response
+
+@app.route('/stitch', methods=['POST'])
+def stitch():
+    try:
+        uploads, options = read_stitch_request()
+        binary = jpeg_requested(options)
+        payload = run_stitch(uploads, options, embed=not binary)
+        g.timings = payload['timings']
+        if binary:
+            return jpeg_response(payload)
+        response = jsonify(payload)
+        response.set_etag(payload['cacheKey'])
+        return response
+        
+    except StitchRejected as e:
+        return rejected_response(e)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc(file=sys.stderr)
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Same request body as /stitch; returns a job id to poll at /jobs/<id>"""
+    try:
+        uploads, options = read_stitch_request()
+        if len(uploads) < 2:
+            return jsonify({'success': False, 'error': 'Need at least 2 images'}), 400
+        if len(uploads) > MAX_STITCH_IMAGES:
+            admission.reject('size')
+            return jsonify({'success': False, 'error': f"At most {MAX_STITCH_IMAGES} images per stitch"}), 413
+        
+        job = submit_job(uploads, options)
+        return jsonify({'success': True, 'jobId': job.id, 'status': job.status}), 202
+        
+    except StitchRejected as e:
+        return rejected_response(e)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status and progress; ?since=N returns only events from index N on"""
+    purge_jobs()
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify(job.snapshot(request.args.get('since', 0, type=int)))
+
+@app.route('/results/<key>', methods=['GET'])
+def get_result(key):
+    """
+    Cached panorama by content key (see result_cache_key) as image/jpeg.
+    HEAD answers 200/404 without a body, so clients can skip uploading known captures.
+    """
+    if not result_cache.contains(key):
+        return jsonify({'success': False, 'error': 'Unknown result'}), 404
+    os.utime(result_cache.image_path(key))
+    return send_file(result_cache.image_path(key), mimetype='image/jpeg', etag=key, conditional=True)
+
+@app.route('/results/lookup', methods=['POST'])
+def lookup_result():
+    """
+    Cache key of a stitch without uploading it: the body is the /stitch
+    options with images as {"sha256", "azimuth", "elevation"}. The quality
+    tier is resolved as /stitch resolves it now, so this also covers 'auto'.
+    """
+    options = request.get_json(silent=True) or {}
+    images = options.pop('images', None)
+    if (not isinstance(images, list) or len(images) < 2
+            or not all(isinstance(image, dict) and isinstance(image.get('sha256'), str) for image in images)):
+        return jsonify({'success': False, 'error': 'images must list at least 2 {"sha256", "azimuth", "elevation"}'}), 400
+    try:
+        tier = select_quality_tier(options.get('quality'), options.get('timeBudget'), len(images))
+        key = result_cache_key([image['sha256'].lower() for image in images],
+                               [image.get('azimuth', 0) for image in images],
+                               [image.get('elevation', 0) for image in images], tier, options)
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'cacheKey': key, 'quality': tier, 'cached': result_cache.contains(key)})
+
+@app.route('/tiles/<key>', methods=['GET'])
+def get_tile_archive(key):
+    """Whole tile pyramid (application/zip) written for a 'tiles' output"""
+    if not result_cache.valid_key(key) or not os.path.exists(result_cache.archive_path(key)):
+        return jsonify({'success': False, 'error': 'Unknown tile archive'}), 404
+    os.utime(result_cache.archive_path(key))
+    return send_file(result_cache.archive_path(key), mimetype='application/zip', etag=key, conditional=True)
+
+@app.route('/tiles/<key>/<path:name>', methods=['GET'])
+def get_tile(key, name):
+    """One tile (or manifest.json) of a tile archive; paths follow the manifest's tilePath"""
+    data = result_cache.read_archive_member(key, name)
+    if data is None:
+        return jsonify({'success': False, 'error': 'Unknown tile'}), 404
+    ext = os.path.splitext(name)[1]
+    mime_type = next((mime for fmt_ext, mime, _, _ in OUTPUT_FORMATS.values() if fmt_ext == ext), 'application/json')
+    response = app.response_class(data, mimetype=mime_type)
+    response.set_etag(hashlib.sha256(f"{key}/{name}".encode('utf-8')).hexdigest())
+    return response.make_conditional(request)
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    """Open an incremental stitch; body holds the /stitch options (quality, blend, ...)"""
+    try:
+        session = StitchSession(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    purge_sessions()
+    with _sessions_lock:
+        if len(sessions) >= MAX_SESSIONS:
+            return jsonify({'success': False, 'error': 'Too many open sessions, retry later'}), 503
+        try:
+            session.reserve()
+        except StitchRejected as e:
+            return rejected_response(e)
+        sessions[session.id] = session
+    
+    return jsonify({
+        'success': True,
+        'sessionId': session.id,
+        'quality': session.tier,
+        'width': session.spec['width'],
+        'height': session.spec['height'],
+        'blend': session.blend,
+    })
+
+@app.route('/sessions/<session_id>/images', methods=['POST'])
+def push_session_images(session_id):
+    """Add one or more images (same body formats as /stitch)"""
+    session = touch_session(session_id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Unknown session'}), 404
+    try:
+        uploads, _ = read_stitch_request()
+        with session.lock:
+            # Finalizing stitches everything pushed, so the /stitch image limit covers the session total
+            if len(session.digests) + len(uploads) > MAX_STITCH_IMAGES:
+                admission.reject('size')
+                return jsonify({'success': False, 'error': f"At most {MAX_STITCH_IMAGES} images per stitch"}), 413
+            added = session.push(uploads)
+            return jsonify({'success': True, 'imageCount': len(session.digests), 'added': added})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/sessions/<session_id>/preview', methods=['GET'])
+def session_preview(session_id):
+    """Low-resolution view of the images pushed so far (?width=512)"""
+    session = touch_session(session_id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Unknown session'}), 404
+    width = max(16, min(request.args.get('width', 512, type=int), session.spec['width']))
+    with session.lock:
+        if session.accumulator is None:
+            return jsonify({'success': False, 'error': 'Session already finalized'}), 400
+        preview = session.accumulator.preview(width)
+        image_count = len(session.digests)
+    return jsonify({'success': True, 'preview': encode_image_base64(preview, quality=80), 'imageCount': image_count})
+
+@app.route('/sessions/<session_id>/finalize', methods=['POST'])
+def finalize_session(session_id):
+    """Inpaint and encode the panorama; the session is closed afterwards"""
+    session = touch_session(session_id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Unknown session'}), 404
+    try:
+        with session.lock:
+            payload = session.finalize()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    with _sessions_lock:
+        sessions.pop(session_id, None)
+    session.release()
+    g.timings = payload['timings']
+    response = jsonify(payload)
+    response.set_etag(payload['cacheKey'])
+    return response
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    with _sessions_lock:
+        session = sessions.pop(session_id, None)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Unknown session'}), 404
+    session.release()
+    return jsonify({'success': True})
+
 if __name__ == '__main__':
-    import os
+    # Requests are served meanwhile; /health reports ready once this finishes
+    threading.Thread(target=warm_up, daemon=True).start()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
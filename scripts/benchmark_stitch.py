@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Synthetic benchmark and accuracy suite for the stitching engines
+
+Renders perspective views from a known equirectangular scene, stitches them
+with each engine and reports wall time, peak RSS, per-stage timings and
+PSNR/SSIM against the ground truth. Results can be saved as a baseline and
+later runs compared against it to catch regressions.
+
+Engines:
+    equirect   app.stitch_equirectangular (Flask service)
+    endpoint   app /stitch route end to end (decode, stitch, encode)
+    manual     stitch_panorama.manual_spherical_stitch (direct projection fallback)
+    seeded     stitch_panorama.refine_poses + manual_spherical_stitch (sensor-seeded registration)
+    stitcher   stitch_panorama.stitch_spherical_panorama (OpenCV Stitcher first; time only)
+
+Usage:
+    python benchmark_stitch.py --engines equirect,manual --widths 1024,2048 --poses rig16
+    python benchmark_stitch.py --engines manual,seeded --pose-noise 3
+    python benchmark_stitch.py --save-baseline baseline.json
+    python benchmark_stitch.py --baseline baseline.json
+"""
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# Capture rigs: (azimuth, elevation) in degrees
+POSE_PRESETS = {
+    'ring8': [(az, 0) for az in range(0, 360, 45)],
+    'rig16': [(az, 0) for az in range(0, 360, 45)] + [(az, 45) for az in range(0, 360, 90)]
+             + [(az, -45) for az in range(45, 360, 90)],
+    'rig26': [(az, 0) for az in range(0, 360, 30)] + [(az, 45) for az in range(0, 360, 60)]
+             + [(az, -45) for az in range(30, 360, 60)] + [(0, 90), (0, -90)],
+}
+
+# Camera model and default FOV (h, v) of each engine
+ENGINE_CAMERAS = {
+    'equirect': ('angular', (40, 55)),
+    'endpoint': ('angular', (40, 55)),
+    'manual': ('gnomonic', (55, 75)),
+    'seeded': ('gnomonic', (55, 75)),
+    'stitcher': ('gnomonic', (55, 75)),
+}
+
+# Output tier used by the endpoint for each width
+ENDPOINT_TIERS = {1024: 'preview', 2048: 'standard', 4096: 'full'}
+
+def make_scene(width: int, height: int, seed: int = 7) -> np.ndarray:
+    """
+    Ground-truth equirectangular scene (BGR, x=0 at azimuth -180°) with
+    smooth gradients, a latitude/longitude grid and random blobs, so both
+    low-frequency colour and high-frequency edges are measured
+    """
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(1, 0, height, dtype=np.float32)[:, np.newaxis]
+    lon = np.linspace(0, 1, width, endpoint=False, dtype=np.float32)[np.newaxis, :]
+    scene = np.empty((height, width, 3), dtype=np.float32)
+    scene[:, :, 0] = 60 + 150 * lat
+    scene[:, :, 1] = 80 + 100 * (0.5 + 0.5 * np.sin(2 * np.pi * lon))
+    scene[:, :, 2] = 90 + 120 * (1 - lat) * (0.5 + 0.5 * np.cos(2 * np.pi * lon))
+
+    # Random blobs (texture for seams and ghosting)
+    for _ in range(400):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(width // 400 + 1, width // 60 + 2))
+        color = tuple(float(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(scene, center, radius, color, -1, lineType=cv2.LINE_AA)
+
+    # Grid lines every 15 degrees
+    for x in range(0, width, width // 24):
+        scene[:, x:x + max(1, width // 1024)] = 20
+    for y in range(0, height, height // 12):
+        scene[y:y + max(1, height // 512)] = 20
+
+    return np.clip(scene, 0, 255).astype(np.uint8)
+
+def camera_basis(az_deg: float, el_deg: float):
+    """Forward, right and up vectors (shared convention of both engines)"""
+    az, el = np.radians(az_deg), np.radians(el_deg)
+    fwd = np.array([np.cos(el) * np.sin(az), np.sin(el), np.cos(el) * np.cos(az)])
+    right = np.array([np.cos(az), 0.0, -np.sin(az)])
+    up = np.array([-np.sin(el) * np.sin(az), np.cos(el), -np.sin(el) * np.cos(az)])
+    return fwd, right, up
+
+def render_view(scene: np.ndarray, az: float, el: float, h_fov: float, v_fov: float,
+                img_w: int, img_h: int, model: str) -> np.ndarray:
+    """
+    Render the view an engine expects for a pose by inverting its camera model:
+    'angular' (app.py: image position linear in angle) or 'gnomonic'
+    (stitch_panorama.py: image position linear in tangent)
+    """
+    fwd, right, up = camera_basis(az, el)
+    u = np.arange(img_w, dtype=np.float64) / (img_w - 1)
+    v = np.arange(img_h, dtype=np.float64) / (img_h - 1)
+    u, v = np.meshgrid(u, v)
+
+    if model == 'angular':
+        x = np.tan((u - 0.5) * np.radians(h_fov))
+        y = np.tan((0.5 - v) * np.radians(v_fov))
+    else:
+        x = (u - 0.5) * 2 * np.tan(np.radians(h_fov) / 2)
+        y = (0.5 - v) * 2 * np.tan(np.radians(v_fov) / 2)
+
+    dirs = x[..., np.newaxis] * right + y[..., np.newaxis] * up + fwd
+    dirs /= np.linalg.norm(dirs, axis=2, keepdims=True)
+    lon = np.degrees(np.arctan2(dirs[..., 0], dirs[..., 2]))
+    lat = np.degrees(np.arcsin(np.clip(dirs[..., 1], -1, 1)))
+
+    scene_h, scene_w = scene.shape[:2]
+    map_x = ((lon / 360 + 0.5) * scene_w).astype(np.float32)
+    map_y = ((90 - lat) / 180 * scene_h).astype(np.float32)
+    return cv2.remap(scene, map_x, map_y, cv2.INTER_LINEAR,
+                     borderMode=cv2.BORDER_WRAP)
+
+def coverage_mask(poses, h_fov: float, v_fov: float, width: int, height: int, model: str) -> np.ndarray:
+    """Canvas pixels (x=0 at azimuth -180°) seen by at least one camera"""
+    lon = np.radians((np.arange(width) / width - 0.5) * 360)
+    lat = np.radians(90 - np.arange(height) / height * 180)
+    lon, lat = np.meshgrid(lon, lat)
+    dirs = np.stack([np.cos(lat) * np.sin(lon), np.sin(lat), np.cos(lat) * np.cos(lon)], axis=2)
+
+    if model == 'angular':
+        limit_h, limit_v = np.tan(np.radians(h_fov / 2)), np.tan(np.radians(v_fov / 2))
+    else:
+        limit_h, limit_v = np.tan(np.radians(h_fov) / 2), np.tan(np.radians(v_fov) / 2)
+
+    mask = np.zeros((height, width), dtype=bool)
+    for az, el in poses:
+        fwd, right, up = camera_basis(az, el)
+        f = dirs @ fwd
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inside = (f > 0.01) & (np.abs(dirs @ right) < limit_h * f) & (np.abs(dirs @ up) < limit_v * f)
+        mask |= inside
+    return mask
+
+def psnr(a: np.ndarray, b: np.ndarray, mask: np.ndarray) -> float:
+    diff = a.astype(np.float64)[mask] - b.astype(np.float64)[mask]
+    mse = np.mean(diff ** 2) if diff.size else 0.0
+    return float('inf') if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
+
+def ssim(a: np.ndarray, b: np.ndarray, mask: np.ndarray) -> float:
+    """Mean SSIM of the luma channels over the mask (Gaussian window, sigma 1.5)"""
+    a = cv2.cvtColor(a, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda img: cv2.GaussianBlur(img, (11, 11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    cov = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map[mask].mean()) if mask.any() else 0.0
+
+def run_engine(engine: str, views, poses, width: int, h_fov: float, v_fov: float, timings: dict) -> np.ndarray:
+    """Stitch the rendered views; returns the panorama in the x=0 at -180° layout (or the raw result)"""
+    azimuths = [float(az) for az, _ in poses]
+    elevations = [float(el) for _, el in poses]
+
+    if engine == 'equirect':
+        import app
+        return app.stitch_equirectangular(views, azimuths, elevations, width, width // 2,
+                                          timings=timings, h_fov=h_fov, v_fov=v_fov)
+
+    if engine == 'endpoint':
+        import app
+        body = {
+            'images': [{'data': base64.b64encode(cv2.imencode('.jpg', view, [cv2.IMWRITE_JPEG_QUALITY, 95])[1]).decode(),
+                        'azimuth': az, 'elevation': el} for view, az, el in zip(views, azimuths, elevations)],
+            'quality': ENDPOINT_TIERS[width],
+        }
+        # Drop earlier results so repeat runs measure a real stitch, not a cache hit
+        shutil.rmtree(app.result_cache.directory, ignore_errors=True)
+        payload = app.app.test_client().post('/stitch', json=body).get_json()
+        if not payload.get('success'):
+            raise RuntimeError(payload.get('error'))
+        timings.update(payload.get('timings', {}))
+        jpeg = base64.b64decode(payload['panorama'].split(',')[1])
+        return cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+
+    import stitch_panorama
+    if engine == 'manual':
+        _, result = stitch_panorama.manual_spherical_stitch(views, azimuths, elevations, width, width // 2,
+                                                            h_fov, v_fov, timings=timings)
+    elif engine == 'seeded':
+        bases, h_fov, v_fov, _ = stitch_panorama.refine_poses(views, azimuths, elevations, h_fov, v_fov,
+                                                              timings=timings)
+        _, result = stitch_panorama.manual_spherical_stitch(views, azimuths, elevations, width, width // 2,
+                                                            h_fov, v_fov, timings=timings, bases=bases)
+    else:
+        success, result = stitch_panorama.stitch_spherical_panorama(views, azimuths, elevations, mode='stitcher')
+        if not success:
+            raise RuntimeError(result)
+
+    # stitch_panorama puts azimuth 0 at x=0; shift to the -180° layout
+    if result.shape[:2] == (width // 2, width):
+        result = np.roll(result, width // 2, axis=1)
+    return result
+
+def run_case(case: dict) -> dict:
+    """Run one benchmark case in this (fresh) process"""
+    # Keep the endpoint's result cache away from the service's cache
+    os.environ['RESULT_CACHE_DIR'] = tempfile.mkdtemp(prefix='stitch-bench-')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    engine, width, poses = case['engine'], case['width'], case['poses']
+    model, (h_fov, v_fov) = ENGINE_CAMERAS[engine]
+    if case.get('fov') and engine != 'endpoint':  # the endpoint always uses the service's FOV
+        h_fov, v_fov = case['fov']
+    src_w, src_h = case['source']
+
+    scene = make_scene(max(width, 2048), max(width, 2048) // 2)
+    views = [render_view(scene, az, el, h_fov, v_fov, src_w, src_h, model) for az, el in poses]
+    # Engines get the poses with simulated sensor error; views are rendered at the true poses
+    rng = np.random.default_rng(0)
+    sensor_poses = [(az + rng.normal(0, case.get('poseNoise', 0)), el + rng.normal(0, case.get('poseNoise', 0)))
+                    for az, el in poses]
+    truth = cv2.resize(scene, (width, width // 2), interpolation=cv2.INTER_AREA)
+    mask = coverage_mask(poses, h_fov, v_fov, width, width // 2, model)
+    # Ignore the outermost pixels of the footprint, where feathering fades out
+    mask = cv2.erode(mask.astype(np.uint8), np.ones((5, 5), np.uint8)).astype(bool)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    runs = []
+    for _ in range(case['repeat']):
+        timings = {}
+        start = time.perf_counter()
+        result = run_engine(engine, views, sensor_poses, width, h_fov, v_fov, timings)
+        runs.append((time.perf_counter() - start, timings))
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    seconds = [elapsed for elapsed, _ in runs]
+    report = {
+        'case': case['name'],
+        'engine': engine,
+        'width': width,
+        'images': len(poses),
+        'fov': [h_fov, v_fov],
+        'coldSeconds': round(seconds[0], 3),
+        'warmSeconds': round(min(seconds[1:]), 3) if len(seconds) > 1 else None,
+        'peakRssMB': round(peak_rss / 1024, 1),
+        'rssGrowthMB': round((peak_rss - rss_before) / 1024, 1),
+        'stages': {stage: round(value, 3) for stage, value in runs[-1][1].items()},
+        'coverage': round(float(mask.mean()), 3),
+        'psnr': None,
+        'ssim': None,
+    }
+    if result.shape[:2] == truth.shape[:2]:
+        report['psnr'] = round(psnr(result, truth, mask), 2)
+        report['ssim'] = round(ssim(result, truth, mask), 4)
+    return report
+
+def compare_baseline(reports: list[dict], baseline: dict, time_tolerance: float, psnr_tolerance: float) -> list[str]:
+    """Regressions of reports against a saved baseline (keyed by case name)"""
+    regressions = []
+    for report in reports:
+        base = baseline.get(report['case'])
+        if base is None:
+            continue
+        for key in ('coldSeconds', 'warmSeconds'):
+            if report.get(key) is not None and base.get(key):
+                if report[key] > base[key] * (1 + time_tolerance):
+                    regressions.append(f"{report['case']}: {key} {report[key]}s vs baseline {base[key]}s")
+        if report.get('psnr') is not None and base.get('psnr') is not None:
+            if report['psnr'] < base['psnr'] - psnr_tolerance:
+                regressions.append(f"{report['case']}: PSNR {report['psnr']} dB vs baseline {base['psnr']} dB")
+        if report.get('ssim') is not None and base.get('ssim') is not None:
+            if report['ssim'] < base['ssim'] - 0.01:
+                regressions.append(f"{report['case']}: SSIM {report['ssim']} vs baseline {base['ssim']}")
+    return regressions
+
+def parse_poses(spec: str) -> list[tuple[float, float]]:
+    """Preset name or explicit list 'az:el,az:el,...'"""
+    if spec in POSE_PRESETS:
+        return POSE_PRESETS[spec]
+    return [tuple(float(v) for v in pose.split(':')) for pose in spec.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', default='equirect,endpoint,manual',
+                        help='comma separated: ' + ', '.join(ENGINE_CAMERAS))
+    parser.add_argument('--widths', default='1024,2048', help='output widths (height is width / 2)')
+    parser.add_argument('--poses', default='rig16', help=f"preset ({', '.join(POSE_PRESETS)}) or 'az:el,az:el,...'")
+    parser.add_argument('--fov', help="override every engine's camera FOV as 'H:V' degrees")
+    parser.add_argument('--source', default='1080x1440', help='rendered view size WxH')
+    parser.add_argument('--pose-noise', type=float, default=0.0,
+                        help='standard deviation (degrees) of simulated sensor error added to the poses')
+    parser.add_argument('--repeat', type=int, default=2, help='runs per case (first is cold, best of the rest is warm)')
+    parser.add_argument('--json', help='write the reports to this file')
+    parser.add_argument('--save-baseline', help='store the reports as a baseline file')
+    parser.add_argument('--baseline', help='compare against a baseline file; exit 1 on regressions')
+    parser.add_argument('--time-tolerance', type=float, default=0.25, help='allowed slowdown vs baseline (fraction)')
+    parser.add_argument('--psnr-tolerance', type=float, default=0.5, help='allowed PSNR drop vs baseline (dB)')
+    args = parser.parse_args()
+
+    poses = parse_poses(args.poses)
+    fov = tuple(float(v) for v in args.fov.split(':')) if args.fov else None
+    source = tuple(int(v) for v in args.source.lower().split('x'))
+
+    cases = []
+    for engine in args.engines.split(','):
+        if engine not in ENGINE_CAMERAS:
+            parser.error(f"unknown engine '{engine}'")
+        for width in (int(w) for w in args.widths.split(',')):
+            if engine == 'endpoint' and width not in ENDPOINT_TIERS:
+                print(f"Skipping endpoint at {width}: not a quality tier", file=sys.stderr)
+                continue
+            cases.append({
+                'name': f"{engine}-{width}-{args.poses}" + (f"-fov{args.fov}" if fov else '')
+                        + (f"-noise{args.pose_noise:g}" if args.pose_noise else ''),
+                'engine': engine, 'width': width, 'poses': poses, 'fov': fov, 'poseNoise': args.pose_noise,
+                'source': source, 'repeat': max(args.repeat, 1),
+            })
+
+    # A fresh process per case keeps peak RSS and cold-cache timings honest
+    context = multiprocessing.get_context('spawn')
+    reports = []
+    for case in cases:
+        print(f"Running {case['name']}...", file=sys.stderr)
+        with context.Pool(1) as pool:
+            try:
+                reports.append(pool.apply(run_case, (case,)))
+            except Exception as e:
+                print(f"  failed: {e}", file=sys.stderr)
+                reports.append({'case': case['name'], 'engine': case['engine'], 'width': case['width'], 'error': str(e)})
+
+    print(f"{'case':<32} {'cold s':>8} {'warm s':>8} {'RSS MB':>8} {'PSNR':>7} {'SSIM':>7}  stages")
+    for r in reports:
+        if 'error' in r:
+            print(f"{r['case']:<32} failed: {r['error']}")
+            continue
+        fmt = lambda value, spec: format('-', spec[:2]) if value is None else format(value, spec)
+        stages = ' '.join(f"{k}={v}" for k, v in sorted(r['stages'].items(), key=lambda kv: -kv[1]))
+        print(f"{r['case']:<32} {r['coldSeconds']:>8.2f} {fmt(r['warmSeconds'], '>8.2f')} {r['peakRssMB']:>8.0f} "
+              f"{fmt(r['psnr'], '>7.2f')} {fmt(r['ssim'], '>7.4f')}  {stages}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({r['case']: r for r in reports if 'error' not in r}, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(reports, baseline, args.time_tolerance, args.psnr_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions or any('error' in r for r in reports):
+            sys.exit(1)
+        print("No regressions against baseline")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+# Read by gunicorn from the working directory (`gunicorn app:app`).
+# The app is imported and warmed up once in the master process (app.preload),
+# then the workers are forked from it and share its lookup tables.
+
+preload_app = True
+
+def when_ready(server):
+    import app
+    app.preload()
+
+def post_fork(server, worker):
+    import app
+    app.after_fork()
@@ -10,8 +10,31 @@ import sys
 import json
 import base64
 import os
+import time
+import hashlib
+import argparse
+import io
+import multiprocessing
+import signal
+import socketserver
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 
+@contextmanager
+def timed(timings: dict | None, stage: str):
+    """Add the wall time of the enclosed block to timings[stage] (no-op if timings is None)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
 def decode_base64_image(base64_string: str) -> np.ndarray:
     """Decode a base64 image string to OpenCV format"""
     # Remove data URL prefix if present
@@ -77,7 +100,13 @@ def stitch_panorama(images: list[np.ndarray], mode: str = 'panorama') -> tuple[b
     else:
         return False, f"Stitching failed with status code: {status}"
 
-def stitch_spherical_panorama(images: list[np.ndarray], azimuths: list[float], elevations: list[float]) -> tuple[bool, np.ndarray | str]:
+# 'seeded' refines the sensor poses by matching overlapping neighbours, 'stitcher'
+# tries cv2.Stitcher on all pairs first, 'direct' projects with the sensor poses
+STITCH_MODES = ('seeded', 'stitcher', 'direct')
+
+def stitch_spherical_panorama(images: list[np.ndarray], azimuths: list[float], elevations: list[float],
+                              mode: str = 'stitcher', time_budget: float | None = None, timings: dict | None = None,
+                              registration: dict | None = None) -> tuple[bool, np.ndarray | str]:
     """
     Stitch images into a spherical (equirectangular) panorama
     Uses custom projection when standard stitching fails
@@ -86,10 +115,29 @@ def stitch_spherical_panorama(images: list[np.ndarray], azimuths: list[float], e
         images: List of OpenCV images
         azimuths: List of azimuth angles (degrees) for each image
         elevations: List of elevation angles (degrees) for each image
+        mode: One of STITCH_MODES
+        time_budget: Seconds allowed for pose refinement in 'seeded' mode (see refine_poses)
+        timings: Per-stage seconds are added here if given
+        registration: Filled with the refine_poses report if given
     
     Returns:
         (success, result)
     """
+    if mode not in STITCH_MODES:
+        return False, f"Unknown stitch mode '{mode}' (expected {', '.join(STITCH_MODES)})"
+    
+    if mode == 'direct':
+        return manual_spherical_stitch(images, azimuths, elevations, timings=timings)
+    
+    if mode == 'seeded':
+        bases, h_fov, v_fov, report = refine_poses(images, azimuths, elevations, time_budget=time_budget,
+                                                   timings=timings)
+        if registration is not None:
+            registration.update(report)
+        print(f"Pose refinement: {json.dumps(report)}", file=sys.stderr)
+        return manual_spherical_stitch(images, azimuths, elevations, h_fov=h_fov, v_fov=v_fov,
+                                       timings=timings, bases=bases)
+    
     # First try OpenCV's built-in stitcher
     success, result = stitch_panorama(images, 'panorama')
     
@@ -103,104 +151,93 @@ def stitch_spherical_panorama(images: list[np.ndarray], azimuths: list[float], e
     
     return manual_spherical_stitch(images, azimuths, elevations)
 
-def manual_spherical_stitch(images: list[np.ndarray], azimuths: list[float], elevations: list[float]) -> tuple[bool, np.ndarray | str]:
+def manual_spherical_stitch(images: list[np.ndarray], azimuths: list[float], elevations: list[float],
+                            out_width: int = 4096, out_height: int = 2048, h_fov: float = 55, v_fov: float = 75,
+                            timings: dict | None = None, bases: list | None = None) -> tuple[bool, np.ndarray | str]:
     """
     Manual spherical projection stitching with multi-band blending
     Used when OpenCV's Stitcher fails
-    """
-    # Output size (equirectangular 2:1 aspect ratio)
-    out_width = 4096
-    out_height = 2048
-    
-    # Assume camera FOV (typical phone camera in portrait)
-    h_fov = 55  # horizontal
-    v_fov = 75  # vertical
     
+    Output size is equirectangular (2:1 aspect ratio); the default FOV is a typical
+    phone camera in portrait. Per-stage seconds are added to timings if given.
+    bases overrides the camera orientations with one (fwd, right, up) per image
+    (see refine_poses); azimuths/elevations are then ignored.
+    """
     # Create output images for blending
     output = np.zeros((out_height, out_width, 3), dtype=np.float32)
     weights = np.zeros((out_height, out_width), dtype=np.float32)
     
-    for idx, (img, az, el) in enumerate(zip(images, azimuths, elevations)):
+    dir_x, dir_y, dir_z = equirect_direction_grid(out_width, out_height)
+    
+    if bases is None:
+        bases = [camera_basis(az, el) for az, el in zip(azimuths, elevations)]
+    
+    for idx, (img, basis) in enumerate(zip(images, bases)):
         if img is None:
             continue
             
         h, w = img.shape[:2]
-        img_float = img.astype(np.float32)
         
         # Create weight mask (feathered edges)
         weight_mask = create_feather_mask(w, h, feather_size=0.2)
         
-        # Project image onto equirectangular
-        for py in range(out_height):
-            # Elevation for this row (-90 to 90, top to bottom inverted)
-            out_el = 90 - (py / out_height) * 180
+        img_float = img.astype(np.float32)
+        
+        # Project only the output pixels inside this camera's footprint
+        for y0, y1, x0, x1 in footprint_windows(*basis, h_fov, v_fov, out_width, out_height):
+            with timed(timings, 'projection'):
+                map_x, map_y, valid = project_directions(
+                    dir_x[y0:y1, x0:x1], dir_y[y0:y1, x0:x1], dir_z[y0:y1, x0:x1], None, None, h_fov, v_fov, w, h,
+                    basis=basis)
             
-            for px in range(out_width):
-                # Azimuth for this column (0 to 360)
-                out_az = (px / out_width) * 360
-                
-                # Check if this output pixel falls within this image's FOV
-                src_coords = project_to_image(out_az, out_el, az, el, h_fov, v_fov, w, h)
+            # Bilinear interpolation
+            with timed(timings, 'remap'):
+                color = cv2.remap(img_float, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            
+            # Sample weight at the top-left source pixel
+            with timed(timings, 'accumulate'):
+                wt = np.where(valid, weight_mask[map_y.astype(np.int32), map_x.astype(np.int32)], 0).astype(np.float32)
                 
-                if src_coords is not None:
-                    sx, sy = src_coords
-                    
-                    # Bilinear interpolation
-                    x0, y0 = int(sx), int(sy)
-                    x1, y1 = min(x0 + 1, w - 1), min(y0 + 1, h - 1)
-                    fx, fy = sx - x0, sy - y0
-                    
-                    # Sample color
-                    color = (
-                        img_float[y0, x0] * (1-fx) * (1-fy) +
-                        img_float[y0, x1] * fx * (1-fy) +
-                        img_float[y1, x0] * (1-fx) * fy +
-                        img_float[y1, x1] * fx * fy
-                    )
-                    
-                    # Sample weight
-                    wt = weight_mask[y0, x0]
-                    
-                    # Accumulate
-                    output[py, px] += color * wt
-                    weights[py, px] += wt
+                # Accumulate
+                output[y0:y1, x0:x1] += color * wt[:, :, np.newaxis]
+                weights[y0:y1, x0:x1] += wt
         
         print(f"Projected image {idx + 1}/{len(images)}", file=sys.stderr)
     
     # Normalize by weights
-    mask = weights > 0.001
-    for c in range(3):
-        output[:, :, c][mask] /= weights[mask]
+    with timed(timings, 'normalize'):
+        mask = weights > 0.001
+        for c in range(3):
+            output[:, :, c][mask] /= weights[mask]
     
     # Fill gaps with gradient background
-    fill_background(output, weights)
+    with timed(timings, 'fill'):
+        fill_background(output, weights)
     
     # Convert back to uint8
     result = np.clip(output, 0, 255).astype(np.uint8)
     
     return True, result
 
+def smoothstep_ramp(length: int, feather: int) -> np.ndarray:
+    """1-D weight ramp: smoothstep from 0 over `feather` samples at both ends, 1 in the middle"""
+    ramp = np.ones(length, dtype=np.float32)
+    t = np.arange(feather, dtype=np.float32) / max(feather, 1)
+    weight = t * t * (3 - 2 * t)  # smoothstep
+    ramp[:feather] *= weight
+    ramp[::-1][:feather] *= weight
+    return ramp
+
+@lru_cache(maxsize=32)
 def create_feather_mask(width: int, height: int, feather_size: float = 0.15) -> np.ndarray:
-    """Create a feathered weight mask for smooth blending"""
-    mask = np.ones((height, width), dtype=np.float32)
-    
-    feather_x = int(width * feather_size)
-    feather_y = int(height * feather_size)
-    
-    # Horizontal feathering
-    for x in range(feather_x):
-        t = x / feather_x
-        weight = t * t * (3 - 2 * t)  # smoothstep
-        mask[:, x] *= weight
-        mask[:, width - 1 - x] *= weight
-    
-    # Vertical feathering
-    for y in range(feather_y):
-        t = y / feather_y
-        weight = t * t * (3 - 2 * t)  # smoothstep
-        mask[y, :] *= weight
-        mask[height - 1 - y, :] *= weight
-    
+    """
+    Create a feathered weight mask for smooth blending
+    Separable outer product of horizontal and vertical ramps, memoized per size (read-only)
+    """
+    ramp_x = smoothstep_ramp(width, int(width * feather_size))
+    ramp_y = smoothstep_ramp(height, int(height * feather_size))
+    mask = np.outer(ramp_y, ramp_x)
+    mask.setflags(write=False)
     return mask
 
 def project_to_image(out_az: float, out_el: float, img_az: float, img_el: float, 
@@ -267,60 +304,457 @@ def project_to_image(out_az: float, out_el: float, img_az: float, img_el: float,
     
     return (px, py)
 
-def fill_background(output: np.ndarray, weights: np.ndarray):
-    """Fill areas with no image data with a gradient background"""
-    h, w = output.shape[:2]
+def equirect_angle_grid(out_width: int, out_height: int) -> tuple[np.ndarray, np.ndarray]:
+    """Azimuth (0 to 360) and elevation (90 to -90) in degrees for every output pixel"""
+    out_az = np.arange(out_width, dtype=np.float64) / out_width * 360
+    out_el = 90 - np.arange(out_height, dtype=np.float64) / out_height * 180
+    return np.meshgrid(out_az, out_el)
+
+def direction_grid(out_az: np.ndarray, out_el: np.ndarray, dtype=np.float64) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Unit direction vectors for arrays of azimuth/elevation in degrees"""
+    out_az_rad = np.radians(out_az)
+    out_el_rad = np.radians(out_el)
+    cos_el = np.cos(out_el_rad)
+    dir_x = (cos_el * np.sin(out_az_rad)).astype(dtype)
+    dir_y = np.sin(out_el_rad).astype(dtype)
+    dir_z = (cos_el * np.cos(out_az_rad)).astype(dtype)
+    return dir_x, dir_y, dir_z
+
+@lru_cache(maxsize=2)
+def equirect_direction_grid(out_width: int, out_height: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Cached float32 direction vectors for every pixel of an equirectangular canvas"""
+    grid = direction_grid(*equirect_angle_grid(out_width, out_height), dtype=np.float32)
+    for arr in grid:
+        arr.setflags(write=False)
+    return grid
+
+def camera_basis(img_az: float, img_el: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Forward, right and up unit vectors for a camera (same convention as project_to_image)"""
+    img_az_rad = np.radians(img_az)
+    img_el_rad = np.radians(img_el)
+    fwd = np.array([np.cos(img_el_rad) * np.sin(img_az_rad), np.sin(img_el_rad), np.cos(img_el_rad) * np.cos(img_az_rad)])
+    right = np.array([np.cos(img_az_rad), 0.0, -np.sin(img_az_rad)])
+    up = np.array([-np.sin(img_el_rad) * np.sin(img_az_rad), np.cos(img_el_rad), -np.sin(img_el_rad) * np.cos(img_az_rad)])
+    return fwd, right, up
+
+def footprint_windows(cam_fwd, cam_right, cam_up, h_fov: float, v_fov: float,
+                      out_width: int, out_height: int, lon_origin: float = 0.0,
+                      samples: int = 64, margin: int = 2):
+    """
+    Pixel windows (y0, y1, x0, x1) of the equirectangular canvas that contain a camera's footprint.
+    
+    The FOV is a rectangle on the tangent plane, so its outline is traced in
+    camera space and rotated onto the sphere. Latitude and longitude extremes
+    of a region lie on its outline unless it contains a pole; poles are tested
+    directly and widen the window to the full longitude range. A footprint
+    crossing the 0°/360° seam is split into two windows.
+    """
+    tan_h = np.tan(np.radians(h_fov / 2))
+    tan_v = np.tan(np.radians(v_fov / 2))
+    
+    # Outline of the FOV rectangle on the image plane, walked as one closed loop
+    t = np.linspace(-1, 1, samples, endpoint=False)
+    ones = np.ones(samples)
+    edge_x = np.concatenate([t, ones, -t, -ones]) * tan_h
+    edge_y = np.concatenate([-ones, t, ones, -t]) * tan_v
+    dirs = np.outer(edge_x, cam_right) + np.outer(edge_y, cam_up) + cam_fwd
+    dirs /= np.linalg.norm(dirs, axis=1, keepdims=True)
+    
+    lat = np.degrees(np.arcsin(np.clip(dirs[:, 1], -1, 1)))
+    lat_min, lat_max = lat.min(), lat.max()
+    
+    # A pole is inside the footprint if it projects inside the FOV rectangle
+    full_width = False
+    for sign in (1, -1):
+        fwd = sign * cam_fwd[1]
+        if fwd > 0.01 and abs(sign * cam_right[1] / fwd) <= tan_h and abs(sign * cam_up[1] / fwd) <= tan_v:
+            full_width = True
+            if sign > 0:
+                lat_max = 90.0
+            else:
+                lat_min = -90.0
+    
+    y0 = max(int(np.floor((90 - lat_max) / 180 * out_height)) - margin, 0)
+    y1 = min(int(np.ceil((90 - lat_min) / 180 * out_height)) + margin + 1, out_height)
+    
+    if not full_width:
+        lon = np.unwrap(np.degrees(np.arctan2(dirs[:, 0], dirs[:, 2])), period=360)
+        # Longitude moves fast near the poles - pad by the largest step between outline samples
+        pad = np.abs(np.diff(lon)).max()
+        lon_min = lon.min() - pad
+        lon_max = lon.max() + pad
+        x0 = int(np.floor((lon_min - lon_origin) / 360 * out_width)) - margin
+        x1 = int(np.ceil((lon_max - lon_origin) / 360 * out_width)) + margin + 1
+        full_width = x1 - x0 >= out_width
+    
+    if full_width:
+        return [(y0, y1, 0, out_width)]
+    
+    # Shift into [0, width) and split at the seam
+    shift = (x0 // out_width) * out_width
+    x0 -= shift
+    x1 -= shift
+    if x1 <= out_width:
+        return [(y0, y1, x0, x1)]
+    return [(y0, y1, x0, out_width), (y0, y1, 0, x1 - out_width)]
+
+def project_directions(dir_x: np.ndarray, dir_y: np.ndarray, dir_z: np.ndarray, img_az: float, img_el: float,
+                       h_fov: float, v_fov: float, img_w: int, img_h: int,
+                       basis: tuple | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Array version of project_to_image for whole grids of direction vectors
+    Returns (map_x, map_y, valid); map_x/map_y are float32 and clamped so they can
+    feed cv2.remap directly, valid marks points inside the image's field of view
+    basis (fwd, right, up) replaces camera_basis(img_az, img_el), e.g. for a rolled camera
+    """
+    fwd, right, up = camera_basis(img_az, img_el) if basis is None else basis
+    
+    # Project directions onto camera basis
+    dot_fwd = dir_x * fwd[0] + dir_y * fwd[1] + dir_z * fwd[2]
+    dot_right = dir_x * right[0] + dir_z * right[2]
+    if right[1]:
+        dot_right += dir_y * right[1]
+    dot_up = dir_x * up[0] + dir_y * up[1] + dir_z * up[2]
+    
+    # Behind camera
+    in_front = dot_fwd > 0.01
+    inv_fwd = 1 / np.where(in_front, dot_fwd, 1)
     
-    for y in range(h):
-        t = y / h
+    # Project to image plane (gnomonic / tangent plane)
+    u = dot_right * inv_fwd * (0.5 / np.tan(np.radians(h_fov) / 2)) + 0.5
+    v = 0.5 - dot_up * inv_fwd * (0.5 / np.tan(np.radians(v_fov) / 2))
+    
+    # Check bounds
+    valid = in_front & (u >= 0) & (u <= 1) & (v >= 0) & (v <= 1)
+    
+    # Convert to pixel coordinates
+    map_x = np.clip(u * (img_w - 1), 0, img_w - 1).astype(np.float32)
+    map_y = np.clip(v * (img_h - 1), 0, img_h - 1).astype(np.float32)
+    
+    return map_x, map_y, valid
+
+# Pose refinement ('seeded' mode): features are matched only between cameras whose sensor
+# footprints overlap, and bundle adjustment starts from the sensor orientations
+
+# Registration runs on images downscaled to about this many megapixels (cv2.Stitcher's default)
+REGISTRATION_MEGAPIX = 0.6
+# ORB keypoints per registration image; more helps sparse rigs but matching cost grows with it
+REGISTRATION_FEATURES = 800
+# Pairs are matched if their footprints overlap by at least this fraction of the FOV
+MIN_PAIR_OVERLAP = 0.1
+# Matches below this cv2.detail confidence don't link two cameras
+MATCH_CONFIDENCE = 1.0
+# Refined orientations further than this (degrees) from the sensor pose are discarded
+MAX_POSE_CORRECTION = 15.0
+# Refined focal lengths outside this ratio of the nominal FOV's are discarded
+MAX_FOCAL_CHANGE = 1.25
+
+# Running estimates of registration costs in seconds (per image, per pair, per image),
+# updated after every refinement; used to decide if refinement fits a time budget
+REGISTRATION_COSTS = {'features': 0.05, 'match': 0.03, 'adjust': 0.01}
+
+class FeatureCache:
+    """
+    LRU cache of ORB features of downscaled images, keyed by a hash of the
+    downscaled pixels, so images seen again (retries, reused captures, the
+    --serve worker) skip detection
+    
+    Matching needs each image's img_idx set on its features, and
+    cv2.detail.ImageFeatures can't be copied from Python, so an entry is
+    lent to one user at a time: acquire() marks it in use until release(),
+    and anyone else asking for the same key (a concurrent request, or the
+    same image twice in one request) gets freshly computed features.
+    """
+    
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.in_use = set()
+        self.lock = threading.Lock()
+        # ORB detectors aren't thread-safe, so each thread gets its own
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(small: np.ndarray) -> str:
+        return f"{hashlib.sha1(small.tobytes()).hexdigest()}:{small.shape}"
+    
+    def acquire(self, small: np.ndarray, key: str) -> tuple[cv2.detail.ImageFeatures, bool]:
+        """Features of an already downscaled image, and whether they were lent (release them later)"""
+        with self.lock:
+            if key in self.entries and key not in self.in_use:
+                self.entries.move_to_end(key)
+                self.in_use.add(key)
+                self.hits += 1
+                return self.entries[key], True
+            self.misses += 1
         
-        # Sky to ground gradient
-        if t < 0.3:
-            color = [46, 26, 26]  # Dark blue (BGR)
-        elif t < 0.45:
-            lt = (t - 0.3) / 0.15
-            color = [
-                46 + (235 - 46) * lt,
-                26 + (206 - 26) * lt,
-                26 + (135 - 26) * lt
-            ]
-        elif t < 0.55:
-            lt = (t - 0.45) / 0.1
-            color = [
-                235 + (180 - 235) * lt,
-                206 + (200 - 206) * lt,
-                135 + (200 - 135) * lt
-            ]
-        elif t < 0.7:
-            lt = (t - 0.55) / 0.15
-            color = [
-                180 + (85 - 180) * lt,
-                200 + (115 - 200) * lt,
-                200 + (139 - 200) * lt
-            ]
-        else:
-            lt = (t - 0.7) / 0.3
-            color = [
-                85 + (50 - 85) * lt,
-                115 + (50 - 115) * lt,
-                139 + (50 - 139) * lt
-            ]
+        if not hasattr(self.local, 'finder'):
+            self.local.finder = cv2.ORB.create(nfeatures=REGISTRATION_FEATURES)
+        features = cv2.detail.computeImageFeatures2(self.local.finder, small)
         
-        for x in range(w):
-            if weights[y, x] < 0.01:
-                output[y, x] = color
+        with self.lock:
+            if key in self.entries or key in self.in_use:
+                return features, False
+            self.entries[key] = features
+            self.in_use.add(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return features, True
+    
+    def release(self, keys):
+        with self.lock:
+            self.in_use.difference_update(keys)
 
-def main():
-    """Main entry point - reads JSON from stdin, outputs result to stdout"""
+feature_cache = FeatureCache()
+
+# cv2.detail rotations map camera rays (x right, y down, z forward) to a right-handed world;
+# this module's world has y up, so its y axis is flipped on the way in and out
+FLIP_Y = np.diag([1.0, -1.0, 1.0])
+
+def basis_to_rotation(fwd: np.ndarray, right: np.ndarray, up: np.ndarray) -> np.ndarray:
+    """cv2.detail camera rotation for a (fwd, right, up) basis (see camera_basis)"""
+    return FLIP_Y @ np.column_stack([right, -up, fwd])
+
+def rotation_to_basis(R: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Inverse of basis_to_rotation"""
+    M = FLIP_Y @ np.asarray(R, dtype=np.float64)
+    return M[:, 2].copy(), M[:, 0].copy(), -M[:, 1]
+
+def overlapping_pairs(bases: list, h_fov: float, v_fov: float, min_overlap: float = MIN_PAIR_OVERLAP) -> np.ndarray:
+    """
+    Upper-triangular uint8 mask of camera pairs whose footprints overlap,
+    judged by the angle between optical axes measured in the first camera's
+    horizontal and vertical planes
+    """
+    mask = np.zeros((len(bases), len(bases)), dtype=np.uint8)
+    for i, (fwd_i, right_i, up_i) in enumerate(bases):
+        for j in range(i + 1, len(bases)):
+            fwd_j = bases[j][0]
+            depth = np.dot(fwd_j, fwd_i)
+            if depth <= 0:
+                continue
+            across = np.degrees(abs(np.arctan2(np.dot(fwd_j, right_i), depth)))
+            along = np.degrees(abs(np.arctan2(np.dot(fwd_j, up_i), depth)))
+            if across < h_fov * (1 - min_overlap) and along < v_fov * (1 - min_overlap):
+                mask[i, j] = 1
+    return mask
+
+def linked_components(pairwise_matches, count: int, confidence: float = MATCH_CONFIDENCE) -> list[list[int]]:
+    """Groups of cameras connected by confident matches (union-find over the match graph)"""
+    parent = list(range(count))
+    
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    for match in pairwise_matches:
+        if match.src_img_idx >= 0 and match.confidence >= confidence:
+            parent[root(match.src_img_idx)] = root(match.dst_img_idx)
+    groups = {}
+    for i in range(count):
+        groups.setdefault(root(i), []).append(i)
+    return list(groups.values())
+
+def align_rotations(refined: list[np.ndarray], sensor: list[np.ndarray]) -> np.ndarray:
+    """
+    Global rotation that best maps refined onto sensor rotations (Kabsch).
+    Bundle adjustment only fixes relative orientations; this puts a group
+    back into the sensor frame so north and the horizon stay where they were
+    """
+    U, _, Vt = np.linalg.svd(sum(S @ R.T for R, S in zip(refined, sensor)))
+    D = np.diag([1.0, 1.0, np.sign(np.linalg.det(U @ Vt))])
+    return U @ D @ Vt
+
+def rotation_angle(A: np.ndarray, B: np.ndarray) -> float:
+    """Angle in degrees of the rotation between A and B"""
+    return float(np.degrees(np.arccos(np.clip((np.trace(A.T @ B) - 1) / 2, -1, 1))))
+
+def refine_poses(images: list[np.ndarray], azimuths: list[float], elevations: list[float],
+                 h_fov: float = 55, v_fov: float = 75, time_budget: float | None = None,
+                 timings: dict | None = None) -> tuple[list, float, float, dict]:
+    """
+    Refine sensor orientations (and the shared FOV) by feature matching
+    
+    Features come from images downscaled to REGISTRATION_MEGAPIX (cached in
+    feature_cache); only pairs that overlap according to the sensor poses are
+    matched, and bundle adjustment starts from the sensor orientations, so
+    no all-pairs matching or homography-based initialisation is needed.
+    Each group of linked cameras is rotated back into the sensor frame;
+    cameras without confident matches, or whose correction exceeds
+    MAX_POSE_CORRECTION, keep their sensor pose.
+    
+    If time_budget (seconds) can't fit the estimated registration cost
+    (REGISTRATION_COSTS) the remaining steps are skipped and the sensor poses
+    are returned, so the caller goes straight to direct projection.
+    
+    Returns (bases, h_fov, v_fov, report); bases holds one (fwd, right, up) per image.
+    """
+    start = time.perf_counter()
+    cache_hits = feature_cache.hits
+    sensor_bases = [camera_basis(az, el) for az, el in zip(azimuths, elevations)]
+    report = {'images': len(images), 'pairs': 0, 'matched': 0, 'refined': 0}
+    
+    def skip(reason):
+        report['skipped'] = reason
+        report['seconds'] = round(time.perf_counter() - start, 3)
+        return sensor_bases, h_fov, v_fov, report
+    
+    def over_budget(cost):
+        return time_budget is not None and time.perf_counter() - start + cost > time_budget
+    
+    present = [i for i, img in enumerate(images) if img is not None]
+    pair_mask = overlapping_pairs([sensor_bases[i] for i in present], h_fov, v_fov)
+    report['pairs'] = int(pair_mask.sum())
+    if report['pairs'] == 0:
+        return skip('no overlapping pairs')
+    
+    estimate = (len(present) * (REGISTRATION_COSTS['features'] + REGISTRATION_COSTS['adjust'])
+                + report['pairs'] * REGISTRATION_COSTS['match'])
+    if over_budget(estimate):
+        return skip('time budget')
+    
+    # Features on downscaled images; cached entries are lent until bundle adjustment is done
+    borrowed = []
     try:
-        # Read input JSON
-        input_data = json.load(sys.stdin)
+        features = []
+        scales = []
+        with timed(timings, 'features'):
+            for idx, i in enumerate(present):
+                img = images[i]
+                scale = min(1.0, np.sqrt(REGISTRATION_MEGAPIX * 1e6 / (img.shape[0] * img.shape[1])))
+                small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else img
+                key = FeatureCache.key(small)
+                image_features, lent = feature_cache.acquire(small, key)
+                if lent:
+                    borrowed.append(key)
+                image_features.img_idx = idx
+                features.append(image_features)
+                scales.append(scale)
+        feature_seconds = time.perf_counter() - start
         
+        if over_budget(report['pairs'] * REGISTRATION_COSTS['match'] + len(present) * REGISTRATION_COSTS['adjust']):
+            return skip('time budget')
+        
+        # Match overlapping neighbours only
+        match_start = time.perf_counter()
+        with timed(timings, 'match'):
+            matcher = cv2.detail_BestOf2NearestMatcher(False, 0.3)
+            pairwise_matches = matcher.apply2(features, pair_mask)
+            matcher.collectGarbage()
+        match_seconds = time.perf_counter() - match_start
+        report['matched'] = sum(1 for m in pairwise_matches
+                                if 0 <= m.src_img_idx < m.dst_img_idx and m.confidence >= MATCH_CONFIDENCE)
+        if report['matched'] == 0:
+            return skip('no confident matches')
+        
+        # Bundle adjustment seeded with the sensor orientations and nominal focal lengths
+        sensor_rotations = [basis_to_rotation(*sensor_bases[i]) for i in present]
+        nominal_focals = []
+        cameras = []
+        for idx, i in enumerate(present):
+            h, w = images[i].shape[:2]
+            focal_x = scales[idx] * (w - 1) / 2 / np.tan(np.radians(h_fov) / 2)
+            focal_y = scales[idx] * (h - 1) / 2 / np.tan(np.radians(v_fov) / 2)
+            camera = cv2.detail.CameraParams()
+            camera.focal = focal_x
+            camera.aspect = focal_y / focal_x
+            camera.ppx = scales[idx] * (w - 1) / 2
+            camera.ppy = scales[idx] * (h - 1) / 2
+            camera.R = sensor_rotations[idx].astype(np.float32)
+            cameras.append(camera)
+            nominal_focals.append(focal_x)
+        
+        adjust_start = time.perf_counter()
+        with timed(timings, 'adjust'):
+            # BundleAdjusterRay assumes square pixels; the reprojection adjuster keeps our aspect
+            adjuster = cv2.detail_BundleAdjusterReproj()
+            adjuster.setConfThresh(MATCH_CONFIDENCE)
+            refine_mask = np.zeros((3, 3), np.uint8)
+            refine_mask[0, 0] = 1  # focal only
+            adjuster.setRefinementMask(refine_mask)
+            # Sensor seeds start close to the optimum, so a few iterations are enough
+            adjuster.setTermCriteria((cv2.TERM_CRITERIA_COUNT + cv2.TERM_CRITERIA_EPS, 100, 1e-3))
+            ok, cameras = adjuster.apply(features, pairwise_matches, cameras)
+        adjust_seconds = time.perf_counter() - adjust_start
+    finally:
+        feature_cache.release(borrowed)
+    
+    # Blend the measured costs into the running estimates
+    for stage, seconds, count in (('features', feature_seconds, len(present)),
+                                  ('match', match_seconds, report['pairs']),
+                                  ('adjust', adjust_seconds, len(present))):
+        REGISTRATION_COSTS[stage] = 0.7 * REGISTRATION_COSTS[stage] + 0.3 * seconds / max(count, 1)
+    
+    if not ok:
+        return skip('bundle adjustment failed')
+    
+    bases = list(sensor_bases)
+    focal_ratios = []
+    for group in linked_components(pairwise_matches, len(present)):
+        if len(group) < 2:
+            continue
+        refined = [np.asarray(cameras[idx].R, dtype=np.float64) for idx in group]
+        correction = align_rotations(refined, [sensor_rotations[idx] for idx in group])
+        for idx, R in zip(group, refined):
+            R = correction @ R
+            if rotation_angle(R, sensor_rotations[idx]) <= MAX_POSE_CORRECTION:
+                bases[present[idx]] = rotation_to_basis(R)
+                focal_ratios.append(cameras[idx].focal / nominal_focals[idx])
+                report['refined'] += 1
+    
+    # All captures share one lens, so use the median focal change for every camera
+    if focal_ratios:
+        ratio = float(np.median(focal_ratios))
+        if 1 / MAX_FOCAL_CHANGE <= ratio <= MAX_FOCAL_CHANGE:
+            h_fov = float(np.degrees(2 * np.arctan(np.tan(np.radians(h_fov) / 2) / ratio)))
+            v_fov = float(np.degrees(2 * np.arctan(np.tan(np.radians(v_fov) / 2) / ratio)))
+    
+    report['fov'] = [round(h_fov, 2), round(v_fov, 2)]
+    report['featureCacheHits'] = feature_cache.hits - cache_hits
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    return bases, h_fov, v_fov, report
+
+# Sky to ground gradient stops: (position from top, BGR color)
+BACKGROUND_STOPS = [
+    (0.0, (46, 26, 26)),     # Dark blue
+    (0.3, (46, 26, 26)),
+    (0.45, (235, 206, 135)),
+    (0.55, (180, 200, 200)),
+    (0.7, (85, 115, 139)),
+    (1.0, (50, 50, 50)),
+]
+
+@lru_cache(maxsize=4)
+def background_gradient(height: int) -> np.ndarray:
+    """Per-row BGR gradient column of shape (height, 3), memoized per height (read-only)"""
+    t = np.arange(height, dtype=np.float64) / height
+    stops = [pos for pos, _ in BACKGROUND_STOPS]
+    column = np.stack([
+        np.interp(t, stops, [color[c] for _, color in BACKGROUND_STOPS])
+        for c in range(3)
+    ], axis=1).astype(np.float32)
+    column.setflags(write=False)
+    return column
+
+def fill_background(output: np.ndarray, weights: np.ndarray):
+    """Fill areas with no image data with a gradient background"""
+    gradient = background_gradient(output.shape[0])
+    np.copyto(output, gradient[:, np.newaxis, :], where=(weights < 0.01)[:, :, np.newaxis])
+
+def handle_request(input_data: dict) -> dict:
+    """
+    Stitch one request document ({"images": [...], "mode": ..., "timeBudget": ...})
+    and return the response document; errors are reported in the response
+    """
+    try:
         images_data = input_data.get('images', [])
         
         if not images_data:
-            print(json.dumps({'success': False, 'error': 'No images provided'}))
-            return
+            return {'success': False, 'error': 'No images provided'}
         
         print(f"Processing {len(images_data)} images...", file=sys.stderr)
         
@@ -338,26 +772,410 @@ def main():
                 print(f"Loaded image: az={img_data.get('azimuth', 0)}, el={img_data.get('elevation', 0)}, size={img.shape}", file=sys.stderr)
         
         if len(images) < 2:
-            print(json.dumps({'success': False, 'error': 'Could not decode enough images'}))
-            return
+            return {'success': False, 'error': 'Could not decode enough images'}
         
         # Try stitching
-        print("Starting OpenCV stitching...", file=sys.stderr)
-        success, result = stitch_spherical_panorama(images, azimuths, elevations)
+        mode = input_data.get('mode') or 'stitcher'
+        time_budget = input_data.get('timeBudget')
+        print(f"Starting OpenCV stitching ({mode})...", file=sys.stderr)
+        registration = {}
+        success, result = stitch_spherical_panorama(images, azimuths, elevations, mode=mode,
+                                                    time_budget=None if time_budget is None else float(time_budget),
+                                                    registration=registration)
         
-        if success:
-            # Encode result
-            result_base64 = encode_image_base64(result, '.jpg', 92)
-            print(f"Stitching successful! Output size: {result.shape}", file=sys.stderr)
-            print(json.dumps({'success': True, 'panorama': result_base64}))
-        else:
-            print(json.dumps({'success': False, 'error': str(result)}))
-            
+        if not success:
+            return {'success': False, 'error': str(result)}
+        
+        # Encode result
+        result_base64 = encode_image_base64(result, '.jpg', 92)
+        print(f"Stitching successful! Output size: {result.shape}", file=sys.stderr)
+        output = {'success': True, 'panorama': result_base64}
+        if registration:
+            output['registration'] = registration
+        return output
+    
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
-        import traceback
         traceback.print_exc(file=sys.stderr)
+        return {'success': False, 'error': str(e)}
+
+def main():
+    """Main entry point - reads JSON from stdin, outputs result to stdout"""
+    try:
+        input_data = json.load(sys.stdin)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
         print(json.dumps({'success': False, 'error': str(e)}))
+        return
+    print(json.dumps(handle_request(input_data)))
+
+def warm_up(out_width: int = 4096, out_height: int = 2048) -> float:
+    """Build the lookup tables every stitch uses, so the first request doesn't pay for them; returns seconds"""
+    start = time.perf_counter()
+    equirect_direction_grid(out_width, out_height)
+    background_gradient(out_height)
+    return time.perf_counter() - start
+
+class StitchWorker:
+    """
+    Long-lived stitching worker (--serve), so callers don't pay interpreter
+    start-up, the cv2/NumPy import and table building on every request.
+    
+    Protocol, one JSON document per line in both directions:
+    - on start (and on every socket connection) the worker writes
+      {"event": "ready", "pid", "concurrency", "inFlight", "warmupSeconds"}
+    - a request is the one-shot stdin document plus an optional "id"; the
+      response is the one-shot stdout document with the same "id".
+      Up to `concurrency` requests run at once and responses are written
+      as they finish, so they may arrive out of order
+    - {"id": ..., "command": "ping"} is answered with the ready document;
+      commands never count as in-flight requests, and unknown ones are
+      answered with an error
+    - at end of input, pending requests are finished before returning
+    """
+    
+    def __init__(self, concurrency: int = 2):
+        self.concurrency = max(concurrency, 1)
+        self.executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='stitch')
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.warmup_seconds = warm_up()
+    
+    def status(self) -> dict:
+        with self.lock:
+            in_flight = self.in_flight
+        return {'event': 'ready', 'pid': os.getpid(), 'concurrency': self.concurrency,
+                'inFlight': in_flight, 'warmupSeconds': round(self.warmup_seconds, 3)}
+    
+    def run(self, request: dict, send):
+        try:
+            response = handle_request(request)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        send({'id': request.get('id'), **response})
+    
+    def serve_stream(self, reader, writer):
+        """Answer the requests read from reader (text lines) on writer"""
+        write_lock = threading.Lock()
+        
+        def send(doc: dict):
+            line = json.dumps(doc) + '\n'
+            try:
+                with write_lock:
+                    writer.write(line)
+                    writer.flush()
+            except (BrokenPipeError, ConnectionError, ValueError) as e:
+                print(f"Could not send response {doc.get('id')}: {e}", file=sys.stderr)
+        
+        send(self.status())
+        pending = []
+        for line in reader:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('request must be a JSON object')
+            except ValueError as e:
+                send({'id': None, 'success': False, 'error': f"Invalid request: {e}"})
+                continue
+            
+            # Control commands are answered here, before the request is counted as in flight
+            command = request.get('command')
+            if command == 'ping':
+                send({'id': request.get('id'), **self.status()})
+                continue
+            if command is not None:
+                send({'id': request.get('id'), 'success': False, 'error': f"Unknown command '{command}'"})
+                continue
+            
+            with self.lock:
+                self.in_flight += 1
+            pending = [future for future in pending if not future.done()]
+            pending.append(self.executor.submit(self.run, request, send))
+        wait(pending)
+    
+    def serve_socket(self, path: str):
+        """Listen on a Unix socket; every connection speaks the same protocol as stdin/stdout"""
+        worker = self
+        
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                worker.serve_stream(io.TextIOWrapper(self.rfile, encoding='utf-8'),
+                                    io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True))
+        
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        server.daemon_threads = True
+        # Exit through the finally below on SIGTERM too, so the socket file is removed
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        print(json.dumps({**self.status(), 'socket': path}), flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(path)
+
+# Source image files a capture set may contain (each with a <stem>.json pose sidecar)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp', '.bmp')
+
+# Written in the output directory by --batch unless --progress says otherwise
+BATCH_PROGRESS_FILE = 'batch-progress.json'
+
+def read_pose(sidecar: Path) -> tuple[float, float]:
+    """(azimuth, elevation) from a pose sidecar ({"azimuth": ..., "elevation": ...}, as in requests)"""
+    pose = json.loads(sidecar.read_text())
+    return float(pose['azimuth']), float(pose.get('elevation', 0))
+
+def capture_set_from_dir(directory: Path, name: str) -> dict | None:
+    """
+    Capture set of the images in directory that have a pose sidecar, or None
+    if there are none. Images without a sidecar are skipped with a warning.
+    """
+    images = []
+    for path in sorted(directory.iterdir()):
+        if path.suffix.lower() not in IMAGE_EXTENSIONS or not path.is_file():
+            continue
+        sidecar = path.with_suffix('.json')
+        if not sidecar.is_file():
+            print(f"Skipping {path}: no pose sidecar {sidecar.name}", file=sys.stderr)
+            continue
+        azimuth, elevation = read_pose(sidecar)
+        images.append({'path': str(path), 'azimuth': azimuth, 'elevation': elevation})
+    return {'name': name, 'images': images} if images else None
+
+def find_capture_sets(source: str) -> list[dict]:
+    """
+    Capture sets ({"name", "images": [{"path", "azimuth", "elevation"}]}) to
+    stitch in batch mode. source is either a directory, where every directory
+    below it (itself included) holding images with pose sidecars is one set
+    named by its relative path, or a JSON manifest: a list whose entries are
+    set directories or set objects, with paths relative to the manifest.
+    """
+    root = Path(source)
+    if root.is_dir():
+        sets = []
+        for directory, subdirs, _ in os.walk(root):
+            subdirs.sort()
+            name = Path(directory).relative_to(root).as_posix()
+            capture_set = capture_set_from_dir(Path(directory), root.name if name == '.' else name)
+            if capture_set:
+                sets.append(capture_set)
+        return sets
+    
+    entries = json.loads(root.read_text())
+    if not isinstance(entries, list):
+        raise ValueError(f"{source}: manifest must be a JSON list of capture sets")
+    sets = []
+    for entry in entries:
+        if isinstance(entry, str):
+            directory = root.parent / entry
+            capture_set = capture_set_from_dir(directory, entry)
+            if capture_set is None:
+                raise ValueError(f"{directory}: no images with pose sidecars")
+        else:
+            capture_set = {'name': entry['name'], 'images': [
+                {'path': str(root.parent / image['path']), 'azimuth': float(image['azimuth']),
+                 'elevation': float(image.get('elevation', 0))}
+                for image in entry['images']]}
+        sets.append(capture_set)
+    return sets
+
+def capture_set_fingerprint(capture_set: dict, settings: dict) -> str:
+    """Hash of the set's files (path, size, mtime), poses and the stitch settings, to tell stale results"""
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    for image in capture_set['images']:
+        stat = os.stat(image['path'])
+        digest.update(f"{image['path']}\0{stat.st_size}\0{stat.st_mtime_ns}\0"
+                      f"{image['azimuth']}\0{image['elevation']}\n".encode())
+    return digest.hexdigest()
+
+class BatchProgress:
+    """
+    Resumable record of a batch run, saved as JSON after every finished set:
+    {"sets": {name: {"status": "done" | "failed", "fingerprint", "output",
+    "images", "seconds", "timings", "error"}}}. A set is skipped on the next
+    run only if it is done, its output still exists and its fingerprint
+    (see capture_set_fingerprint) hasn't changed.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.sets = {}
+        if path.exists():
+            self.sets = json.loads(path.read_text()).get('sets', {})
+    
+    def is_done(self, name: str, fingerprint: str) -> bool:
+        entry = self.sets.get(name)
+        return (entry is not None and entry['status'] == 'done' and entry['fingerprint'] == fingerprint
+                and os.path.exists(entry['output']))
+    
+    def record(self, name: str, entry: dict):
+        self.sets[name] = entry
+        self.save()
+    
+    def save(self):
+        # Written under another name and renamed, so an interrupted run never leaves a truncated file
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        tmp_path.write_text(json.dumps({'sets': self.sets}, indent=2))
+        os.replace(tmp_path, self.path)
+
+def batch_worker_init():
+    """Process pool initializer: one OpenCV thread per process (the pool provides the parallelism), warm tables"""
+    cv2.setNumThreads(1)
+    warm_up()
+
+def stitch_capture_set(capture_set: dict, output: str, mode: str, time_budget: float | None,
+                       quality: int) -> dict:
+    """
+    Stitch one capture set from disk and write the panorama to output (JPEG);
+    returns its progress entry (see BatchProgress) without the fingerprint
+    """
+    start = time.perf_counter()
+    timings = {}
+    entry = {'status': 'failed', 'output': output, 'images': len(capture_set['images'])}
+    try:
+        images, azimuths, elevations = [], [], []
+        with timed(timings, 'decode'):
+            for image in capture_set['images']:
+                img = cv2.imread(image['path'], cv2.IMREAD_COLOR)
+                if img is None:
+                    print(f"Could not decode {image['path']}", file=sys.stderr)
+                    continue
+                images.append(img)
+                azimuths.append(image['azimuth'])
+                elevations.append(image['elevation'])
+        
+        if len(images) < 2:
+            entry['error'] = 'Could not decode enough images'
+        else:
+            registration = {}
+            success, result = stitch_spherical_panorama(images, azimuths, elevations, mode=mode,
+                                                        time_budget=time_budget, timings=timings,
+                                                        registration=registration)
+            if not success:
+                entry['error'] = str(result)
+            else:
+                with timed(timings, 'encode'):
+                    ok, buffer = cv2.imencode('.jpg', result, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                    if not ok:
+                        raise ValueError('Could not encode the panorama')
+                    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+                    tmp_path = f"{output}.{os.getpid()}.tmp"
+                    with open(tmp_path, 'wb') as f:
+                        f.write(buffer.tobytes())
+                    os.replace(tmp_path, output)
+                entry['status'] = 'done'
+                if registration:
+                    entry['registration'] = registration
+    except Exception as e:
+        print(f"Error in {capture_set['name']}: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        entry['error'] = str(e)
+    
+    entry['seconds'] = round(time.perf_counter() - start, 3)
+    entry['timings'] = {stage: round(seconds, 3) for stage, seconds in timings.items()}
+    return entry
+
+def run_batch(source: str, output_dir: str, jobs: int, mode: str = 'stitcher', time_budget: float | None = None,
+              quality: int = 92, progress_path: str | None = None, force: bool = False) -> bool:
+    """
+    Stitch every capture set found in source (see find_capture_sets) on a
+    pool of `jobs` processes, writing <output_dir>/<set name>.jpg. Sets
+    finished by an earlier run are skipped (see BatchProgress) unless force.
+    Prints per-set timings and the aggregate throughput; returns whether
+    every set succeeded.
+    """
+    if mode not in STITCH_MODES:
+        raise ValueError(f"Unknown stitch mode '{mode}' (expected {', '.join(STITCH_MODES)})")
+    sets = find_capture_sets(source)
+    os.makedirs(output_dir, exist_ok=True)
+    progress = BatchProgress(Path(progress_path or os.path.join(output_dir, BATCH_PROGRESS_FILE)))
+    settings = {'mode': mode, 'timeBudget': time_budget, 'quality': quality}
+    
+    todo, skipped = [], []
+    for capture_set in sets:
+        fingerprint = capture_set_fingerprint(capture_set, settings)
+        if not force and progress.is_done(capture_set['name'], fingerprint):
+            skipped.append(capture_set['name'])
+        else:
+            todo.append((capture_set, fingerprint))
+    # Largest sets first, so a big one doesn't start last and leave the other processes idle
+    todo.sort(key=lambda item: len(item[0]['images']), reverse=True)
+    print(f"Batch: {len(sets)} capture sets, {len(skipped)} already done, {len(todo)} to stitch "
+          f"on {jobs} processes", file=sys.stderr)
+    
+    finished = []
+    start = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    executor = ProcessPoolExecutor(jobs, mp_context=context, initializer=batch_worker_init)
+    try:
+        futures = {}
+        for capture_set, fingerprint in todo:
+            output = os.path.join(output_dir, capture_set['name'] + '.jpg')
+            future = executor.submit(stitch_capture_set, capture_set, output, mode, time_budget, quality)
+            futures[future] = (capture_set['name'], fingerprint)
+        for future in as_completed(futures):
+            name, fingerprint = futures[future]
+            entry = {**future.result(), 'fingerprint': fingerprint}
+            progress.record(name, entry)
+            finished.append(name)
+            print(f"[{len(finished)}/{len(todo)}] {name}: {entry['status']} in {entry['seconds']:.1f}s"
+                  + (f" ({entry['error']})" if 'error' in entry else ''), file=sys.stderr)
+    except KeyboardInterrupt:
+        print("Interrupted; finished sets are recorded, run again to resume", file=sys.stderr)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    wall = time.perf_counter() - start
+    
+    print(f"{'set':<40} {'status':>8} {'images':>6} {'seconds':>8}  stages")
+    for name in sorted(finished):
+        entry = progress.sets[name]
+        stages = ' '.join(f"{stage}={seconds:.2f}" for stage, seconds in entry['timings'].items())
+        print(f"{name:<40} {entry['status']:>8} {entry['images']:>6} {entry['seconds']:>8.2f}  {stages}")
+    
+    done = [progress.sets[name] for name in finished if progress.sets[name]['status'] == 'done']
+    failed = len(finished) - len(done)
+    images = sum(entry['images'] for entry in done)
+    busy = sum(progress.sets[name]['seconds'] for name in finished)
+    print(f"{len(done)} stitched, {failed} failed, {len(skipped)} skipped in {wall:.1f}s wall "
+          f"({len(done) / wall * 60 if wall else 0:.1f} sets/min, {images / wall if wall else 0:.1f} images/s, "
+          f"{busy:.1f} process-seconds, {busy / wall if wall else 0:.1f}x parallel)")
+    return failed == 0 and len(finished) == len(todo)
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Stitch a panorama from the JSON request on stdin')
+    parser.add_argument('--serve', action='store_true',
+                        help='keep running and answer newline-delimited JSON requests (see StitchWorker)')
+    parser.add_argument('--socket', help='with --serve, listen on this Unix socket instead of stdin/stdout')
+    parser.add_argument('--concurrency', type=int, default=2, help='with --serve, requests stitched at once')
+    parser.add_argument('--batch', metavar='SOURCE',
+                        help='stitch every capture set in this directory or JSON manifest (see find_capture_sets)')
+    parser.add_argument('--output', help='with --batch, directory the panoramas are written to')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='with --batch, processes stitching at once')
+    parser.add_argument('--mode', default='stitcher', choices=STITCH_MODES, help='with --batch, stitch mode')
+    parser.add_argument('--time-budget', type=float, help='with --batch, seconds allowed for pose refinement per set')
+    parser.add_argument('--quality', type=int, default=92, help='with --batch, JPEG quality')
+    parser.add_argument('--progress', help=f"with --batch, progress manifest (default <output>/{BATCH_PROGRESS_FILE})")
+    parser.add_argument('--force', action='store_true', help='with --batch, restitch sets an earlier run finished')
+    args = parser.parse_args()
+    
+    if args.batch:
+        if not args.output:
+            parser.error('--batch needs --output')
+        ok = run_batch(args.batch, args.output, max(args.jobs, 1), args.mode, args.time_budget, args.quality,
+                       args.progress, args.force)
+        sys.exit(0 if ok else 1)
+    
+    if args.serve:
+        worker = StitchWorker(args.concurrency)
+        if args.socket:
+            worker.serve_socket(args.socket)
+        else:
+            worker.serve_stream(sys.stdin, sys.stdout)
+    else:
+        main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service and the stitching script are plain modules in scripts/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
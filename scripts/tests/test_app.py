@@ -0,0 +1,268 @@
+import base64
+import hashlib
+import io
+import json
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import app
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'result_cache', app.ResultCache(str(tmp_path), 64 * 1024 * 1024))
+    return app.app.test_client()
+
+def capture_images(count: int = 4) -> list:
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(count):
+        img = cv2.GaussianBlur(rng.integers(0, 256, (320, 240, 3), dtype=np.uint8), (0, 0), 3)
+        data = base64.b64encode(cv2.imencode('.jpg', img)[1].tobytes()).decode()
+        images.append({'data': f"data:image/jpeg;base64,{data}", 'azimuth': i * 90, 'elevation': 0})
+    return images
+
+def test_auto_quality_cache_key_follows_resolved_tier(client):
+    images = capture_images()
+    low, high = 1, 1000
+    assert app.select_quality_tier('auto', low, len(images)) != app.select_quality_tier('auto', high, len(images))
+    
+    first = client.post('/stitch', json={'images': images, 'timeBudget': low})
+    second = client.post('/stitch', json={'images': images, 'timeBudget': high})
+    assert first.status_code == second.status_code == 200
+    assert second.json['quality'] == app.select_quality_tier('auto', high, len(images)) != first.json['quality']
+    assert second.json['cached'] is False
+    assert second.json['cacheKey'] != first.json['cacheKey']
+    
+    # Same resolved tier, same entry
+    again = client.post('/stitch', json={'images': images, 'quality': first.json['quality']})
+    assert again.json['cached'] is True
+    assert again.json['cacheKey'] == first.json['cacheKey']
+
+def test_auto_quality_accounts_for_image_count(monkeypatch):
+    monkeypatch.setattr(app, '_seconds_per_megapixel_image', 0.1)
+    full = app.QUALITY_TIERS['full']
+    budget = full['width'] * full['height'] / 1e6 * 8 * 0.1
+    assert app.estimate_stitch_seconds('full', 16) == pytest.approx(2 * app.estimate_stitch_seconds('full', 8))
+    assert app.select_quality_tier('auto', budget, 8) == 'full'
+    assert app.select_quality_tier('auto', budget, 26) == 'standard'
+    assert app.select_quality_tier('full', 1, 26) == 'full'
+
+def test_session_pushes_respect_image_limit(client, monkeypatch):
+    monkeypatch.setattr(app, 'MAX_STITCH_IMAGES', 3)
+    session_id = client.post('/sessions', json={'quality': 'preview'}).json['sessionId']
+    try:
+        images = capture_images()
+        assert client.post(f'/sessions/{session_id}/images', json={'images': images[:2]}).status_code == 200
+        rejected = client.post(f'/sessions/{session_id}/images', json={'images': images[2:]})
+        assert rejected.status_code == 413
+        assert client.post(f'/sessions/{session_id}/images', json={'images': images[2:3]}).json['imageCount'] == 3
+    finally:
+        client.delete(f'/sessions/{session_id}')
+
+def test_expired_session_releases_its_reservation(client, monkeypatch):
+    session_bytes = app.estimate_stitch_bytes([], 'full', 'feather', [], strips=False)
+    monkeypatch.setattr(app, 'admission', app.StitchAdmission(2, session_bytes + 1024 * 1024))
+    monkeypatch.setattr(app, 'SESSION_TTL_SECONDS', 30)
+    session_id = client.post('/sessions', json={'quality': 'full'}).json['sessionId']
+    body = {'images': capture_images(), 'quality': 'preview'}
+    try:
+        # While the session is open its reservation blocks the stitch until it expires
+        blocked = client.post('/stitch', json=body)
+        assert blocked.status_code == 503
+        assert 25 <= int(blocked.headers['Retry-After']) <= 30
+        
+        app.sessions[session_id].last_used -= 31
+        admitted = client.post('/stitch', json=body)
+        assert admitted.status_code == 200
+        assert session_id not in app.sessions
+        assert app.admission.reserved() == 0
+    finally:
+        client.delete(f'/sessions/{session_id}')
+
+def test_result_lookup_head_and_etag_round_trip(client):
+    images = capture_images()
+    stitched = client.post('/stitch', json={'images': images})
+    key = stitched.json['cacheKey']
+    assert stitched.headers['ETag'] == f'"{key}"'
+    
+    digests = [hashlib.sha256(base64.b64decode(image['data'].split(',')[1])).hexdigest() for image in images]
+    lookup = client.post('/results/lookup', json={'images': [
+        {'sha256': digest, 'azimuth': image['azimuth'], 'elevation': image['elevation']}
+        for digest, image in zip(digests, images)]})
+    assert lookup.status_code == 200
+    assert lookup.json['cacheKey'] == key
+    assert lookup.json['quality'] == stitched.json['quality']
+    assert lookup.json['cached'] is True
+    
+    head = client.head(f'/results/{key}')
+    assert head.status_code == 200 and head.data == b''
+    assert head.headers['ETag'] == f'"{key}"'
+    assert client.get(f'/results/{key}', headers={'If-None-Match': f'"{key}"'}).status_code == 304
+    assert client.head(f'/results/{"0" * 64}').status_code == 404
+    assert client.post('/results/lookup', json={'images': [{'azimuth': 0}]}).status_code == 400
+
+def multipart_body(images: list, manifest) -> dict:
+    files = [(io.BytesIO(base64.b64decode(image['data'].split(',')[1])), f'{index}.jpg')
+             for index, image in enumerate(images)]
+    return {'images': files, 'manifest': manifest if isinstance(manifest, str) else json.dumps(manifest)}
+
+def test_multipart_stitch_matches_json(client):
+    images = capture_images()
+    manifest = {'images': [{'azimuth': image['azimuth'], 'elevation': image['elevation']} for image in images],
+                'quality': 'preview'}
+    multipart = client.post('/stitch', data=multipart_body(images, manifest), content_type='multipart/form-data')
+    assert multipart.status_code == 200 and multipart.json['success']
+    assert multipart.json['quality'] == 'preview' and multipart.json['imageCount'] == len(images)
+    
+    # Same bytes and poses, same cache entry
+    as_json = client.post('/stitch', json={'images': images, 'quality': 'preview'})
+    assert as_json.json['cacheKey'] == multipart.json['cacheKey']
+    assert as_json.json['cached'] is True
+
+@pytest.mark.parametrize('manifest', [
+    {'images': [1, 2, 3, 4]},
+    {'images': [{'azimuth': 0}, None, {'azimuth': 180}, {'azimuth': 270}]},
+    {'images': [{'azimuth': 'north'}, {}, {}, {}]},
+    {'images': {'azimuth': 0}},
+    {'images': [{}, {}]},  # fewer poses than images
+    [],
+    '{not json',
+])
+def test_malformed_manifest_is_rejected(client, manifest):
+    response = client.post('/stitch', data=multipart_body(capture_images(), manifest),
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert response.json['success'] is False
+
+@pytest.mark.parametrize('body', [{'images': [{'azimuth': 0}, {'azimuth': 90}]}, {'images': ['a', 'b']}, [1, 2]])
+def test_malformed_json_images_are_rejected(client, body):
+    response = client.post('/stitch', json=body)
+    assert response.status_code == 400
+    assert response.json['success'] is False
+
+def test_jobs_are_checked_at_submit(client, monkeypatch):
+    monkeypatch.setattr(app, 'jobs', {})
+    images = capture_images()
+    for options in ({'blend': 'smudge'}, {'gapFill': 'none'}, {'quality': 'huge'}, {'outputs': [{'format': 'bmp'}]}):
+        invalid = client.post('/jobs', json={'images': images, **options})
+        assert invalid.status_code == 400, options
+    assert app.jobs == {}
+    
+    # The queued payload is charged against the memory budget
+    monkeypatch.setattr(app, 'admission', app.StitchAdmission(2, 1024))
+    assert client.post('/jobs', json={'images': images}).status_code == 413
+    
+    monkeypatch.setattr(app, 'MAX_PENDING_JOBS', 0)
+    full = client.post('/jobs', json={'images': images})
+    assert full.status_code == 429 and 'Retry-After' in full.headers
+    assert app.jobs == {}
+
+def test_job_reservation_is_handed_to_the_stitch(client, monkeypatch):
+    monkeypatch.setattr(app, 'jobs', {})
+    monkeypatch.setattr(app, 'admission', app.StitchAdmission(2, 1024 * 1024 * 1024))
+    accepted = client.post('/jobs', json={'images': capture_images(), 'quality': 'preview'})
+    assert accepted.status_code == 202
+    job = app.jobs[accepted.json['jobId']]
+    deadline = time.time() + 60
+    while job.finished is None and time.time() < deadline:
+        time.sleep(0.05)
+    assert job.status == 'done', job.error
+    assert app.admission.reserved() == 0
+
+# Small rig with cameras on both sides of the ±180° seam and one near the pole
+SEAM_RIG = [(0, 0), (35, 10), (180, 0), (-160, 5), (160, -5), (-150, -20), (90, 80)]
+
+def rig_images(poses, size=(240, 180)) -> list:
+    rng = np.random.default_rng(3)
+    return [cv2.GaussianBlur(rng.integers(0, 256, (*size, 3), dtype=np.uint8), (0, 0), 2) for _ in poses]
+
+def test_coverage_map_matches_projection_weights(monkeypatch, width=512, height=256):
+    monkeypatch.setattr(app, 'projection_cache', app.ProjectionCache(64 * 1024 * 1024))
+    images = rig_images(SEAM_RIG)
+    azimuths, elevations = zip(*SEAM_RIG)
+    
+    # Dense reference: cameras whose feather weight is positive at each pixel
+    expected = np.zeros((height, width), dtype=np.uint8)
+    cold = app.coverage_map(images, azimuths, elevations, width, height)
+    for img, img_az, img_el in zip(images, azimuths, elevations):
+        single = app.EquirectAccumulator(width, height)
+        single.add(img, img_az, img_el)
+        expected += single.weights > 0
+    warm = app.coverage_map(images, azimuths, elevations, width, height)
+    
+    np.testing.assert_array_equal(cold, expected)
+    np.testing.assert_array_equal(warm, expected)
+    # The seam cameras overlap across the canvas edge
+    assert expected[:, 0].max() > 1 and expected[:, -1].max() > 1
+
+def test_seam_accumulator_matches_dense_feather(monkeypatch, width=512, height=256):
+    monkeypatch.setattr(app, 'projection_cache', app.ProjectionCache(64 * 1024 * 1024))
+    images = rig_images(SEAM_RIG)
+    azimuths, elevations = zip(*SEAM_RIG)
+    coverage = app.coverage_map(images, azimuths, elevations, width, height)
+    
+    dense = app.EquirectAccumulator(width, height)
+    seams = app.SeamAccumulator(coverage)
+    for img, img_az, img_el in zip(images, azimuths, elevations):
+        assert dense.add(img, img_az, img_el) == seams.add(img, img_az, img_el)
+    expected, result = dense.finish(), seams.finish()
+    
+    # Covered pixels only differ by the float round trip the dense canvas truncates
+    diff = np.abs(expected.astype(np.int16) - result)
+    assert diff[coverage > 0].max() <= 1
+    assert diff[coverage > 1].max() <= 1
+    # Gaps are filled from those pixels, so they stay close too
+    assert diff[coverage == 0].max() <= 3
+
+@pytest.mark.parametrize('blend', app.BLEND_MODES)
+def test_strips_match_whole_canvas(blend, monkeypatch, width=1024, height=512):
+    images = rig_images(SEAM_RIG)
+    azimuths, elevations = zip(*SEAM_RIG)
+    whole = app.EquirectAccumulator(width, height, blend)
+    for img, img_az, img_el in zip(images, azimuths, elevations):
+        whole.add(img, img_az, img_el)
+    expected = whole.finish()
+    
+    monkeypatch.setattr(app, 'MAX_STITCH_MEMORY_MB', 1)
+    assert len(app.plan_strips(width, height, blend)) > 1
+    np.testing.assert_array_equal(app.stitch_equirectangular(images, azimuths, elevations, width, height, blend),
+                                  expected)
+
+def smooth_panorama(width: int = 512, height: int = 256) -> np.ndarray:
+    """Gradients that are continuous across the ±180° seam"""
+    lon = np.linspace(0, 2 * np.pi, width, endpoint=False)[np.newaxis, :]
+    lat = np.linspace(0, 1, height)[:, np.newaxis]
+    channels = np.broadcast_arrays(100 + 80 * np.cos(lon), 120 + 60 * lat, 100 + 50 * np.sin(lon) * lat)
+    return np.stack(channels, axis=-1).astype(np.uint8)
+
+@pytest.mark.parametrize('mode, tolerance', [('fast', 4), ('pushpull', 4), ('telea', 12)])
+def test_fill_gaps_modes(mode, tolerance):
+    expected = smooth_panorama()
+    mask = np.ones(expected.shape[:2], dtype=bool)
+    mask[:10] = False  # zenith cap
+    mask[60:63, 200:210] = False  # crack
+    mask[100:140, :20] = mask[100:140, -20:] = False  # region wrapping the seam
+    result = expected.copy()
+    result[~mask] = 0
+    
+    filled = app.fill_gaps(result, mask, mode=mode)
+    diff = np.abs(filled.astype(np.int16) - expected)
+    assert diff[mask].max() == 0
+    assert diff[~mask].max() <= tolerance
+    # Both halves of the seam region are filled from the same (wrapped) surroundings
+    assert np.abs(filled[100:140, 0].astype(np.int16) - filled[100:140, -1]).max() <= tolerance
+
+@pytest.mark.parametrize('known', [
+    np.array([[True, False, True, False, False]]),  # a single row can't be reduced
+    np.zeros((1, 1), dtype=bool),
+    np.zeros((4, 4), dtype=bool),
+    np.ones((4, 4), dtype=bool),
+])
+def test_push_pull_fill_degenerate_inputs(known):
+    img = np.full((*known.shape, 3), 90, dtype=np.uint8)
+    filled = app.push_pull_fill(img, known)
+    assert filled.shape == img.shape
+    np.testing.assert_array_equal(filled, np.where(known.any(), 90, 0))
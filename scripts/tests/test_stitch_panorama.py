@@ -0,0 +1,108 @@
+import io
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+import benchmark_stitch
+import stitch_panorama
+
+def serve(worker, *requests) -> list:
+    writer = io.StringIO()
+    worker.serve_stream(io.StringIO(''.join(json.dumps(r) + '\n' for r in requests)), writer)
+    return [json.loads(line) for line in writer.getvalue().splitlines()]
+
+def test_commands_are_not_counted_in_flight():
+    worker = stitch_panorama.StitchWorker(concurrency=1)
+    ready, ping, unknown, ping_again = serve(worker, {'id': 1, 'command': 'ping'},
+                                             {'id': 2, 'command': 'status'}, {'id': 3, 'command': 'ping'})
+    assert ready['inFlight'] == ping['inFlight'] == ping_again['inFlight'] == 0
+    assert ping['id'] == 1 and ping['event'] == 'ready'
+    assert unknown == {'id': 2, 'success': False, 'error': "Unknown command 'status'"}
+    assert worker.in_flight == 0
+
+# Camera poses (azimuth, elevation) covering the seam at +-180 degrees and both poles
+PARITY_POSES = [(0, 0), (30, 20), (179, 0), (-170, 10), (350, -60), (90, 85), (200, -88)]
+
+@pytest.mark.parametrize('img_az, img_el', PARITY_POSES)
+def test_array_projection_matches_scalar(img_az, img_el, h_fov=55, v_fov=75, img_w=1080, img_h=1440,
+                                         out_width=4096, out_height=2048, step=13, tolerance=0.01):
+    """
+    project_directions agrees with the scalar project_to_image on a sampled pixel grid.
+    Points within float rounding of the FOV boundary may disagree on validity
+    """
+    out_az, out_el = stitch_panorama.equirect_angle_grid(out_width, out_height)
+    out_az = out_az[::step, ::step]
+    out_el = out_el[::step, ::step]
+    dir_x, dir_y, dir_z = (d[::step, ::step] for d in stitch_panorama.equirect_direction_grid(out_width, out_height))
+    map_x, map_y, valid = stitch_panorama.project_directions(dir_x, dir_y, dir_z, img_az, img_el, h_fov, v_fov,
+                                                             img_w, img_h)
+    
+    checked = 0
+    for (r, c), az in np.ndenumerate(out_az):
+        expected = stitch_panorama.project_to_image(az, out_el[r, c], img_az, img_el, h_fov, v_fov, img_w, img_h)
+        if (expected is not None) != bool(valid[r, c]):
+            # Only acceptable right on the image border
+            sx, sy = map_x[r, c], map_y[r, c]
+            assert min(sx, img_w - 1 - sx, sy, img_h - 1 - sy) < tolerance, (r, c)
+        elif expected is not None:
+            checked += 1
+            assert abs(expected[0] - map_x[r, c]) < tolerance and abs(expected[1] - map_y[r, c]) < tolerance, (r, c)
+    assert checked > 0
+
+def angle_between(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.degrees(np.arccos(np.clip(np.dot(a, b), -1, 1))))
+
+def test_seeded_refinement_recovers_perturbed_pose(h_fov=55, v_fov=75, tolerance=1.5):
+    """A camera whose sensor pose is a few degrees off is pulled back by its overlapping neighbours"""
+    scene = benchmark_stitch.make_scene(4096, 2048)
+    poses = [(az, 0) for az in range(0, 360, 30)]
+    views = [benchmark_stitch.render_view(scene, az, el, h_fov, v_fov, 1080, 1440, 'gnomonic') for az, el in poses]
+    azimuths = [float(az) for az, _ in poses]
+    elevations = [float(el) for _, el in poses]
+    azimuths[2] += 4
+    elevations[2] -= 2
+    
+    bases, _, _, report = stitch_panorama.refine_poses(views, azimuths, elevations, h_fov, v_fov)
+    assert 'skipped' not in report and report['refined'] >= 2
+    truth = [stitch_panorama.camera_basis(az, el)[0] for az, el in poses]
+    sensor_error = angle_between(stitch_panorama.camera_basis(azimuths[2], elevations[2])[0], truth[2])
+    assert sensor_error > 4
+    assert angle_between(bases[2][0], truth[2]) < min(tolerance, sensor_error / 2)
+    # The correction must not pull the accurate cameras away from their true poses
+    assert all(angle_between(basis[0], fwd) < tolerance for basis, fwd in zip(bases, truth))
+
+def write_capture_set(directory, seed: int, count: int = 4):
+    directory.mkdir(parents=True)
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        img = cv2.GaussianBlur(rng.integers(0, 256, (320, 240, 3), dtype=np.uint8), (0, 0), 3)
+        cv2.imwrite(str(directory / f'IMG_{i}.jpg'), img)
+        (directory / f'IMG_{i}.json').write_text(json.dumps({'azimuth': i * 90, 'elevation': 0}))
+
+def test_batch_resume_restitches_only_changed_and_unfinished_sets(tmp_path, capsys):
+    source, output = tmp_path / 'captures', tmp_path / 'out'
+    for seed, name in enumerate(('a', 'b', 'c')):
+        write_capture_set(source / name, seed)
+    assert stitch_panorama.run_batch(str(source), str(output), jobs=1, mode='direct')
+    assert 'Batch: 3 capture sets, 0 already done, 3 to stitch' in capsys.readouterr().err
+    
+    # Interrupted before 'c' was recorded, and one image of 'b' changed since
+    progress_path = output / stitch_panorama.BATCH_PROGRESS_FILE
+    progress = json.loads(progress_path.read_text())
+    del progress['sets']['c']
+    progress_path.write_text(json.dumps(progress))
+    cv2.imwrite(str(source / 'b' / 'IMG_2.jpg'), np.full((320, 240, 3), 128, dtype=np.uint8))
+    written = {name: (output / f'{name}.jpg').stat().st_mtime_ns for name in ('a', 'b', 'c')}
+    
+    assert stitch_panorama.run_batch(str(source), str(output), jobs=1, mode='direct')
+    log = capsys.readouterr().err
+    assert 'Batch: 3 capture sets, 1 already done, 2 to stitch' in log
+    assert ' b: done' in log and ' c: done' in log and ' a: ' not in log
+    assert (output / 'a.jpg').stat().st_mtime_ns == written['a']
+    assert set(json.loads(progress_path.read_text())['sets']) == {'a', 'b', 'c'}
+    
+    # Nothing left to do
+    assert stitch_panorama.run_batch(str(source), str(output), jobs=1, mode='direct')
+    assert 'Batch: 3 capture sets, 3 already done, 0 to stitch' in capsys.readouterr().err
@@ -422,6 +422,7 @@ export default function HDRIGenerationPage() {
   const [isCameraReady, setIsCameraReady] = useState(false);
   const [isGenerating, setIsGenerating] = useState(false);
   const [generatedHDRI, setGeneratedHDRI] = useState<string | null>(null);
+  const [generatedSize, setGeneratedSize] = useState<string | null>(null); // e.g. "standard, 2048×1024"
   const [error, setError] = useState<string | null>(null);
   const [pageUrl, setPageUrl] = useState('');
   const [debugLogs, setDebugLogs] = useState<string[]>([]);
@@ -432,7 +433,14 @@ export default function HDRIGenerationPage() {
     const timestamp = new Date().toLocaleTimeString();
     setDebugLogs(prev => [...prev, `[${timestamp}] ${message}`]);
   };
-  
+
+  // Panoramas returned as raw JPEG are held in object URLs; release the previous one
+  useEffect(() => {
+    return () => {
+      if (generatedHDRI?.startsWith('blob:')) URL.revokeObjectURL(generatedHDRI);
+    };
+  }, [generatedHDRI]);
+
   const [orientation, setOrientation] = useState<DeviceOrientation>({ alpha: 0, beta: 0, gamma: 0 });
   const [screenOrientation, setScreenOrientation] = useState(0);
   const [hasOrientationPermission, setHasOrientationPermission] = useState(false);
@@ -1218,16 +1226,27 @@ export default function HDRIGenerationPage() {
             }))
           );
           
+          // Ask for the raw JPEG (no base64 data URL); errors still come back as JSON
           const response = await fetch(`${OPENCV_API}/stitch`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', Accept: 'image/jpeg' },
             body: JSON.stringify({ images: imagesData }),
           });
           
+          if (response.headers.get('Content-Type')?.startsWith('image/jpeg')) {
+            const panorama = URL.createObjectURL(await response.blob());
+            addDebugLog(`OpenCV stitching complete! (${response.headers.get('X-Stitch-Method')})`);
+            // The server picks the quality tier (auto), so show the size it rendered
+            setGeneratedSize(`${response.headers.get('X-Stitch-Quality')}, ${response.headers.get('X-Stitch-Width')}×${response.headers.get('X-Stitch-Height')}`);
+            setGeneratedHDRI(panorama);
+            return;
+          }
+          
           const result = await response.json();
           
           if (result.success && result.panorama) {
             addDebugLog(`OpenCV stitching complete! (${result.method})`);
+            setGeneratedSize(`${result.quality}, ${result.width}×${result.height}`);
             setGeneratedHDRI(result.panorama);
             return;
           }
@@ -1244,6 +1263,7 @@ export default function HDRIGenerationPage() {
       const panoramaUrl = await stitchEquirectangular();
       
       addDebugLog('Panorama stitching complete!');
+      setGeneratedSize('4096×2048');
       setGeneratedHDRI(panoramaUrl);
       
     } catch (err) {
@@ -1828,7 +1848,7 @@ export default function HDRIGenerationPage() {
             )}
             
             <p className="text-sm text-gray-500 mb-4">
-              Equirectangular panorama (4096×2048) - Use in 3D software or panorama viewers
+              Equirectangular panorama{generatedSize && ` (${generatedSize})`} - Use in 3D software or panorama viewers
             </p>
             
             <div className="flex gap-3">
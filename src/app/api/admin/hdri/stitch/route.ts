@@ -1,10 +1,14 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { spawn } from 'child_process';
 import path from 'path';
+import { stitchWorkerPool, STITCH_POOL_SIZE, StitchResult } from '@/lib/stitch-worker-pool';
 
 export const maxDuration = 120; // 2 minutes for stitching
 export const dynamic = 'force-dynamic';
 
+// A pooled worker gets half of maxDuration, so a process of its own still has time if it's stuck
+const POOL_TIMEOUT_MS = (maxDuration * 1000) / 2;
+
 interface ImageData {
   data: string; // base64 image data
   azimuth: number;
@@ -13,12 +17,8 @@ interface ImageData {
 
 interface StitchRequest {
   images: ImageData[];
-}
-
-interface StitchResult {
-  success: boolean;
-  panorama?: string;
-  error?: string;
+  mode?: 'seeded' | 'stitcher' | 'direct'; // this route defaults to 'seeded' (sensor-pose-seeded registration)
+  timeBudget?: number; // seconds allowed for pose refinement before projecting with the sensor poses
 }
 
 /**
@@ -38,8 +38,8 @@ export async function POST(request: NextRequest) {
 
     console.log(`[HDRI Stitch] Processing ${body.images.length} images...`);
 
-    // Call Python script
-    const result = await runPythonStitcher(body);
+    // Call Python script; the script itself still defaults to cv2.Stitcher
+    const result = await runPythonStitcher({ ...body, mode: body.mode ?? 'seeded' });
 
     if (result.success) {
       console.log('[HDRI Stitch] Success!');
@@ -59,9 +59,24 @@ export async function POST(request: NextRequest) {
 }
 
 /**
- * Run the Python stitching script
+ * Run the Python stitching script on a pooled worker, or in a process of its own
+ * if the pool is disabled, no worker can be started, or the worker dies or times out
  */
 async function runPythonStitcher(input: StitchRequest): Promise<StitchResult> {
+  if (STITCH_POOL_SIZE > 0) {
+    try {
+      return await stitchWorkerPool.stitch(input, POOL_TIMEOUT_MS);
+    } catch (error) {
+      console.log('[HDRI Stitch] Worker pool unavailable, spawning a process:', error instanceof Error ? error.message : error);
+    }
+  }
+  return runPythonStitcherOnce(input);
+}
+
+/**
+ * Run the Python stitching script once for this request
+ */
+async function runPythonStitcherOnce(input: StitchRequest): Promise<StitchResult> {
   return new Promise((resolve) => {
     const scriptPath = path.join(process.cwd(), 'scripts', 'stitch_panorama.py');
     
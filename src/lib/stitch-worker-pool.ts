@@ -0,0 +1,174 @@
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import path from 'path';
+import readline from 'readline';
+
+// Pool of long-lived `stitch_panorama.py --serve` workers, so stitch requests don't pay
+// Python start-up, the cv2/NumPy import and lookup-table building every time.
+// HDRI_STITCH_WORKERS sets the pool size (0 disables the pool).
+
+export const STITCH_POOL_SIZE = Number(process.env.HDRI_STITCH_WORKERS ?? 2);
+const PYTHON_COMMANDS = ['python', 'python3', 'py'];
+const READY_TIMEOUT_MS = 60_000;
+const REQUEST_TIMEOUT_MS = 120_000;
+
+export interface StitchResult {
+  success: boolean;
+  panorama?: string;
+  error?: string;
+  registration?: Record<string, unknown>;
+}
+
+class StitchWorker {
+  readonly ready: Promise<void>;
+  alive = true;
+  private process: ChildProcessWithoutNullStreams;
+  private pending = new Map<number, { resolve: (result: StitchResult) => void; reject: (error: Error) => void }>();
+  private nextId = 1;
+
+  constructor(command: string, scriptPath: string) {
+    this.process = spawn(command, [scriptPath, '--serve', '--concurrency', '1'], {
+      stdio: ['pipe', 'pipe', 'pipe'],
+      env: { ...process.env },
+    });
+
+    this.ready = new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        reject(new Error(`${command} worker not ready after ${READY_TIMEOUT_MS / 1000}s`));
+        this.process.kill();
+      }, READY_TIMEOUT_MS);
+
+      // One JSON document per line: the ready event first, then responses tagged with our ids
+      readline.createInterface({ input: this.process.stdout }).on('line', (line) => {
+        let message: { id?: number; event?: string } & StitchResult;
+        try {
+          message = JSON.parse(line);
+        } catch {
+          console.log('[Python worker] Unexpected output:', line.substring(0, 200));
+          return;
+        }
+        if (message.event === 'ready' && message.id === undefined) {
+          clearTimeout(timer);
+          resolve();
+          return;
+        }
+        const request = message.id !== undefined ? this.pending.get(message.id) : undefined;
+        if (request) {
+          this.pending.delete(message.id!);
+          request.resolve(message);
+        }
+      });
+
+      this.process.on('error', (err) => {
+        clearTimeout(timer);
+        reject(err);
+      });
+
+      this.process.on('exit', (code) => {
+        clearTimeout(timer);
+        reject(new Error(`${command} worker exited with code ${code}`));
+        this.fail(new Error(`Stitch worker exited with code ${code}`));
+      });
+    });
+    // A worker that dies between dispatch and write fails the write with EPIPE; unhandled, that
+    // stream error would take down the server
+    this.process.stdin.on('error', (err) => {
+      this.fail(new Error(`Stitch worker input closed: ${err.message}`));
+      this.process.kill();
+    });
+    // Rejections are handled by whoever awaits `ready`; don't report them as unhandled
+    this.ready.catch(() => {});
+
+    this.process.stderr.on('data', (data) => {
+      console.log('[Python]', data.toString());
+    });
+  }
+
+  get load(): number {
+    return this.pending.size;
+  }
+
+  request(input: object, timeoutMs = REQUEST_TIMEOUT_MS): Promise<StitchResult> {
+    const id = this.nextId++;
+    return new Promise((resolve, reject) => {
+      // A worker that doesn't answer in time is stuck: kill it (failing its other requests too), and
+      // the pool starts a fresh one for the next request
+      const timer = setTimeout(() => {
+        this.fail(new Error(`Stitch worker gave no answer within ${timeoutMs / 1000}s`));
+        this.process.kill('SIGKILL');
+      }, timeoutMs);
+      this.pending.set(id, {
+        resolve: (result) => {
+          clearTimeout(timer);
+          resolve(result);
+        },
+        reject: (error) => {
+          clearTimeout(timer);
+          reject(error);
+        },
+      });
+      this.process.stdin.write(JSON.stringify({ ...input, id }) + '\n');
+    });
+  }
+
+  // Mark the worker dead and reject its pending requests, so callers fall back to a process of their own
+  private fail(error: Error) {
+    this.alive = false;
+    for (const request of this.pending.values()) {
+      request.reject(error);
+    }
+    this.pending.clear();
+  }
+}
+
+class StitchWorkerPool {
+  private workers: StitchWorker[] = [];
+  private starting: Promise<StitchWorker> | null = null;
+  private command: string | null = null;
+  private scriptPath = path.join(process.cwd(), 'scripts', 'stitch_panorama.py');
+
+  // An idle worker, a new one while the pool isn't full, otherwise the least loaded. The choice is
+  // made synchronously, so concurrent calls see each other's requests in the workers' load.
+  // Rejects if the worker gives no answer within timeoutMs (start-up not included)
+  stitch(input: object, timeoutMs = REQUEST_TIMEOUT_MS): Promise<StitchResult> {
+    this.workers = this.workers.filter((worker) => worker.alive);
+    const idle = this.workers.find((worker) => worker.load === 0);
+    if (idle) {
+      return idle.request(input, timeoutMs);
+    }
+    if (this.workers.length < STITCH_POOL_SIZE) {
+      // Requests arriving meanwhile share the start-up instead of starting more workers
+      this.starting ??= this.start().finally(() => {
+        this.starting = null;
+      });
+      return this.starting.then((worker) => worker.request(input, timeoutMs));
+    }
+    return this.workers.reduce((a, b) => (b.load < a.load ? b : a)).request(input, timeoutMs);
+  }
+
+  // Start a worker and add it to the pool once ready, finding a working Python command the first time
+  private async start(): Promise<StitchWorker> {
+    const commands = this.command ? [this.command] : PYTHON_COMMANDS;
+    let lastError: unknown = null;
+    for (const command of commands) {
+      const worker = new StitchWorker(command, this.scriptPath);
+      try {
+        await worker.ready;
+      } catch (error) {
+        console.log(`[HDRI Stitch] ${command} worker failed:`, error instanceof Error ? error.message : error);
+        lastError = error;
+        continue;
+      }
+      this.command = command;
+      this.workers.push(worker);
+      console.log(`[HDRI Stitch] Started ${command} worker (${this.workers.length}/${STITCH_POOL_SIZE})`);
+      return worker;
+    }
+    throw lastError ?? new Error('No Python worker could be started');
+  }
+}
+
+// Keep one pool per server process, also across dev-mode module reloads
+const globalForStitch = globalThis as unknown as { stitchWorkerPool?: StitchWorkerPool };
+
+export const stitchWorkerPool = globalForStitch.stitchWorkerPool ?? new StitchWorkerPool();
+globalForStitch.stitchWorkerPool = stitchWorkerPool;